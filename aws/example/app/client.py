@@ -1,14 +1,36 @@
-import datetime
 import logging
+import os
 import sys
 import time
 
-import boto3
 import gevent
 from locust.env import Environment
+from locust.runners import WORKER_REPORT_INTERVAL
 from locust.stats import HISTORY_STATS_INTERVAL_SEC
 from locust.stats import stats_printer
 
+from cluster import MasterLiveness
+from cluster import WorkerBarrier
+from dataset import forget_datasets
+from histogram import LatencyHistogram
+from histogram import percentile_fraction
+from history import HISTORY_SIZE
+from history import LatencyWindows
+from history import StageMetrics
+from history import StatsHistory
+from omission import recorder
+from pacing import pacer
+from saturation import BalancedMasterRunner
+from saturation import CPU_THRESHOLD
+from saturation import LAG_THRESHOLD_MS
+from saturation import SaturationMonitor
+import services
+from sink import EndpointDeltas
+from startup import startup
+from traffic import forget_plans
+
+POOL_STOP_TIMEOUT = 60
+
 
 class DistributedClient:
     def __init__(
@@ -24,6 +46,17 @@ class DistributedClient:
         master_fargate_task=None,
         max_runtime=None,
         region="ap-southeast-1",
+        history_size=HISTORY_SIZE,
+        report_window=60,
+        worker_quorum=1.0,
+        min_workers=1,
+        ready_timeout=None,
+        heartbeat_interval=1,
+        heartbeat_misses=5,
+        sink=None,
+        saturation_cpu=CPU_THRESHOLD,
+        saturation_lag_ms=LAG_THRESHOLD_MS,
+        rebalance_saturated=False,
     ):
         node_type = node_type.lower()
         if node_type not in ["worker", "master", "local"]:
@@ -35,25 +68,68 @@ class DistributedClient:
         self.env.host = host
         self.max_runtime = max_runtime
         self.node_type = node_type
-        self.ecs = boto3.client("ecs", region_name=region)
+        self.heartbeat_interval = float(heartbeat_interval)
+        self.sink = sink
+        self.endpoint_deltas = EndpointDeltas()
+        self.saturation = SaturationMonitor(
+            saturation_cpu, saturation_lag_ms, rebalance_saturated
+        )
 
         if node_type == "worker":
             self.env.create_worker_runner(master_host, master_port)
             self.master_fargate_task = master_fargate_task
+            self.liveness = MasterLiveness(
+                heartbeat_interval,
+                heartbeat_misses,
+                (
+                    lambda: master_stopped(
+                        services.client("ecs", region), master_fargate_task
+                    )
+                )
+                if master_fargate_task
+                else None,
+            )
+            self.env.runner.register_message(
+                "master_heartbeat", self.liveness.on_heartbeat
+            )
+            self.env.runner.register_message("pool_job", self.on_pool_job)
+            self.env.runner.send_message("worker_ready")
         else:
             if node_type == "master":
-                self.env.create_master_runner(master_host, master_port)
+                self.env.runner = BalancedMasterRunner(
+                    self.env, master_host, master_port
+                )
+                self.env.runner.monitor = self.saturation
                 self.expected_workers = int(expected_workers)
+                self.barrier = WorkerBarrier(
+                    self.expected_workers, worker_quorum, min_workers, ready_timeout
+                )
+                self.env.runner.register_message("worker_ready", self.on_worker_ready)
+                self.env.runner.greenlet.spawn(self.send_heartbeats)
             if node_type == "local":
                 self.env.create_local_runner()
 
             self.stages_shape.runner = self.env.runner
             self.percentiles = percentiles.split(",")
+            self.history = StatsHistory(self.percentiles, capacity=history_size)
+            self.windows = LatencyWindows(self.percentiles, duration=report_window)
+            self.previous_histogram = LatencyHistogram()
+            self.previous_failures = 0
+            self.watch_stages()
+
+        pacer.register(self.env, node_type)
+        recorder.register(self.env, node_type)
+        self.saturation.register(self.env, node_type)
+        if node_type != "master":
+            startup.register(self.env)
+        startup.mark("runner")
 
     def start_master(self):
-        """Wait for all worker nodes to connect and start the load testing"""
-        while len(self.env.runner.clients.ready) < self.expected_workers:
-            time.sleep(1)
+        """Wait for enough worker nodes to connect and start the load testing"""
+        if not self.barrier.wait():
+            self.env.runner.quit()
+            sys.exit(1)
+        startup.mark("workers_ready")
         gevent.spawn(stats_printer(self.env.stats))
         gevent.spawn(self.stats_history, self.env.runner, self.percentiles)
         self.env.runner.start_shape()
@@ -62,15 +138,85 @@ class DistributedClient:
         )
         self.save_results(self.percentiles)
 
-    def start_worker(self):
-        """Start a worker node if a master node exists and wait for the task to complete"""
-        if self.master_fargate_task:
-            gevent.spawn_later(
-                20,
-                self._master_status(
-                    self.env, self.max_runtime, self.master_fargate_task
-                ),
+    def on_worker_ready(self, environment, msg, **kwargs):
+        """A worker connected. Late workers also need the current pacing of rps stages"""
+        self.barrier.add(msg.node_id)
+        if self.stages_shape.pacing_interval is not None:
+            self.env.runner.send_message(
+                "pacing",
+                {"interval": self.stages_shape.pacing_interval},
+                client_id=msg.node_id,
             )
+
+    def send_heartbeats(self):
+        """Broadcast heartbeats to the workers, so they exit quickly if the master dies"""
+        while True:
+            self.env.runner.send_message("master_heartbeat")
+            gevent.sleep(self.heartbeat_interval)
+
+    def run_job(self, stages_shape, environment, job_id=None):
+        """
+        Run a shape on the connected workers without restarting them (warm pool), and wait until they stop.
+        Workers set the environment variables of the job before spawning its users
+        """
+        self.env.runner.send_message("pool_job", environment)
+        os.environ.update(environment)
+        self.stages_shape = stages_shape
+        self.stages_shape.runner = self.env.runner
+        self.env.shape_class = stages_shape
+        self.env.runner.shape_greenlet = None
+        self.env.runner.shape_last_state = None
+        self.reset_stats(job_id)
+        self.env.runner.start_shape()
+        self.wait_for_end(
+            self.env, stages_shape, self.max_runtime, end=self.env.runner.stop
+        )
+        deadline = time.time() + POOL_STOP_TIMEOUT
+        while self.env.runner.state != "stopped":
+            if time.time() > deadline:
+                logging.warning("Workers did not all report stopped")
+                break
+            gevent.sleep(1)
+        # Workers only send their stats periodically, wait for the last requests of the job
+        gevent.sleep(WORKER_REPORT_INTERVAL)
+
+    def reset_stats(self, job_id=None):
+        """Start the next job of a warm pool from empty stats and history"""
+        self.env.stats.reset_all()
+        self.env.runner.exceptions = {}
+        self.history = StatsHistory(self.percentiles, capacity=self.history.capacity)
+        self.windows = LatencyWindows(self.percentiles, duration=self.windows.duration)
+        self.previous_histogram = LatencyHistogram()
+        self.previous_failures = 0
+        self.watch_stages()
+        self.endpoint_deltas = EndpointDeltas()
+        self.saturation.reset()
+        recorder.reset()
+        if self.sink is not None:
+            self.sink.restart(job_id)
+        pacer.reset()
+
+    def watch_stages(self):
+        """Measure the steady window of each stage of the current shape"""
+        self.stage_metrics = StageMetrics(
+            self.percentiles, self.env.stats, self.stages_shape.stages
+        )
+        self.stages_shape.stage_events.add_listener(self.stage_metrics.on_stage)
+
+    def on_pool_job(self, environment, msg, **kwargs):
+        """Settings of the next job of a warm pool, read by the users spawned for it"""
+        os.environ.update(msg.data)
+        forget_plans(
+            forget_datasets(
+                msg.data["TEST_DATASET_BUCKET"], msg.data["TEST_DATASET_KEY"]
+            )
+        )
+        pacer.reset()
+        recorder.reset()
+
+    def start_worker(self):
+        """Start a worker node and wait for the task to complete, or for the master node to be lost"""
+        gevent.spawn(self.liveness.watch, self.env.runner.quit, self.max_runtime)
         self.env.runner.greenlet.join()
 
     def start_local(self):
@@ -84,60 +230,84 @@ class DistributedClient:
         self.save_results(self.percentiles)
 
     def stats_history(self, runner, percentiles=["50", "95"]):
-        """Save current stats info to history for charts of report."""
+        """
+        Save current stats info to history for charts of report.
+        Percentiles are computed once per interval from the histogram of the requests completed since the previous one.
+        Intervals where workers were saturated have saturated_workers > 0
+        """
+        fractions = [percentile_fraction(p) for p in percentiles]
         while True:
             stats = runner.stats
-            if not stats.total.use_response_times_cache:
-                break
+            now = time.time()
+            interval, failures = self.interval_stats()
+            load = self.saturation.collect()
             if runner.state != "stopped":
-                r = {
-                    "time": datetime.datetime.now().strftime("%H:%M:%S"),
-                    "current_rps": stats.total.current_rps or 0,
-                    "current_fail_per_sec": stats.total.current_fail_per_sec or 0,
-                    "user_count": runner.user_count or 0,
-                }
-                for percentile in percentiles:
-                    pvalue = float(percentile) / (10 ** len(percentile))
-                    r[f"response_time_percentile_{percentile}"] = (
-                        stats.total.get_current_response_time_percentile(pvalue) or 0
+                values = interval.percentiles(fractions)
+                self.windows.add(now, interval, failures)
+                self.history.append(
+                    time=now,
+                    current_rps=stats.total.current_rps,
+                    current_fail_per_sec=stats.total.current_fail_per_sec,
+                    user_count=runner.user_count,
+                    **{
+                        f"response_time_percentile_{p}": v
+                        for p, v in zip(percentiles, values)
+                    },
+                    **load,
+                )
+                if self.sink is not None:
+                    self.sink.offer(
+                        {
+                            "time": now,
+                            "user_count": runner.user_count,
+                            "num_requests": interval.total,
+                            "num_failures": failures,
+                            **{
+                                f"response_time_percentile_{p}": v
+                                for p, v in zip(percentiles, values)
+                            },
+                            "endpoints": self.endpoint_deltas.collect(stats),
+                            "saturated_workers": load["saturated_workers"],
+                        }
                     )
-                stats.history.append(r)
             gevent.sleep(HISTORY_STATS_INTERVAL_SEC)
 
-    def wait_for_end(self, env, stages_shape, max_runtime):
-        """Stop master node when the number of users goes back to 0"""
+    def interval_stats(self):
+        """Response time histogram and failures of the requests completed since the previous call"""
+        total = self.env.stats.total
+        current = LatencyHistogram.from_dict(total.response_times)
+        interval = current - self.previous_histogram
+        failures = max(total.num_failures - self.previous_failures, 0)
+        self.previous_histogram = current
+        self.previous_failures = total.num_failures
+        return interval, failures
+
+    def wait_for_end(self, env, stages_shape, max_runtime, end=None):
+        """Stop master node when the number of users goes back to 0 (or only stop the users with end)"""
+        end = end or self.env.runner.quit
         has_started = False
         start_time = time.time()
         while True:
             if self.env.runner.user_count > 0:
                 has_started = True
             if has_started and self.env.runner.user_count == 0:
-                self.env.runner.quit()
+                end()
                 return
-            if max_runtime and time.time() - start_time > max_runtime:
-                self.env.runner.quit()
+            shape_greenlet = self.env.runner.shape_greenlet
+            if shape_greenlet is not None and shape_greenlet.dead:
+                end()
                 return
-            gevent.sleep(HISTORY_STATS_INTERVAL_SEC)
-
-    def _master_status(self, env, max_runtime, fargate_task=None):
-        """Worker node need to exit if the overall task takes too much time or if the master node dies"""
-        start_time = time.time()
-        while True:
             if max_runtime and time.time() - start_time > max_runtime:
-                self.env.runner.quit()
+                end()
                 return
-            if fargate_task:
-                task = self.ecs.describe_tasks(
-                    cluster=fargate_task.split("/")[1], tasks=[fargate_task]
-                )
-                if (
-                    len(task["tasks"]) != 1
-                    or task["tasks"][0]["lastStatus"] == "STOPPED"
-                ):
-                    self.env.runner.quit()
-                    return
-            gevent.sleep(60)
+            gevent.sleep(HISTORY_STATS_INTERVAL_SEC)
 
     def save_results(self, percentiles):
         """To implement if need to save results somewhere"""
         pass
+
+
+def master_stopped(ecs, fargate_task):
+    """Check if the master Fargate task is gone"""
+    task = ecs.describe_tasks(cluster=fargate_task.split("/")[1], tasks=[fargate_task])
+    return len(task["tasks"]) != 1 or task["tasks"][0]["lastStatus"] == "STOPPED"
@@ -0,0 +1,156 @@
+import logging
+import math
+import random
+import time
+
+import gevent
+from gevent.event import Event
+
+# Seconds without heartbeat after which a worker exits even if ECS cannot confirm the master stopped
+MAX_SILENCE = 600
+
+
+class WorkerBarrier:
+    """Release the master once enough workers sent worker_ready, without polling"""
+
+    def __init__(self, expected, quorum=1.0, min_workers=1, timeout=None):
+        self.expected = int(expected)
+        self.min_workers = max(int(min_workers), 1)
+        self.required = min(
+            max(math.ceil(float(quorum) * self.expected), self.min_workers),
+            self.expected,
+        )
+        self.timeout = float(timeout) if timeout else None
+        self.ready = set()
+        self.late = set()
+        self.event = Event()
+        self.created = time.time()
+        self.released = None
+
+    def add(self, worker_id):
+        """Called on every worker_ready message"""
+        if self.released is not None:
+            if worker_id not in self.ready:
+                self.late.add(worker_id)
+                logging.info(
+                    f"Worker {worker_id} joined late, users will be rebalanced"
+                )
+            return
+        self.ready.add(worker_id)
+        logging.info(f"{len(self.ready)}/{self.expected} workers ready")
+        if len(self.ready) >= self.required:
+            self.event.set()
+
+    def wait(self):
+        """Block until the barrier opens. Return False if fewer than min_workers are ready at the deadline"""
+        self.event.wait(self.timeout)
+        self.released = time.time()
+        if len(self.ready) < self.min_workers:
+            logging.error(
+                f"Only {len(self.ready)} workers ready after {self.timeout}s, {self.min_workers} required"
+            )
+            return False
+        if len(self.ready) < self.expected:
+            logging.warning(
+                f"Starting with {len(self.ready)}/{self.expected} workers, {self.expected - len(self.ready)} missing"
+            )
+        return True
+
+    def summary(self):
+        """Readiness details for the report"""
+        return {
+            "expected_workers": self.expected,
+            "ready_workers": len(self.ready),
+            "missing_workers": max(self.expected - len(self.ready) - len(self.late), 0),
+            "late_workers": len(self.late),
+            "time_to_ready": round(self.released - self.created, 3)
+            if self.released
+            else None,
+        }
+
+
+class Backoff:
+    """Jittered exponential delay between two calls of a rare fallback check"""
+
+    def __init__(self, base=60, maximum=600):
+        self.delay = base
+        self.maximum = maximum
+        self.next = time.time() + self._jitter(base)
+
+    def due(self):
+        now = time.time()
+        if now < self.next:
+            return False
+        self.delay = min(self.delay * 2, self.maximum)
+        self.next = now + self._jitter(self.delay)
+        return True
+
+    def _jitter(self, delay):
+        return random.uniform(0.5, 1.5) * delay  # nosec
+
+
+class MasterLiveness:
+    """Detect a lost master from the heartbeats it broadcasts every `interval` seconds"""
+
+    def __init__(
+        self, interval=1, misses=5, check_master=None, max_silence=MAX_SILENCE
+    ):
+        self.interval = float(interval)
+        self.misses = int(misses)
+        self.check_master = check_master
+        self.max_silence = float(max_silence)
+        self.backoff = Backoff()
+        self.recheck = None
+        self.last = None
+
+    def on_heartbeat(self, environment, msg, **kwargs):
+        self.last = time.time()
+
+    def lost(self):
+        if self.last is None:
+            return bool(self.check_master and self.backoff.due() and self.stopped())
+        silence = time.time() - self.last
+        if silence <= self.interval * self.misses:
+            self.recheck = None
+            return False
+        if self.check_master is None:
+            logging.error(f"No heartbeat from the master for {silence:.1f}s")
+            return True
+        if silence > self.max_silence:
+            logging.error(f"No heartbeat from the master for {silence:.1f}s, giving up")
+            return True
+        if self.recheck is None:
+            # Every worker misses the heartbeats of a stalled master at once: spread their ECS calls
+            self.recheck = Backoff(self.interval * self.misses, self.max_silence / 4)
+        if not self.recheck.due():
+            return False
+        stopped = self.stopped()
+        if stopped:
+            logging.error(
+                f"No heartbeat from the master for {silence:.1f}s, and its task is stopped"
+            )
+        elif stopped is not None:
+            logging.warning(
+                f"No heartbeat from the master for {silence:.1f}s, but its task is running"
+            )
+        return bool(stopped)
+
+    def stopped(self):
+        """Whether ECS reports the master task stopped, None when the check failed (e.g. throttled)"""
+        try:
+            return bool(self.check_master())
+        except Exception as e:
+            logging.warning(f"Could not check the master task: {e}")
+            return None
+
+    def watch(self, on_lost, max_runtime=None):
+        """Call on_lost once the master is lost or the max runtime is over"""
+        start_time = time.time()
+        while True:
+            if max_runtime and time.time() - start_time > max_runtime:
+                logging.info("Max runtime reached")
+                break
+            if self.lost():
+                break
+            gevent.sleep(self.interval)
+        on_lost()
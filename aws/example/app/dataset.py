@@ -0,0 +1,382 @@
+import array
+import codecs
+import contextlib
+import csv
+import fcntl
+import hashlib
+import logging
+import mmap
+import os
+import tempfile
+
+import gevent
+from gevent.lock import Semaphore
+from gevent.queue import Empty
+from gevent.queue import Queue
+
+import services
+
+CACHE_DIR = os.environ.get(
+    "DATASET_CACHE_DIR", os.path.join(tempfile.gettempdir(), "distributed-locust")
+)
+
+CHUNK_SIZE = 8 * 1024 * 1024
+STREAM_WINDOW = 10000
+
+_datasets = {}
+_lock = Semaphore()
+
+
+class TestDataset:
+    """
+    Test rows packed in a single byte buffer and indexed by offsets.
+    Row i is buffer[offsets[i]:offsets[i + 1]]
+    """
+
+    def __init__(self, buffer, offsets, shared=False):
+        self.buffer = buffer
+        self.offsets = offsets
+        self.total = len(offsets) - 1
+        self.shared = DatasetCursor(self) if shared and self.total else None
+
+    def __len__(self):
+        return self.total
+
+    def __getitem__(self, idx):
+        return self.buffer[self.offsets[idx] : self.offsets[idx + 1]]
+
+    def cursor(self, start=0):
+        """
+        Cheap per-user iterator over the shared rows.
+        A sharded dataset hands out a single cursor, so users of the process never send the same row in one pass
+        """
+        return self.shared or DatasetCursor(self, start)
+
+    @classmethod
+    def from_file(cls, path, shared=False):
+        """Memory-map a packed dataset. Pages are shared by every process mapping the same file"""
+        with open(path + ".idx", "rb") as f:
+            offsets = memoryview(_map(f)).cast("Q")
+        with open(path + ".rows", "rb") as f:
+            buffer = _map(f)
+        return cls(buffer, offsets, shared)
+
+
+class DatasetCursor:
+    """Position of a user in a shared dataset. Loop back to the first row at the end"""
+
+    __slots__ = ("dataset", "idx", "total")
+
+    def __init__(self, dataset, start=0):
+        self.dataset = dataset
+        self.total = len(dataset)
+        self.idx = start % self.total
+
+    def next(self):
+        row = self.dataset[self.idx]
+        self.idx += 1
+        if self.idx == self.total:
+            self.idx = 0
+        return row
+
+
+class StreamingDataset:
+    """
+    Replay a test set too large to fit in memory. A background greenlet fetches the object
+    in ranged chunks, parses the CSV rows incrementally and keeps at most `window` encoded
+    bodies ready to send. Users share the stream, so each row is sent once per pass
+    """
+
+    def __init__(
+        self,
+        bucket,
+        key,
+        window=STREAM_WINDOW,
+        chunk_size=CHUNK_SIZE,
+        shard=None,
+        region=None,
+    ):
+        self.s3 = services.client("s3", region)
+        self.bucket = bucket
+        self.key = key
+        self.chunk_size = chunk_size
+        self.shard = shard
+        self.start, self.end = shard_range(self.s3, bucket, key, shard)
+        self.queue = Queue(maxsize=window)
+        self.stalls = 0
+        self.greenlet = gevent.spawn(self._produce)
+
+    def cursor(self, start=0):
+        """Users read from the shared window"""
+        return self
+
+    def next(self):
+        try:
+            return self.queue.get_nowait()
+        except Empty:
+            self.stalls += 1
+        while True:
+            try:
+                return self.queue.get(timeout=1)
+            except Empty:
+                if self.greenlet.dead:
+                    raise RuntimeError(
+                        f"Streaming of s3://{self.bucket}/{self.key} stopped: {self.greenlet.exception}"
+                    )
+
+    def _produce(self):
+        """Fill the window, looping back to the first row at the end of the object"""
+        while True:
+            chunks = iter_chunks(
+                self.s3, self.bucket, self.key, self.start, self.end, self.chunk_size
+            )
+            rows = 0
+            reader = csv.reader(iter_lines(chunks), delimiter=",")
+            if self.start == 0:
+                next(reader, None)
+            for row in reader:
+                if row:
+                    self.queue.put(row[0].encode())
+                    rows += 1
+            if rows == 0 and self.shard is not None:
+                logging.warning(
+                    f"Shard {self.shard[0]}/{self.shard[1]} of s3://{self.bucket}/{self.key} has no rows, using every row"
+                )
+                self.shard = None
+                self.start, self.end = shard_range(self.s3, self.bucket, self.key)
+            elif rows == 0:
+                raise ValueError(
+                    f"Test dataset s3://{self.bucket}/{self.key} has no rows"
+                )
+
+
+def load_dataset(bucket, key, mode="cache", shard=None, region=None):
+    """
+    Return the process-wide dataset for this S3 object.
+        cache: downloaded and packed on first use, then memory-mapped
+        stream: read in ranged chunks through a bounded window
+    shard: optional (index, count). Only the rows starting in the index-th of count
+    equal byte ranges of the object are fetched. A shard without rows (more shards than
+    lines) uses every row of the object
+    """
+    with _lock:
+        return _load_dataset(bucket, key, mode, shard, region)
+
+
+def _load_dataset(bucket, key, mode, shard, region):
+    dataset = _datasets.get((bucket, key, mode, shard))
+    if dataset is None and mode == "stream":
+        dataset = StreamingDataset(
+            bucket,
+            key,
+            window=int(os.environ.get("TEST_DATASET_WINDOW", STREAM_WINDOW)),
+            shard=shard,
+            region=region,
+        )
+        _datasets[(bucket, key, mode, shard)] = dataset
+    elif dataset is None:
+        s3 = services.client("s3", region)
+        head = s3.head_object(Bucket=bucket, Key=key)
+        path = cache_path(bucket, key, shard, object_version(head))
+        # Other processes of the container may be packing the same dataset
+        with file_lock(os.path.dirname(path) + ".lock"):
+            if not os.path.exists(path + ".idx"):
+                remove_stale(path)
+                download_dataset(
+                    bucket, key, path, shard, region, head["ContentLength"]
+                )
+        dataset = TestDataset.from_file(path, shared=shard is not None)
+        if len(dataset) == 0 and shard is not None:
+            logging.warning(
+                f"Shard {shard[0]}/{shard[1]} of s3://{bucket}/{key} has no rows, using every row"
+            )
+            dataset = _load_dataset(bucket, key, mode, None, region)
+        elif len(dataset) == 0:
+            raise ValueError(f"Test dataset s3://{bucket}/{key} has no rows")
+        _datasets[(bucket, key, mode, shard)] = dataset
+    return dataset
+
+
+def forget_datasets(bucket, key):
+    """Drop the datasets of other objects than s3://bucket/key (next job of a warm pool). Return the ones kept"""
+    for cached in list(_datasets):
+        if cached[:2] != (bucket, key):
+            del _datasets[cached]
+    return list(_datasets.values())
+
+
+def parse_shard(value):
+    """Parse the "index/count" shard notation"""
+    if not value:
+        return None
+    index, count = [int(x) for x in value.split("/")]
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"Invalid dataset shard {value}")
+    return (index, count)
+
+
+def object_version(head):
+    """Version of an S3 object from its head_object response"""
+    etag = head.get("ETag", "").strip('"')
+    return f"{etag}-{head['ContentLength']}"
+
+
+def cache_path(bucket, key, shard=None, version=""):
+    """
+    Location of the packed dataset, shared by all processes of the container:
+    CACHE_DIR/<object and shard>/<version>, so an object replaced under the same key is packed again
+    """
+    name = (
+        f"{bucket}/{key}" if shard is None else f"{bucket}/{key}#{shard[0]}/{shard[1]}"
+    )
+    digest = hashlib.sha1(name.encode()).hexdigest()  # nosec
+    return os.path.join(
+        CACHE_DIR, digest, hashlib.sha1(version.encode()).hexdigest()  # nosec
+    )
+
+
+def remove_stale(path):
+    """Remove the packed versions of the dataset other than path. Processes mapping them keep their pages"""
+    directory, name = os.path.split(path)
+    if not os.path.isdir(directory):
+        return
+    for entry in os.listdir(directory):
+        if not entry.startswith(name):
+            os.remove(os.path.join(directory, entry))
+
+
+@contextlib.contextmanager
+def file_lock(path, poll=0.1):
+    """Exclusive lock held across processes. Polled, so waiting does not block the event loop"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a") as f:
+        while True:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                gevent.sleep(poll)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def download_dataset(bucket, key, path, shard=None, region=None, size=None):
+    """Download the CSV test set (or its shard) from S3 in chunks and pack its first column"""
+    s3 = services.client("s3", region)
+    start, end = shard_range(s3, bucket, key, shard, size)
+    count = pack_rows(
+        iter_lines(iter_chunks(s3, bucket, key, start, end)), path, header=start == 0
+    )
+    logging.info(f"Packed {count} rows from s3://{bucket}/{key} into {path}")
+
+
+def shard_range(s3, bucket, key, shard=None, size=None):
+    """
+    Byte range [start, end) of a shard, aligned on line starts.
+    A row belongs to the shard its first byte falls in, so shards never overlap.
+    Rows of a sharded dataset must not contain new lines
+    """
+    if size is None:
+        size = s3.head_object(Bucket=bucket, Key=key)["ContentLength"]
+    if shard is None:
+        return 0, size
+    index, count = shard
+    return (
+        _line_start(s3, bucket, key, size * index // count, size),
+        _line_start(s3, bucket, key, size * (index + 1) // count, size),
+    )
+
+
+def _line_start(s3, bucket, key, pos, size, probe=64 * 1024):
+    """Position of the first line starting at or after pos"""
+    if pos <= 0 or pos >= size:
+        return min(max(pos, 0), size)
+    start = pos - 1
+    while start < size:
+        end = min(start + probe, size)
+        obj = s3.get_object(Bucket=bucket, Key=key, Range=f"bytes={start}-{end - 1}")
+        idx = obj["Body"].read().find(b"\n")
+        if idx >= 0:
+            return start + idx + 1
+        start = end
+    return size
+
+
+def iter_chunks(s3, bucket, key, start, end, chunk_size=CHUNK_SIZE):
+    """Yield bytes [start, end) of an S3 object. The next range is fetched while the current one is consumed"""
+
+    def fetch(pos):
+        obj = s3.get_object(
+            Bucket=bucket,
+            Key=key,
+            Range=f"bytes={pos}-{min(pos + chunk_size, end) - 1}",
+        )
+        return obj["Body"].read()
+
+    pending = gevent.spawn(fetch, start) if start < end else None
+    pos = start
+    while pending is not None:
+        chunk = pending.get()
+        pos += len(chunk)
+        pending = gevent.spawn(fetch, pos) if chunk and pos < end else None
+        yield chunk
+
+
+def iter_lines(chunks):
+    """Split UTF-8 chunks into lines, keeping line endings so the csv reader can rebuild quoted multi-line fields"""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    pending = ""
+    for chunk in chunks:
+        lines = (pending + decoder.decode(chunk)).split("\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line + "\n"
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+
+def pack_rows(lines, path, header=True):
+    """
+    Parse CSV lines and write the packed rows file, then the offsets file.
+    Both are written to temporary files of their own and renamed in place, rows first,
+    so a reader that finds the offsets file never sees a partial dataset
+    """
+    directory, name = os.path.split(path)
+    os.makedirs(directory, exist_ok=True)
+    offsets = array.array("Q", [0])
+    reader = csv.reader(lines, delimiter=",")
+    if header:
+        next(reader, None)
+    temporary = []
+    try:
+        fd, rows_path = tempfile.mkstemp(dir=directory, prefix=name, suffix=".rows.tmp")
+        temporary.append(rows_path)
+        with os.fdopen(fd, "wb") as f:
+            for row in reader:
+                if not row:
+                    continue
+                value = row[0].encode()
+                f.write(value)
+                offsets.append(offsets[-1] + len(value))
+        fd, idx_path = tempfile.mkstemp(dir=directory, prefix=name, suffix=".idx.tmp")
+        temporary.append(idx_path)
+        with os.fdopen(fd, "wb") as f:
+            offsets.tofile(f)
+        os.replace(rows_path, path + ".rows")
+        os.replace(idx_path, path + ".idx")
+        temporary = []
+    finally:
+        for tmp in temporary:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+    return len(offsets) - 1
+
+
+def _map(f):
+    """Read-only memory map of a file. Empty files cannot be mapped"""
+    if os.fstat(f.fileno()).st_size == 0:
+        return b""
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
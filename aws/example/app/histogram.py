@@ -0,0 +1,127 @@
+from array import array
+
+SUB_BUCKET_BITS = 7
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+HALF_SUB_BUCKETS = SUB_BUCKETS >> 1
+MAX_SHIFT = 40 - SUB_BUCKET_BITS
+BUCKETS = (MAX_SHIFT + 2) * HALF_SUB_BUCKETS
+
+
+def bucket_index(value):
+    """
+    HDR-style log-linear bucketing: values below 128ms are exact, then each power of two
+    is split into 64 buckets (about 1.5% relative precision)
+    """
+    value = int(value)
+    if value < SUB_BUCKETS:
+        return max(value, 0)
+    shift = min(value.bit_length() - SUB_BUCKET_BITS, MAX_SHIFT)
+    return min((shift << (SUB_BUCKET_BITS - 1)) + (value >> shift), BUCKETS - 1)
+
+
+def bucket_value(idx):
+    """Middle of the values stored in a bucket"""
+    if idx < SUB_BUCKETS:
+        return idx
+    shift = idx // HALF_SUB_BUCKETS - 1
+    return ((idx - shift * HALF_SUB_BUCKETS) << shift) + ((1 << shift) - 1) // 2
+
+
+def bucket_floor(idx):
+    """Lowest value stored in a bucket"""
+    if idx < SUB_BUCKETS:
+        return idx
+    shift = idx // HALF_SUB_BUCKETS - 1
+    return (idx - shift * HALF_SUB_BUCKETS) << shift
+
+
+def percentile_fraction(percentile):
+    """Convert the percentile notation of the CLI ("50", "95", "999") to a fraction"""
+    return float(percentile) / (10 ** len(percentile))
+
+
+class LatencyHistogram:
+    """
+    Fixed-size response time histogram (ms). Histograms are merged and diffed bucket by bucket,
+    so per-interval and cross-worker percentiles never need the raw samples
+    """
+
+    __slots__ = ("counts",)
+
+    def __init__(self, counts=None):
+        self.counts = counts if counts is not None else array("Q", bytes(8 * BUCKETS))
+
+    @property
+    def total(self):
+        return sum(self.counts)
+
+    def record(self, value, count=1):
+        self.counts[bucket_index(value)] += count
+
+    def record_series(self, value, step, count):
+        """
+        Record value, value - step, ... (count values, rounded to the ms) with one update per bucket
+        they fall in, so a long series costs at most the number of buckets
+        """
+        while count > 0:
+            idx = bucket_index(round(value))
+            floor = bucket_floor(idx)
+            in_bucket = count if floor == 0 else int((value - floor + 0.5) // step) + 1
+            in_bucket = min(max(in_bucket, 1), count)
+            self.counts[idx] += in_bucket
+            value -= in_bucket * step
+            count -= in_bucket
+
+    def merge(self, other):
+        """Add the counts of another histogram"""
+        counts = self.counts
+        for idx, count in enumerate(other.counts):
+            if count:
+                counts[idx] += count
+        return self
+
+    def __sub__(self, other):
+        """Counts recorded since `other` was snapshotted"""
+        return LatencyHistogram(
+            array("Q", [max(a - b, 0) for a, b in zip(self.counts, other.counts)])
+        )
+
+    def copy(self):
+        return LatencyHistogram(array("Q", self.counts))
+
+    def percentile(self, fraction):
+        return self.percentiles([fraction])[0]
+
+    def percentiles(self, fractions):
+        """Values under which each fraction of the requests completed, in a single pass"""
+        total = self.total
+        if total == 0:
+            return [0 for _ in fractions]
+        targets = sorted((max(1, round(f * total)), i) for i, f in enumerate(fractions))
+        results = [0] * len(fractions)
+        seen = 0
+        pos = 0
+        for idx, count in enumerate(self.counts):
+            if not count:
+                continue
+            seen += count
+            while pos < len(targets) and seen >= targets[pos][0]:
+                results[targets[pos][1]] = bucket_value(idx)
+                pos += 1
+            if pos == len(targets):
+                break
+        return results
+
+    def to_dict(self):
+        """Sparse {bucket value: count} form, small enough to ship between nodes or store in a report"""
+        return {
+            bucket_value(idx): count for idx, count in enumerate(self.counts) if count
+        }
+
+    @classmethod
+    def from_dict(cls, values):
+        """Build from a {response time: count} mapping, e.g. StatsEntry.response_times or to_dict()"""
+        histogram = cls()
+        for value, count in values.items():
+            histogram.record(value, count)
+        return histogram
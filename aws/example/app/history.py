@@ -0,0 +1,189 @@
+import datetime
+from array import array
+
+from histogram import LatencyHistogram
+from histogram import percentile_fraction
+
+HISTORY_SIZE = 17280
+
+
+class StatsHistory:
+    """
+    Fixed-size columnar history of a load test, one typed array per metric.
+    Once `capacity` intervals are stored the oldest ones are overwritten, so memory stays flat on soak tests
+    """
+
+    COLUMNS = [
+        "time",
+        "current_rps",
+        "current_fail_per_sec",
+        "user_count",
+        "saturated_workers",
+        "worker_cpu_percent",
+        "loop_lag_ms",
+        "scheduling_delay_ms",
+    ]
+
+    def __init__(self, percentiles, capacity=HISTORY_SIZE):
+        self.capacity = int(capacity)
+        self.names = self.COLUMNS + [
+            f"response_time_percentile_{p}" for p in percentiles
+        ]
+        self.columns = {
+            name: array("d", bytes(8 * self.capacity)) for name in self.names
+        }
+        self.count = 0
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, **values):
+        idx = self.count % self.capacity
+        for name, column in self.columns.items():
+            column[idx] = values.get(name) or 0
+        self.count += 1
+
+    def column(self, name):
+        """Values of a metric, oldest first"""
+        column = self.columns[name]
+        if self.count <= self.capacity:
+            return column[: self.count].tolist()
+        start = self.count % self.capacity
+        return column[start:].tolist() + column[:start].tolist()
+
+    def export(self):
+        """Rows in the report format"""
+        columns = {name: self.column(name) for name in self.names}
+        rows = []
+        for i in range(len(self)):
+            row = {name: columns[name][i] for name in self.names}
+            row["time"] = _format_time(row["time"])
+            row["user_count"] = int(row["user_count"])
+            row["saturated_workers"] = int(row["saturated_workers"])
+            rows.append(row)
+        return rows
+
+
+class LatencyWindows:
+    """
+    Request count, failures and response time percentiles per fixed time window.
+    Each window merges the interval histograms it covers, so its percentiles are exact for the window
+    """
+
+    def __init__(self, percentiles, duration=60):
+        self.percentiles = percentiles
+        self.fractions = [percentile_fraction(p) for p in percentiles]
+        self.duration = float(duration)
+        self.windows = []
+        self.start = None
+        self.histogram = LatencyHistogram()
+        self.failures = 0
+
+    def add(self, timestamp, histogram, failures=0):
+        """Add the requests completed during an interval ending at timestamp"""
+        if self.start is None:
+            self.start = timestamp
+        self.histogram.merge(histogram)
+        self.failures += failures
+        if timestamp - self.start >= self.duration:
+            self.flush(timestamp)
+
+    def flush(self, timestamp):
+        """Close the current window"""
+        if self.start is None:
+            return
+        window = {
+            "start": _format_time(self.start),
+            "end": _format_time(timestamp),
+            "num_requests": self.histogram.total,
+            "num_failures": self.failures,
+        }
+        values = self.histogram.percentiles(self.fractions)
+        for percentile, value in zip(self.percentiles, values):
+            window[f"response_time_percentile_{percentile}"] = value
+        self.windows.append(window)
+        self.start = None
+        self.histogram = LatencyHistogram()
+        self.failures = 0
+
+    def export(self):
+        return list(self.windows)
+
+
+class StageMetrics:
+    """
+    Throughput, failures and response time percentiles of each stage of the shape, measured over
+    the steady window of the stage: from the moment all its users run until the stage ends, so the
+    ramp is excluded. Stages never steady are measured over their whole run and flagged steady=False.
+    Boundaries follow the stats received by the master, so they are accurate to the worker report interval
+    """
+
+    def __init__(self, percentiles, stats, stages):
+        self.percentiles = percentiles
+        self.fractions = [percentile_fraction(p) for p in percentiles]
+        self.stats = stats
+        self.stages = stages
+        self.results = []
+        self.stage = None
+        self.start = None
+        self.steady = None
+        self.snapshot = None
+
+    def on_stage(self, kind, stage, timestamp, **kwargs):
+        """Listener of StagesShape.stage_events"""
+        if kind == "start":
+            self.stage = stage
+            self.start = timestamp
+            self.steady = None
+            self.snapshot = self._snapshot(timestamp)
+        elif kind == "steady" and stage == self.stage:
+            self.steady = timestamp
+            self.snapshot = self._snapshot(timestamp)
+        elif kind == "end" and stage == self.stage:
+            self.close(timestamp)
+
+    def close(self, timestamp):
+        """End the current stage, e.g. when the test is stopped before the shape is over"""
+        if self.stage is None:
+            return
+        start_time, histogram, requests, failures = self.snapshot
+        end = self._snapshot(timestamp)
+        duration = max(timestamp - start_time, 0)
+        requests = end[2] - requests
+        failures = end[3] - failures
+        stage = self.stages[self.stage]
+        result = {
+            "stage": self.stage,
+            "mode": stage.get("mode", "users"),
+            "target": stage.get("rps", stage.get("users")),
+            "start": _format_time(self.start),
+            "end": _format_time(timestamp),
+            "steady": self.steady is not None,
+            "ramp_seconds": round((self.steady or timestamp) - self.start, 3),
+            "window_seconds": round(duration, 3),
+            "num_requests": requests,
+            "num_failures": failures,
+            "requests_per_second": round(requests / duration, 3) if duration else 0,
+            "failure_rate": round(failures / requests, 6) if requests else 0,
+        }
+        values = (end[1] - histogram).percentiles(self.fractions)
+        for percentile, value in zip(self.percentiles, values):
+            result[f"response_time_percentile_{percentile}"] = value
+        self.results.append(result)
+        self.stage = None
+
+    def _snapshot(self, timestamp):
+        total = self.stats.total
+        return (
+            timestamp,
+            LatencyHistogram.from_dict(total.response_times),
+            total.num_requests,
+            total.num_failures,
+        )
+
+    def export(self):
+        return list(self.results)
+
+
+def _format_time(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp).strftime("%H:%M:%S")
@@ -1,24 +1,65 @@
 import argparse
 import datetime
 import json
+import logging
 import os
+import signal
 import sys
+import time
+from startup import startup
 from locust.log import setup_logging
-import boto3
+from locust.stats import stats_printer
+import gevent
 from client import DistributedClient
+from client import master_stopped
+from cluster import MasterLiveness
+from dataset import load_dataset
+from dataset import parse_shard
+from histogram import LatencyHistogram
+from histogram import percentile_fraction
+from omission import recorder
+from pacing import pacer
+from pool import JobQueue
+from registry import MasterRegistry
+from registry import REGISTRY_PREFIX
+from results import ResultStore
+from saturation import CPU_THRESHOLD
+from saturation import LAG_THRESHOLD_MS
+import services
 from shape import APIInterface
+from shape import forget_stages
+from shape import prefetch_stages
 from shape import StagesShape
+from sink import create_sink
+from supervisor import process_count
+from supervisor import WorkerProcesses
+from traffic import load_plan
 
 setup_logging("INFO", None)
 
 
 class LoadTesting(DistributedClient):
-    def __init__(self, shapes_location, output_location, region, *args, **kwargs):
-        stages_shape = StagesShape(
-            shapes_location["Bucket"], shapes_location["Key"], region
+    def __init__(
+        self,
+        shapes_location,
+        output_location,
+        region,
+        output_layout="legacy",
+        shape_mode="users",
+        *args,
+        **kwargs,
+    ):
+        # Workers never run the shape: they connect without waiting for it
+        stages_shape = (
+            StagesShape(
+                shapes_location["Bucket"], shapes_location["Key"], mode=shape_mode
+            )
+            if kwargs.get("node_type", "master").lower() != "worker"
+            else None
         )
         super(LoadTesting, self).__init__(stages_shape=stages_shape, *args, **kwargs)
         self.output_location = output_location
+        self.output_layout = output_layout
         self.region = region
 
     def start(self):
@@ -29,30 +70,101 @@ class LoadTesting(DistributedClient):
         else:
             self.start_local()
 
+    def start_pool(self, queue, args, idle_timeout=None):
+        """
+        Warm pool: keep the master and its workers connected and run the jobs of the queue one after another.
+        Each job overrides the arguments of the master command. Workers keep the dataset of the previous job
+        when the next one reads the same object; shapes are small and read again for every job
+        """
+        if not self.barrier.wait():
+            self.env.runner.quit()
+            sys.exit(1)
+        startup.mark("workers_ready")
+        gevent.spawn(stats_printer(self.env.stats))
+        gevent.spawn(self.stats_history, self.env.runner, self.percentiles)
+        while True:
+            item = queue.next(idle_timeout)
+            if item is None:
+                logging.info(f"No job for {idle_timeout}s, stopping the pool")
+                break
+            job_id, job = item
+            if job.get("stop"):
+                queue.finish(job_id, job)
+                break
+            settings = argparse.Namespace(**dict(vars(args), **job))
+            try:
+                forget_stages()
+                stages_shape = StagesShape(
+                    settings.shapes_bucket,
+                    settings.shapes_key,
+                    mode=settings.shape_mode,
+                )
+                self.env.host = settings.host
+                self.output_location = output_location(settings)
+                self.run_job(stages_shape, job_environment(settings), job_id)
+                self.save_results(self.percentiles)
+            except Exception as e:
+                logging.exception(f"Job {job_id} failed")
+                queue.finish(job_id, job, e)
+                continue
+            queue.finish(job_id, job)
+        self.env.runner.quit()
+
     def save_results(self, percentiles):
+        """Whole-run percentiles come from the response time histogram merged across all workers"""
+        total = self.env.stats.total
+        histogram = LatencyHistogram.from_dict(total.response_times)
+        now = time.time()
+        self.windows.add(now, *self.interval_stats())
+        self.windows.flush(now)
+        self.stage_metrics.close(now)
         results = {
             "time": datetime.datetime.now().strftime("%H:%M:%S"),
-            "min_response_time": self.env.stats.total.min_response_time,
-            "max_response_time": self.env.stats.total.max_response_time,
-            "num_requests": self.env.stats.total.num_requests,
-            "history": self.env.stats.history,
+            "min_response_time": total.min_response_time,
+            "max_response_time": total.max_response_time,
+            "num_requests": total.num_requests,
+            "num_failures": total.num_failures,
+            "response_time_histogram": histogram.to_dict(),
+            "history": self.history.export(),
+            "windows": self.windows.export(),
+            "stages": self.stage_metrics.export(),
+            "pacing_missed_requests": pacer.total_missed,
+            "startup": startup.phases,
         }
-        if len(self.env.stats.history) > 0:
-            for percentile in percentiles:
-                results[f"response_time_percentile_{percentile}"] = sum(
-                    [
-                        x[f"response_time_percentile_{percentile}"]
-                        for x in self.env.stats.history
-                    ]
-                ) / len(self.env.stats.history)
+        if os.environ.get("CORRECTED_LATENCY") == "1":
+            results["corrected_latency"] = recorder.report(percentiles)
+        results["saturation"] = self.saturation.summary()
+        if self.saturation.saturated_intervals:
+            logging.warning(
+                f"Workers were saturated during {self.saturation.saturated_intervals} intervals: "
+                "response times of these intervals (saturated_workers in the history) are inflated by the load generator"
+            )
+        if self.sink is not None:
+            self.sink.close()
+            results["metrics_sink"] = self.sink.summary()
+        if self.node_type == "master":
+            results["workers"] = self.barrier.summary()
+        if self.stages_shape.search is not None:
+            results["capacity"] = self.stages_shape.search.report()
+        values = histogram.percentiles([percentile_fraction(p) for p in percentiles])
+        for percentile, value in zip(percentiles, values):
+            results[f"response_time_percentile_{percentile}"] = value
         if self.output_location:
             self.upload_report(
                 self.output_location["Bucket"], self.output_location["Key"], results
             )
 
     def upload_report(self, bucket, key, results):
-        """Save output to S3"""
-        s3 = boto3.client("s3", region_name=os.environ["AWS_REGION"])
+        """
+        Save output to S3.
+            legacy: append the results to the JSON list stored at key
+            runs: key is a prefix, each run is written to its own objects (see ResultStore)
+        """
+        s3 = services.client("s3")
+        if self.output_layout == "runs":
+            run_id = ResultStore(bucket, key, s3=s3).save(results)
+            logging.info(f"Results saved as run {run_id} in s3://{bucket}/{key}")
+            return
         report = self._download_previous_report(s3, bucket, key)
         report.append(results)
         s3.put_object(Bucket=bucket, Key=key, Body=json.dumps(report))
@@ -61,9 +173,9 @@ class LoadTesting(DistributedClient):
         """Download previous report if exists"""
         try:
             obj = s3.get_object(Bucket=bucket, Key=key)
-            return json.loads(obj["Body"].read())
-        except Exception:
+        except s3.exceptions.NoSuchKey:
             return []
+        return json.loads(obj["Body"].read())
 
 
 def parse_args():
@@ -72,17 +184,103 @@ def parse_args():
     parser.add_argument("--method", default="/")
     parser.add_argument("--shapes-bucket")
     parser.add_argument("--shapes-key")
+    parser.add_argument("--shape-mode", default="users", choices=["users", "time"])
     parser.add_argument("--testdata-bucket")
     parser.add_argument("--testdata-key")
+    parser.add_argument("--dataset-mode", default="cache", choices=["cache", "stream"])
+    parser.add_argument("--dataset-window", default=10000)
+    parser.add_argument(
+        "--dataset-format",
+        default="body",
+        choices=["body", "requests"],
+        help="Rows are request bodies, or JSON requests with method, path, headers and weight",
+    )
+    parser.add_argument("--shard-dataset", action="store_true")
+    parser.add_argument("--worker-index", default=0)
+    parser.add_argument("--worker-count", default=1)
     parser.add_argument("--client-type", default="local")
+    parser.add_argument(
+        "--processes",
+        default="1",
+        help="Worker processes in the container, or auto for one per CPU",
+    )
     parser.add_argument("--master-host", default="127.0.0.1")
-    parser.add_argument("--master-port", default=5557)
+    parser.add_argument("--master-port", default=5557, type=int)
     parser.add_argument("--expected-workers", default=1)
+    parser.add_argument(
+        "--worker-quorum",
+        default=1.0,
+        type=float,
+        help="Fraction of the expected workers needed to start",
+    )
+    parser.add_argument("--min-workers", default=1, type=int)
+    parser.add_argument("--heartbeat-interval", default=1, type=float)
+    parser.add_argument(
+        "--heartbeat-misses",
+        default=5,
+        type=int,
+        help="Missed master heartbeats before a worker exits",
+    )
+    parser.add_argument(
+        "--ready-timeout",
+        default=600,
+        type=float,
+        help="Seconds to wait for workers before starting with the ones ready",
+    )
     parser.add_argument("--output-bucket", default=None)
     parser.add_argument("--output-key", default=None)
+    parser.add_argument("--output-layout", default="legacy", choices=["legacy", "runs"])
+    parser.add_argument(
+        "--metrics-sink",
+        default=None,
+        help="Stream interval metrics during the run to s3://BUCKET/PREFIX or a local file",
+    )
+    parser.add_argument(
+        "--saturation-cpu",
+        default=CPU_THRESHOLD,
+        type=float,
+        help="CPU percent of a worker process from which it is saturated",
+    )
+    parser.add_argument(
+        "--saturation-lag-ms",
+        default=LAG_THRESHOLD_MS,
+        type=float,
+        help="Event-loop lag of a worker process from which it is saturated",
+    )
+    parser.add_argument(
+        "--rebalance-saturated",
+        action="store_true",
+        help="Move users from saturated workers to the others",
+    )
+    parser.add_argument(
+        "--corrected-latency",
+        action="store_true",
+        help="Also report response times measured from the intended send time of rps stages",
+    )
     parser.add_argument("--percentiles", default="50,95")
-    parser.add_argument("--max-runtime", default=None)
+    parser.add_argument("--history-size", default=17280)
+    parser.add_argument("--report-window", default=60)
+    parser.add_argument("--max-runtime", default=None, type=float)
     parser.add_argument("--fargate-task", default=None)
+    parser.add_argument(
+        "--registry-bucket",
+        default=None,
+        help="Bucket where the master announces itself to the Step Function",
+    )
+    parser.add_argument("--registry-prefix", default=REGISTRY_PREFIX)
+    parser.add_argument("--execution-id", default=os.environ.get("EXECUTION_ID"))
+    parser.add_argument(
+        "--pool-bucket",
+        default=None,
+        help="Keep the master and workers running and read jobs from this bucket",
+    )
+    parser.add_argument("--pool-prefix", default="pool")
+    parser.add_argument(
+        "--pool-idle-timeout",
+        default=None,
+        type=float,
+        help="Stop the pool after this many seconds without job",
+    )
     parser.add_argument(
         "--region", default=os.environ.get("AWS_REGION", "ap-southeast-1")
     )
@@ -93,30 +291,154 @@ def parse_args():
 
 
 def set_env(args):
-    os.environ["AWS_REGION"] = args.region
-    os.environ["METHOD_PATH"] = args.method
-    os.environ["CONTENT_TYPE"] = args.content_type
-    os.environ["TEST_DATASET_BUCKET"] = args.testdata_bucket
-    os.environ["TEST_DATASET_KEY"] = args.testdata_key
+    os.environ.update(job_environment(args))
+    if args.shard_dataset:
+        os.environ["TEST_DATASET_SHARD"] = f"{args.worker_index}/{args.worker_count}"
 
 
-if __name__ == "__main__":
-    print(sys.argv)
-    args = parse_args()
-    client = LoadTesting(
+def job_environment(args):
+    """Environment variables read by the users, also sent to the workers of a warm pool for each job"""
+    return {
+        "AWS_REGION": args.region,
+        "METHOD_PATH": args.method,
+        "CONTENT_TYPE": args.content_type,
+        "TEST_DATASET_BUCKET": args.testdata_bucket,
+        "TEST_DATASET_KEY": args.testdata_key,
+        "TEST_DATASET_MODE": args.dataset_mode,
+        "TEST_DATASET_WINDOW": str(args.dataset_window),
+        "TEST_DATASET_FORMAT": args.dataset_format,
+        "CORRECTED_LATENCY": "1" if args.corrected_latency else "0",
+    }
+
+
+def output_location(args):
+    if args.output_bucket is None and args.output_key is None:
+        return None
+    return {"Bucket": args.output_bucket, "Key": args.output_key}
+
+
+def create_client(args, master_fargate_task=None, max_runtime=None):
+    return LoadTesting(
         shapes_location={"Bucket": args.shapes_bucket, "Key": args.shapes_key},
-        output_location={"Bucket": args.output_bucket, "Key": args.output_key}
-        if args.output_bucket is not None or args.output_key is not None
-        else None,
+        output_location=output_location(args),
+        output_layout=args.output_layout,
+        shape_mode=args.shape_mode,
         node_type=args.client_type,
         host=args.host,
         user_classes=[APIInterface],
         expected_workers=args.expected_workers,
+        worker_quorum=args.worker_quorum,
+        min_workers=args.min_workers,
+        ready_timeout=args.ready_timeout,
+        heartbeat_interval=args.heartbeat_interval,
+        heartbeat_misses=args.heartbeat_misses,
         percentiles=args.percentiles,
-        max_runtime=args.max_runtime,
+        max_runtime=max_runtime,
         master_host=args.master_host,
         master_port=args.master_port,
-        master_fargate_task=args.fargate_task,
+        master_fargate_task=master_fargate_task,
         region=args.region,
+        history_size=args.history_size,
+        report_window=args.report_window,
+        saturation_cpu=args.saturation_cpu,
+        saturation_lag_ms=args.saturation_lag_ms,
+        rebalance_saturated=args.rebalance_saturated,
+        sink=create_sink(args.metrics_sink, args.region, execution_id=args.execution_id)
+        if args.client_type != "worker"
+        else None,
     )
-    client.start()
+
+
+def prefetch_dataset(args):
+    """Load the dataset, and compile its request plan (once, before forking worker processes)"""
+    dataset = load_dataset(
+        args.testdata_bucket,
+        args.testdata_key,
+        shard=parse_shard(os.environ.get("TEST_DATASET_SHARD")),
+    )
+    if args.dataset_format == "requests":
+        load_plan(dataset)
+    return dataset
+
+
+def prefetch(args, dataset=True):
+    """
+    Start downloading the shape and the dataset concurrently, so they are ready (or on their way)
+    when the node has connected. Workers do not need the shape, nor the master the dataset.
+    Return the greenlets
+    """
+    greenlets = []
+    if args.client_type != "worker":
+        greenlets.append(prefetch_stages(args.shapes_bucket, args.shapes_key))
+        greenlets[-1].link_value(lambda g: startup.mark("shape"))
+    if dataset and args.client_type != "master" and args.dataset_mode == "cache":
+        greenlets.append(gevent.spawn(prefetch_dataset, args))
+        greenlets[-1].link_value(lambda g: startup.mark("dataset"))
+    return greenlets
+
+
+def run_worker_processes(args, processes):
+    """
+    Fork one Locust worker per process. The dataset is downloaded once before forking.
+    Each process follows the master heartbeats; the parent watches the max runtime and,
+    as a rare fallback, the master task for all of them
+    """
+    gevent.joinall(prefetch(args, dataset=not args.shard_dataset), raise_error=True)
+
+    def run(index):
+        if args.shard_dataset:
+            os.environ["TEST_DATASET_SHARD"] = "{}/{}".format(
+                int(args.worker_index) * processes + index,
+                int(args.worker_count) * processes,
+            )
+        client = create_client(args)
+        gevent.signal_handler(
+            signal.SIGTERM, lambda: gevent.spawn(client.env.runner.quit)
+        )
+        client.start()
+
+    # Never receives heartbeats: only checks the master task with a backoff
+    liveness = MasterLiveness(
+        check_master=(
+            lambda: master_stopped(
+                services.client("ecs", args.region), args.fargate_task
+            )
+        )
+        if args.fargate_task
+        else None
+    )
+    start_time = time.time()
+
+    def should_stop():
+        if args.max_runtime and time.time() - start_time > args.max_runtime:
+            return True
+        return liveness.lost()
+
+    pool = WorkerProcesses(processes, run, should_stop, interval=1)
+    pool.start()
+    sys.exit(pool.wait())
+
+
+if __name__ == "__main__":
+    print(sys.argv)
+    startup.mark("imports")
+    args = parse_args()
+    processes = process_count(args.processes)
+    if args.client_type == "worker" and processes > 1:
+        run_worker_processes(args, processes)
+    else:
+        prefetch(args)
+        client = create_client(args, args.fargate_task, args.max_runtime)
+        if args.client_type == "master" and args.registry_bucket:
+            registry = MasterRegistry(
+                args.registry_bucket,
+                args.execution_id,
+                args.registry_prefix,
+                args.region,
+            )
+            gevent.spawn(registry.announce, args.master_host, args.master_port)
+        if args.client_type == "master" and args.pool_bucket:
+            queue = JobQueue(args.pool_bucket, args.pool_prefix, region=args.region)
+            client.start_pool(queue, args, args.pool_idle_timeout)
+        else:
+            client.start()
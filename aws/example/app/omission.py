@@ -0,0 +1,66 @@
+from histogram import LatencyHistogram
+from histogram import percentile_fraction
+
+
+class OmissionRecorder:
+    """Response times of rps stages measured from their intended send time, when CORRECTED_LATENCY is set"""
+
+    def __init__(self):
+        self.histogram = LatencyHistogram()
+        self.backfilled = 0
+
+    def record(self, user, intended, start, end):
+        """Record a request of a user, sent at start and intended at `intended` (None if unpaced)"""
+        sent = start if intended is None else min(start, intended)
+        self.histogram.record(round((end - sent) * 1000))
+        skipped = getattr(user, "skipped_slots", None)
+        if skipped is not None:
+            first, count, interval = skipped
+            user.skipped_slots = None
+            # Slot k completed (end - first - k * interval)s after it was due: a series, recorded by bucket
+            self.histogram.record_series((end - first) * 1000, interval * 1000, count)
+            self.backfilled += count
+
+    def on_report_to_master(self, client_id, data):
+        if self.histogram.total:
+            data["corrected_latency"] = {
+                "response_times": self.histogram.to_dict(),
+                "backfilled": self.backfilled,
+            }
+            self.histogram = LatencyHistogram()
+            self.backfilled = 0
+
+    def on_worker_report(self, client_id, data):
+        corrected = data.get("corrected_latency")
+        if corrected:
+            self.histogram.merge(
+                LatencyHistogram.from_dict(corrected["response_times"])
+            )
+            self.backfilled += corrected["backfilled"]
+
+    def reset(self):
+        """Start the next job from an empty histogram"""
+        self.histogram = LatencyHistogram()
+        self.backfilled = 0
+
+    def report(self, percentiles):
+        """Corrected distribution, next to the raw one of the results"""
+        values = self.histogram.percentiles(
+            [percentile_fraction(p) for p in percentiles]
+        )
+        return {
+            "num_samples": self.histogram.total,
+            "backfilled_samples": self.backfilled,
+            "response_time_histogram": self.histogram.to_dict(),
+            **{f"response_time_percentile_{p}": v for p, v in zip(percentiles, values)},
+        }
+
+    def register(self, env, node_type):
+        """Ship the corrected histogram from the workers, and merge it on the master"""
+        if node_type == "worker":
+            env.events.report_to_master.add_listener(self.on_report_to_master)
+        if node_type == "master":
+            env.events.worker_report.add_listener(self.on_worker_report)
+
+
+recorder = OmissionRecorder()
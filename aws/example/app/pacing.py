@@ -0,0 +1,86 @@
+import logging
+import random
+import time
+
+MAX_LAG_SLOTS = 2
+WARNING_INTERVAL = 5
+
+
+class Pacer:
+    """Open-loop request schedule of the users of a process during rps stages"""
+
+    def __init__(self):
+        self.interval = None
+        self.since = None
+        self.missed = 0
+        self.missed_total = 0
+        self.unreported = 0
+        self.last_warning = 0
+
+    def wait(self, user):
+        """Seconds until the next intended send time of the user"""
+        now = time.time()
+        intended = getattr(user, "intended_send", None)
+        if intended is None:
+            intended = now + random.uniform(0, self.interval)  # nosec
+        else:
+            intended += self.interval
+        lag = now - intended
+        if lag > self.interval * MAX_LAG_SLOTS:
+            first = max(intended, self.since)
+            missed = max(int((now - first) / self.interval), 0)
+            self.missed += missed
+            # First slot skipped, for the latency correction (see OmissionRecorder)
+            user.skipped_slots = (first, missed, self.interval)
+            intended = now
+        user.intended_send = intended
+        return max(intended - now, 0)
+
+    def on_pacing(self, environment, msg, **kwargs):
+        """Interval set by the master, None outside rps stages"""
+        if msg.data["interval"] != self.interval:
+            self.since = time.time()
+        self.interval = msg.data["interval"]
+
+    def on_report_to_master(self, client_id, data):
+        data["pacing_missed"] = self.missed
+        self.missed = 0
+
+    def on_worker_report(self, client_id, data):
+        """Add up the slots missed by the workers, with a warning at most every WARNING_INTERVAL seconds"""
+        missed = data.get("pacing_missed", 0)
+        self.missed_total += missed
+        self.unreported += missed
+        now = time.time()
+        if self.unreported and now - self.last_warning >= WARNING_INTERVAL:
+            logging.warning(
+                f"Workers could not keep up with the target rate: {self.unreported} requests "
+                f"not sent since the previous warning, {self.missed_total} in total"
+            )
+            self.unreported = 0
+            self.last_warning = now
+
+    def reset(self):
+        """Wait for the interval of the next job"""
+        self.interval = None
+        self.since = None
+        self.missed = 0
+        self.missed_total = 0
+        self.unreported = 0
+        self.last_warning = 0
+
+    @property
+    def total_missed(self):
+        return self.missed_total + self.missed
+
+    def register(self, env, node_type):
+        """Listen to pacing messages on nodes running users, and collect missed slots on the master"""
+        if node_type in ["worker", "local"]:
+            env.runner.register_message("pacing", self.on_pacing)
+        if node_type == "worker":
+            env.events.report_to_master.add_listener(self.on_report_to_master)
+        if node_type == "master":
+            env.events.worker_report.add_listener(self.on_worker_report)
+
+
+pacer = Pacer()
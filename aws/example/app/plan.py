@@ -0,0 +1,212 @@
+import argparse
+import copy
+import json
+import math
+import sys
+
+from schedule import CompiledShape
+from schedule import pacing_users
+from schedule import parse_shape
+from schedule import validate_stages
+from search import CapacitySearch
+
+MAX_SIMULATED_TIME = 7 * 24 * 3600
+
+
+def simulate(stages, mode="users", interpolation="step", step=1.0, latency=None):
+    """
+    Replay a shape the way StagesShape ticks it, without Locust. Users move toward the
+    target at the stage spawn rate; rps stages use the users needed at the given latency (seconds).
+    Return the timeline [(time, target, users)]
+    """
+    compiled = CompiledShape(stages, interpolation)
+    timeline = []
+    users = 0.0
+    current = 0
+    reached_at = None
+    t = 0.0
+    while t < MAX_SIMULATED_TIME:
+        if mode == "time":
+            state = compiled.tick(t)
+            if state is not None and stages[compiled.current].get("mode") == "rps":
+                state = (pacing_users(stages[compiled.current], latency), state[1])
+        else:
+            state = None
+            if current < len(stages):
+                stage = stages[current]
+                if round(users) == _stage_users(stage, latency):
+                    reached_at = t if reached_at is None else reached_at
+                    if t - reached_at > stage["duration"]:
+                        current += 1
+                        reached_at = None
+                state = (
+                    (
+                        _stage_users(stages[current], latency),
+                        stages[current]["spawn_rate"],
+                    )
+                    if current < len(stages)
+                    else None
+                )
+        if state is None:
+            break
+        target, spawn_rate = state
+        delta = max(min(target - users, spawn_rate * step), -spawn_rate * step)
+        users += delta
+        timeline.append((t, target, round(users)))
+        t += step
+    return timeline
+
+
+def search_stages(options):
+    """Stages of the heaviest probe of a search shape, which needs a maximum to be planned"""
+    search = CapacitySearch(**options.get("search", {}))
+    if search.maximum is None:
+        raise ValueError("Set search.maximum to plan a search shape")
+    return [search.probe(search.maximum), search.probe(0)]
+
+
+def _stage_users(stage, latency):
+    return (
+        pacing_users(stage, latency) if stage.get("mode") == "rps" else stage["users"]
+    )
+
+
+def summarize(stages, timeline, step=1.0):
+    """Duration, peak users, peak target rate of rps stages and user-seconds of a simulated shape"""
+    return {
+        "duration": len(timeline) * step,
+        "peak_users": max((u for _, _, u in timeline), default=0),
+        "peak_rps": max(
+            (s["rps"] for s in stages if s.get("mode") == "rps"), default=0
+        ),
+        "user_seconds": sum(u for _, _, u in timeline) * step,
+    }
+
+
+def size_fleet(
+    peak_users,
+    vcpus_per_worker=1.0,
+    users_per_vcpu=None,
+    rps_per_vcpu=None,
+    rps_per_user=None,
+    peak_rps=0,
+):
+    """
+    Minimum number of workers for a peak load, from a measured capacity per vCPU, either in users
+    or in requests per second. The rate of user stages needs rps_per_user; rps stages give it directly
+    """
+    if users_per_vcpu:
+        capacity = users_per_vcpu * vcpus_per_worker
+        return max(1, math.ceil(peak_users / capacity))
+    if rps_per_vcpu and (rps_per_user or peak_rps):
+        capacity = rps_per_vcpu * vcpus_per_worker
+        rate = max(peak_users * (rps_per_user or 0), peak_rps)
+        return max(1, math.ceil(rate / capacity))
+    raise ValueError(
+        "Capacity must be given in users or rps (with rps per user) per vCPU"
+    )
+
+
+def step_function_input(template, workers, vcpus_per_worker=1.0):
+    """
+    Step Function input for a number of workers. The template is a regular input with a single job,
+    which becomes the WorkerTemplate of all workers; the master expects all of them.
+    Each process forked by --processes joins the master as its own worker, so they are all counted
+    (--processes auto forks one per vCPU)
+    """
+    result = copy.deepcopy(template)
+    if "Jobs" in result:
+        result["WorkerTemplate"] = result.pop("Jobs")[0]
+    worker_command = result.get("WorkerTemplate", {}).get("WorkerCommand", [])
+    processes = 1
+    if "--processes" in worker_command:
+        value = worker_command[worker_command.index("--processes") + 1]
+        processes = (
+            max(int(vcpus_per_worker), 1) if value == "auto" else max(int(value), 1)
+        )
+    command = result["JobDetails"]["MasterCommand"]
+    expected = str(workers * processes)
+    if "--expected-workers" in command:
+        command[command.index("--expected-workers") + 1] = expected
+    else:
+        command += ["--expected-workers", expected]
+    result["WorkerCount"] = workers
+    return result
+
+
+def load_shape(location, region=None):
+    """Read a shape from a local file, or from S3 with an s3://bucket/key location"""
+    if location.startswith("s3://"):
+        import boto3
+
+        bucket, key = location[5:].split("/", 1)
+        obj = boto3.client("s3", region_name=region).get_object(Bucket=bucket, Key=key)
+        return json.loads(obj["Body"].read())
+    with open(location) as f:
+        return json.load(f)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Simulate a load shape and size the worker fleet"
+    )
+    parser.add_argument("shape", help="Shape file or s3://bucket/key")
+    parser.add_argument("--mode", default=None, choices=["users", "time"])
+    parser.add_argument("--vcpus-per-worker", type=float, default=1.0)
+    parser.add_argument("--users-per-vcpu", type=float, default=None)
+    parser.add_argument("--rps-per-vcpu", type=float, default=None)
+    parser.add_argument(
+        "--rps-per-user",
+        type=float,
+        default=None,
+        help="Measured requests per second of a single user",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=None,
+        help="Expected response time (seconds) to size rps stages",
+    )
+    parser.add_argument(
+        "--template", default=None, help="Step Function input with one job"
+    )
+    parser.add_argument("--timeline", action="store_true")
+    parser.add_argument("--region", default=None)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    stages, options = parse_shape(load_shape(args.shape, args.region))
+    mode = args.mode or options.get("mode", "users")
+    simulated = mode
+    if mode == "search":
+        stages, simulated = search_stages(options), "users"
+    validate_stages(stages, simulated)
+    timeline = simulate(
+        stages, simulated, options.get("interpolation", "step"), latency=args.latency
+    )
+    plan = summarize(stages, timeline)
+    plan["mode"] = mode
+    if args.users_per_vcpu or args.rps_per_vcpu:
+        plan["workers"] = size_fleet(
+            plan["peak_users"],
+            args.vcpus_per_worker,
+            args.users_per_vcpu,
+            args.rps_per_vcpu,
+            args.rps_per_user,
+            plan["peak_rps"],
+        )
+        if args.template:
+            with open(args.template) as f:
+                plan["input"] = step_function_input(
+                    json.load(f), plan["workers"], args.vcpus_per_worker
+                )
+    if args.timeline:
+        plan["timeline"] = timeline
+    json.dump(plan, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+import argparse
+import datetime
+import json
+import logging
+import os
+import time
+import uuid
+
+import gevent
+
+import services
+
+POLL_INTERVAL = 5
+
+
+class JobQueue:
+    """
+    Control channel of a warm pool: jobs are JSON objects in S3, run one at a time in key order.
+        PREFIX/pending/JOB_ID.json  submitted, job ids start with the UTC time
+        PREFIX/running/JOB_ID.json  picked up by the master
+        PREFIX/done/JOB_ID.json     finished, or PREFIX/failed/JOB_ID.json
+    A job overrides the settings of the master command:
+        {"shapes_key": "jobs/000002.json", "testdata_key": "data.csv", "host": "https://...", "method": "/hello"}
+    and {"stop": true} shuts the pool down
+    """
+
+    def __init__(
+        self, bucket, prefix, s3=None, region=None, poll_interval=POLL_INTERVAL
+    ):
+        self.bucket = bucket
+        self.prefix = prefix.rstrip("/")
+        self.s3 = s3 or services.client("s3", region)
+        self.poll_interval = poll_interval
+
+    def submit(self, job):
+        """Add a job to the queue. Return its id"""
+        job_id = (
+            datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
+            + "-"
+            + uuid.uuid4().hex[:8]
+        )
+        self._put("pending", job_id, job)
+        return job_id
+
+    def next(self, idle_timeout=None):
+        """
+        Wait for the oldest pending job and move it to running. Return (job_id, job),
+        or None after idle_timeout seconds without job. Unreadable jobs are moved to failed
+        """
+        start_time = time.time()
+        while True:
+            response = self.s3.list_objects_v2(
+                Bucket=self.bucket, Prefix=f"{self.prefix}/pending/", MaxKeys=1
+            )
+            if response.get("Contents"):
+                key = response["Contents"][0]["Key"]
+                job_id = key.rsplit("/", 1)[1][: -len(".json")]
+                try:
+                    job = json.loads(
+                        self.s3.get_object(Bucket=self.bucket, Key=key)["Body"].read()
+                    )
+                    if not isinstance(job, dict):
+                        raise ValueError("A job must be a JSON object")
+                except Exception as e:
+                    # Otherwise a pool restarted on the same queue fails on it again
+                    logging.exception(f"Cannot read job {job_id}")
+                    self._put("failed", job_id, {"error": str(e)})
+                    self.s3.delete_object(Bucket=self.bucket, Key=key)
+                    continue
+                self._put("running", job_id, job)
+                self.s3.delete_object(Bucket=self.bucket, Key=key)
+                logging.info(f"Starting job {job_id}")
+                return job_id, job
+            if idle_timeout and time.time() - start_time > idle_timeout:
+                return None
+            gevent.sleep(self.poll_interval)
+
+    def finish(self, job_id, job, error=None):
+        """Move a job from running to done, or to failed with the error"""
+        if error is not None:
+            job = dict(job, error=str(error))
+        self._put("failed" if error is not None else "done", job_id, job)
+        self.s3.delete_object(
+            Bucket=self.bucket, Key=f"{self.prefix}/running/{job_id}.json"
+        )
+
+    def _put(self, state, job_id, job):
+        self.s3.put_object(
+            Bucket=self.bucket,
+            Key=f"{self.prefix}/{state}/{job_id}.json",
+            Body=json.dumps(job),
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Submit a job to a warm pool")
+    parser.add_argument("--bucket", required=True)
+    parser.add_argument("--prefix", required=True)
+    parser.add_argument("--job", default=None, help="JSON file of the job settings")
+    parser.add_argument("--stop", action="store_true", help="Shut the pool down")
+    parser.add_argument(
+        "--region", default=os.environ.get("AWS_REGION", "ap-southeast-1")
+    )
+    args = parser.parse_args()
+    if args.stop:
+        job = {"stop": True}
+    else:
+        with open(args.job) as f:
+            job = json.load(f)
+    print(JobQueue(args.bucket, args.prefix, region=args.region).submit(job))
@@ -0,0 +1,87 @@
+import json
+import logging
+import os
+import socket
+import urllib.request
+
+import services
+
+REGISTRY_PREFIX = "_registry"
+
+
+def registry_key(prefix, execution_id, name):
+    return f"{prefix.rstrip('/')}/{execution_id}/{name}"
+
+
+def task_address(bind_host):
+    """
+    Task ARN and private IP of the container, from the ECS task metadata endpoint.
+    Outside ECS, the bind address or the address of the host name
+    """
+    uri = os.environ.get("ECS_CONTAINER_METADATA_URI_V4")
+    if uri:
+        try:
+            with urllib.request.urlopen(f"{uri}/task", timeout=2) as response:  # nosec
+                task = json.load(response)
+            network = task["Containers"][0]["Networks"][0]
+            return task.get("TaskARN"), network["IPv4Addresses"][0]
+        except (OSError, ValueError, KeyError, IndexError) as e:
+            logging.warning(f"Task metadata not available: {e}")
+    if bind_host not in ["0.0.0.0", ""]:  # nosec
+        return None, bind_host
+    return None, socket.gethostbyname(socket.gethostname())
+
+
+class MasterRegistry:
+    """
+    Announce the master to the Step Function as soon as it listens, instead of waiting for the next poll.
+    The master writes master.json and the register Lambda writes the task token of the execution
+    in token.json, under <prefix>/<execution_id>/. Whichever comes second completes the token
+    """
+
+    def __init__(self, bucket, execution_id, prefix=REGISTRY_PREFIX, region=None):
+        self.bucket = bucket
+        self.execution_id = execution_id
+        self.prefix = prefix
+        self.s3 = services.client("s3", region)
+        self.sfn = services.client("stepfunctions", region)
+
+    def announce(self, bind_host, port):
+        task_arn, ip = task_address(bind_host)
+        master = {
+            "ExecutionId": self.execution_id,
+            "MasterStatus": "RUNNING",
+            "MasterPrivateIp": ip,
+            "MasterPort": port,
+            "MasterTaskArn": task_arn,
+        }
+        self.s3.put_object(
+            Bucket=self.bucket,
+            Key=registry_key(self.prefix, self.execution_id, "master.json"),
+            Body=json.dumps(master),
+        )
+        token = self._token()
+        if token:
+            self._complete(token, master)
+        logging.info(f"Master registered as {ip}:{port}")
+        return master
+
+    def _token(self):
+        try:
+            obj = self.s3.get_object(
+                Bucket=self.bucket,
+                Key=registry_key(self.prefix, self.execution_id, "token.json"),
+            )
+        except self.s3.exceptions.NoSuchKey:
+            return None
+        return json.loads(obj["Body"].read())["TaskToken"]
+
+    def _complete(self, token, master):
+        try:
+            self.sfn.send_task_success(taskToken=token, output=json.dumps(master))
+        except (
+            self.sfn.exceptions.InvalidToken,
+            self.sfn.exceptions.TaskDoesNotExist,
+            self.sfn.exceptions.TaskTimedOut,
+        ) as e:
+            logging.info(f"Registration already completed: {e}")
@@ -0,0 +1,139 @@
+import argparse
+import datetime
+import json
+import os
+import tempfile
+import uuid
+from urllib.parse import quote
+from urllib.parse import unquote
+
+import services
+
+MULTIPART_THRESHOLD = 8 * 1024 * 1024
+
+
+class ResultStore:
+    """
+    Append-only results layout. Every run writes its own objects, so concurrent runs never overwrite each other:
+        PREFIX/runs/EXECUTION_ID/RUN_ID/summary.json    results without the history
+        PREFIX/runs/EXECUTION_ID/RUN_ID/history.ndjson  one history row per line
+        PREFIX/manifest/RUN_ID/EXECUTION_ID/NUM_REQUESTS/TIME   index entry, listed to find runs
+    The fields of a manifest entry are in its key, so listing runs reads no object.
+    Run ids start with the UTC time, so listing returns runs in chronological order
+    """
+
+    def __init__(self, bucket, prefix, s3=None, region=None):
+        self.bucket = bucket
+        self.prefix = prefix.rstrip("/")
+        self.s3 = s3 or services.client("s3", region)
+
+    def save(self, results, execution_id=None):
+        """Upload the results of a run and its manifest entry. Return the run id"""
+        execution_id = execution_id or os.environ.get("EXECUTION_ID", "local")
+        run_id = (
+            datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
+            + "-"
+            + uuid.uuid4().hex[:8]
+        )
+        location = f"{self.prefix}/runs/{execution_id}/{run_id}"
+        summary = {k: v for k, v in results.items() if k != "history"}
+        self.s3.put_object(
+            Bucket=self.bucket,
+            Key=f"{location}/summary.json",
+            Body=json.dumps(summary),
+        )
+        self._upload_lines(f"{location}/history.ndjson", results.get("history", []))
+        entry = {
+            "run_id": run_id,
+            "execution_id": execution_id,
+            "location": location,
+            "time": results.get("time"),
+            "num_requests": results.get("num_requests"),
+        }
+        fields = [run_id, execution_id, entry["num_requests"], entry["time"]]
+        self.s3.put_object(
+            Bucket=self.bucket,
+            Key=f"{self.prefix}/manifest/"
+            + "/".join(quote(str(field), safe="") for field in fields),
+            Body=json.dumps(entry),
+        )
+        return run_id
+
+    def list_runs(self, run_id=""):
+        """Manifest entries of all runs (or of a run id), oldest first"""
+        runs = []
+        paginator = self.s3.get_paginator("list_objects_v2")
+        for page in paginator.paginate(
+            Bucket=self.bucket, Prefix=f"{self.prefix}/manifest/{run_id}"
+        ):
+            for obj in page.get("Contents", []):
+                runs.append(self._entry(obj["Key"]))
+        return runs
+
+    def load_run(self, run_id, history=True):
+        """Results of a single run, in the report format"""
+        entries = self.list_runs(run_id)
+        if not entries:
+            raise KeyError(f"No run {run_id} in s3://{self.bucket}/{self.prefix}")
+        entry = entries[0]
+        results = self._get_json(f"{entry['location']}/summary.json")
+        if history:
+            obj = self.s3.get_object(
+                Bucket=self.bucket, Key=f"{entry['location']}/history.ndjson"
+            )
+            results["history"] = [
+                json.loads(line) for line in obj["Body"].iter_lines() if line
+            ]
+        return results
+
+    def _upload_lines(self, key, rows):
+        """Stream rows as newline-delimited JSON. Large histories are uploaded in multiple parts"""
+        from boto3.s3.transfer import TransferConfig
+
+        with tempfile.SpooledTemporaryFile(max_size=MULTIPART_THRESHOLD) as f:
+            for row in rows:
+                f.write(json.dumps(row).encode())
+                f.write(b"\n")
+            f.seek(0)
+            self.s3.upload_fileobj(
+                f,
+                self.bucket,
+                key,
+                Config=TransferConfig(multipart_threshold=MULTIPART_THRESHOLD),
+            )
+
+    def _entry(self, key):
+        """Manifest entry from its key. Entries written before the fields were in the key are read"""
+        name = key[len(self.prefix) + len("/manifest/") :]
+        if name.endswith(".json"):
+            return self._get_json(key)
+        run_id, execution_id, num_requests, time = [unquote(x) for x in name.split("/")]
+        return {
+            "run_id": run_id,
+            "execution_id": execution_id,
+            "location": f"{self.prefix}/runs/{execution_id}/{run_id}",
+            "time": None if time == "None" else time,
+            "num_requests": None if num_requests == "None" else int(num_requests),
+        }
+
+    def _get_json(self, key):
+        obj = self.s3.get_object(Bucket=self.bucket, Key=key)
+        return json.loads(obj["Body"].read())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="List or load stored load test runs")
+    parser.add_argument("--bucket", required=True)
+    parser.add_argument("--prefix", required=True)
+    parser.add_argument("--run-id", default=None)
+    parser.add_argument("--no-history", action="store_true")
+    parser.add_argument(
+        "--region", default=os.environ.get("AWS_REGION", "ap-southeast-1")
+    )
+    args = parser.parse_args()
+    store = ResultStore(args.bucket, args.prefix, region=args.region)
+    if args.run_id:
+        print(json.dumps(store.load_run(args.run_id, history=not args.no_history)))
+    else:
+        for run in store.list_runs():
+            print(json.dumps(run))
@@ -0,0 +1,240 @@
+import logging
+import random
+import time
+
+import gevent
+from locust.rpc import Message
+from locust.runners import MasterRunner
+from locust.runners import STATE_RUNNING
+from locust.runners import STATE_SPAWNING
+
+CPU_THRESHOLD = 90
+LAG_THRESHOLD_MS = 50
+# A capped worker gets its users back once its load drops under this fraction of the thresholds
+RELEASE_FRACTION = 0.5
+PROBE_INTERVAL = 0.1
+
+
+class LoopProbe:
+    """CPU usage, event-loop lag and scheduling delay of the process, sampled by a greenlet"""
+
+    def __init__(self):
+        self.reset()
+        self.greenlet = None
+
+    def reset(self):
+        self.started = time.time()
+        self.cpu = time.process_time()
+        self.lag_max = 0.0
+        self.delay_max = 0.0
+
+    def start(self):
+        if self.greenlet is None:
+            self.reset()
+            self.greenlet = gevent.spawn(self._run)
+
+    def _run(self):
+        while True:
+            # Jittered, so the samples do not fall in step with periodic work of the users
+            interval = PROBE_INTERVAL * random.uniform(0.5, 1.5)  # nosec
+            before = time.perf_counter()
+            gevent.sleep(interval)
+            lag = max(time.perf_counter() - before - interval, 0)
+            before = time.perf_counter()
+            gevent.sleep(0)
+            delay = time.perf_counter() - before
+            self.lag_max = max(self.lag_max, lag)
+            self.delay_max = max(self.delay_max, delay)
+
+    def collect(self):
+        """Load since the previous call"""
+        elapsed = time.time() - self.started
+        cpu = time.process_time() - self.cpu
+        load = {
+            "cpu_percent": round(100 * cpu / elapsed, 1) if elapsed > 0 else 0,
+            "loop_lag_ms": round(1000 * self.lag_max, 1),
+            "scheduling_delay_ms": round(1000 * self.delay_max, 1),
+        }
+        self.reset()
+        return load
+
+
+class SaturationMonitor:
+    """Tell when the load generator, not the target, limits the test"""
+
+    def __init__(
+        self,
+        cpu_threshold=CPU_THRESHOLD,
+        lag_threshold_ms=LAG_THRESHOLD_MS,
+        rebalance=False,
+    ):
+        self.cpu_threshold = float(cpu_threshold)
+        self.lag_threshold_ms = float(lag_threshold_ms)
+        self.rebalance = rebalance
+        self.probe = LoopProbe()
+        self.runner = None
+        self.local_runner = None
+        self.reset()
+
+    def reset(self):
+        """Drop the load and caps of the workers, before the next job"""
+        self.latest = {}
+        self.interval = {}
+        self.peaks = {}
+        self.caps = {}
+        self.saturated_intervals = 0
+
+    def saturated(self, load, users):
+        """Only while running users: startup work does not delay any request"""
+        return users > 0 and (
+            load["cpu_percent"] >= self.cpu_threshold
+            or load["loop_lag_ms"] >= self.lag_threshold_ms
+        )
+
+    def relieved(self, load):
+        return (
+            load["cpu_percent"] < self.cpu_threshold * RELEASE_FRACTION
+            and load["loop_lag_ms"] < self.lag_threshold_ms * RELEASE_FRACTION
+        )
+
+    def cap(self, load, users):
+        """Share of its current users a saturated worker keeps, from how far over the thresholds it is"""
+        share = min(
+            1,
+            self.cpu_threshold / max(load["cpu_percent"], 1),
+            self.lag_threshold_ms / max(load["loop_lag_ms"], 1),
+        )
+        return int(users * share)
+
+    def on_report_to_master(self, client_id, data):
+        data["load"] = self.probe.collect()
+
+    def on_worker_report(self, client_id, data):
+        load = data.get("load")
+        if load is None:
+            return
+        self.add(client_id, load, data.get("user_count", 0))
+
+    def add(self, worker, load, users):
+        was_saturated = worker in self.latest and self.latest[worker]["saturated"]
+        load = dict(load, users=users, saturated=self.saturated(load, users))
+        self.latest[worker] = load
+        interval = self.interval.setdefault(worker, dict(load))
+        for name in ["cpu_percent", "loop_lag_ms", "scheduling_delay_ms"]:
+            interval[name] = max(interval[name], load[name])
+        interval["saturated"] = interval["saturated"] or load["saturated"]
+        peaks = self.peaks.setdefault(worker, {"saturated_reports": 0})
+        for name in ["cpu_percent", "loop_lag_ms", "scheduling_delay_ms"]:
+            peaks[name] = max(peaks.get(name, 0), load[name])
+        if load["saturated"]:
+            peaks["saturated_reports"] += 1
+            self.caps[worker] = self.cap(load, users)
+        elif worker in self.caps and self.relieved(load):
+            del self.caps[worker]
+        if load["saturated"] and not was_saturated:
+            logging.warning(
+                f"Worker {worker} is saturated ({load['cpu_percent']}% CPU, "
+                f"{load['loop_lag_ms']}ms event-loop lag with {users} users): "
+                "its response times include the time requests wait for the process"
+            )
+            if self.rebalance and self.runner is not None:
+                gevent.spawn(self.runner.rebalance)
+
+    def collect(self):
+        """Load of the workers during the interval since the previous call, for the history"""
+        if self.local_runner is not None:
+            self.add("local", self.probe.collect(), self.local_runner.user_count)
+        loads = list(self.interval.values())
+        self.interval = {}
+        saturated = sum(1 for load in loads if load["saturated"])
+        if saturated:
+            self.saturated_intervals += 1
+        return {
+            "saturated_workers": saturated,
+            "worker_cpu_percent": max(
+                (load["cpu_percent"] for load in loads), default=0
+            ),
+            "loop_lag_ms": max((load["loop_lag_ms"] for load in loads), default=0),
+            "scheduling_delay_ms": max(
+                (load["scheduling_delay_ms"] for load in loads), default=0
+            ),
+        }
+
+    def allocate(self, user_count, workers):
+        """
+        Users of each of the workers (ids) for a total of user_count, at most their cap for saturated workers.
+        None when no worker is capped, or all are
+        """
+        capped = {
+            worker: self.caps[worker] for worker in workers if worker in self.caps
+        }
+        free = [worker for worker in workers if worker not in capped]
+        if not capped or not free:
+            return None
+        even = user_count // len(workers)
+        allocation = {worker: min(cap, even) for worker, cap in capped.items()}
+        remaining = user_count - sum(allocation.values())
+        for idx, worker in enumerate(sorted(free)):
+            allocation[worker] = remaining // len(free) + (idx < remaining % len(free))
+        return allocation
+
+    def summary(self):
+        return {
+            "cpu_threshold": self.cpu_threshold,
+            "lag_threshold_ms": self.lag_threshold_ms,
+            "saturated_intervals": self.saturated_intervals,
+            "workers": self.peaks,
+        }
+
+    def register(self, env, node_type):
+        """Sample the load on nodes running users, and collect it on the master"""
+        if node_type in ["worker", "local"]:
+            self.probe.start()
+        if node_type == "local":
+            self.local_runner = env.runner
+        if node_type == "worker":
+            env.events.report_to_master.add_listener(self.on_report_to_master)
+        if node_type == "master":
+            self.runner = env.runner
+            env.events.worker_report.add_listener(self.on_worker_report)
+
+
+class BalancedMasterRunner(MasterRunner):
+    """Master runner sending fewer users to saturated workers, when its monitor rebalances"""
+
+    monitor = None
+
+    def start(self, user_count, spawn_rate):
+        workers = self.clients.ready + self.clients.running + self.clients.spawning
+        allocation = None
+        if self.monitor is not None and self.monitor.rebalance:
+            allocation = self.monitor.allocate(
+                user_count, [worker.id for worker in workers]
+            )
+        if allocation is None or self.state not in [STATE_RUNNING, STATE_SPAWNING]:
+            return super(BalancedMasterRunner, self).start(user_count, spawn_rate)
+        logging.info(
+            f"Spawning {user_count} users away from saturated workers: {allocation}"
+        )
+        self.target_user_count = user_count
+        self.spawn_rate = spawn_rate
+        for worker in workers:
+            # Each worker spawns its users over the same time, whatever its share
+            share = (
+                allocation[worker.id] / user_count
+                if allocation[worker.id] and user_count
+                else 1.0 / len(workers)
+            )
+            data = {
+                "spawn_rate": float(spawn_rate) * share,
+                "num_users": allocation[worker.id],
+                "host": self.environment.host,
+                "stop_timeout": self.environment.stop_timeout,
+            }
+            self.server.send_to_client(Message("spawn", data, worker.id))
+        self.update_state(STATE_SPAWNING)
+
+    def rebalance(self):
+        """Move the users of the current stage away from the workers that became saturated"""
+        if self.state in [STATE_RUNNING, STATE_SPAWNING] and self.target_user_count:
+            self.start(self.target_user_count, self.spawn_rate)
@@ -0,0 +1,157 @@
+import bisect
+import math
+
+MODES = ["users", "time", "search"]
+STAGE_MODES = ["users", "rps"]
+INTERPOLATIONS = ["step", "linear", "spline"]
+PACING_HEADROOM = 1.5
+PACING_LATENCY = 0.25
+
+
+def parse_shape(document):
+    """
+    A shape is either a list of stages, or an object with options:
+        {"mode": "time", "interpolation": "linear", "stages": [...]}
+    Return the stages and the options
+    """
+    if isinstance(document, list):
+        return document, {}
+    if isinstance(document, dict) and document.get("mode") == "search":
+        return [], {k: v for k, v in document.items() if k != "stages"}
+    if not isinstance(document, dict) or "stages" not in document:
+        raise ValueError("Shape must be a list of stages or an object with stages")
+    options = {k: v for k, v in document.items() if k != "stages"}
+    return document["stages"], options
+
+
+def validate_stages(stages, mode="users"):
+    """
+    Check stages before running them:
+        users >= 0 (or rps >= 0 for rps stages), spawn_rate > 0 and duration > 0 on every stage
+        durations are the stage end times in time mode, so they must increase
+        the last stage must bring users back to 0
+    """
+    if not isinstance(stages, list) or len(stages) == 0:
+        raise ValueError("Shape must have at least one stage")
+    for i, stage in enumerate(stages):
+        if stage.get("mode", "users") not in STAGE_MODES:
+            raise ValueError(f"Stage {i}: mode must be one of {', '.join(STAGE_MODES)}")
+        target = stage_target(stage)
+        for field in [target, "spawn_rate", "duration"]:
+            if not isinstance(stage.get(field), (int, float)):
+                raise ValueError(f"Stage {i}: {field} must be a number")
+        if stage[target] < 0:
+            raise ValueError(f"Stage {i}: {target} must be positive")
+        if stage["spawn_rate"] <= 0 or stage["duration"] <= 0:
+            raise ValueError(
+                f"Stage {i}: spawn_rate and duration must be greater than 0"
+            )
+        if mode == "time" and i > 0 and stage["duration"] <= stages[i - 1]["duration"]:
+            raise ValueError(
+                f"Stage {i}: durations must increase in time mode ({stage['duration']} after {stages[i - 1]['duration']})"
+            )
+    if stages[-1][stage_target(stages[-1])] != 0:
+        raise ValueError("The last stage must have 0 users to end the test")
+    return stages
+
+
+def stage_target(stage):
+    """Field holding the load of a stage"""
+    return "rps" if stage.get("mode") == "rps" else "users"
+
+
+def pacing_users(stage, latency=None):
+    """
+    Minimum users holding the rate of an rps stage. By Little's law a rate R with a response time L
+    keeps R * L requests in flight; headroom absorbs latency variations.
+    min_users and max_users bound the result
+    """
+    if stage["rps"] <= 0:
+        return 0
+    users = math.ceil(stage["rps"] * (latency or PACING_LATENCY) * PACING_HEADROOM)
+    users = max(users, stage.get("min_users", 1))
+    return min(users, stage.get("max_users", users))
+
+
+class CompiledShape:
+    """
+    Stages compiled for time-based lookup. Stage i runs from the end of stage i - 1 until its duration.
+        step: users of the current stage
+        linear: users ramp from the current stage to the next one over the stage
+        spline: monotone cubic curve through the stage starts, never overshooting the points
+    The current stage is found by bisecting the stage end times, starting from the last stage found
+    """
+
+    def __init__(self, stages, interpolation="step"):
+        if interpolation not in INTERPOLATIONS:
+            raise ValueError(
+                f"Interpolation must be one of {', '.join(INTERPOLATIONS)}"
+            )
+        self.interpolation = interpolation
+        self.ends = [float(s["duration"]) for s in stages]
+        self.starts = [0.0] + self.ends[:-1]
+        self.users = [float(s.get("users", 0)) for s in stages]
+        self.spawn_rates = [s["spawn_rate"] for s in stages]
+        self.tangents = self._tangents() if interpolation == "spline" else None
+        self.current = 0
+
+    def stage_at(self, run_time):
+        """Index of the stage running at run_time, None once the last stage is over"""
+        i = self.current
+        if not (self.starts[i] <= run_time < self.ends[i]):
+            i = bisect.bisect_right(self.ends, run_time)
+            if i >= len(self.ends):
+                return None
+            self.current = i
+        return i
+
+    def users_at(self, run_time, i):
+        if self.interpolation == "step" or i + 1 >= len(self.users):
+            return self.users[i]
+        span = self.ends[i] - self.starts[i]
+        t = (run_time - self.starts[i]) / span
+        u0, u1 = self.users[i], self.users[i + 1]
+        if self.interpolation == "linear":
+            return u0 + (u1 - u0) * t
+        m0, m1 = self.tangents[i] * span, self.tangents[i + 1] * span
+        t2, t3 = t * t, t * t * t
+        return (
+            (2 * t3 - 3 * t2 + 1) * u0
+            + (t3 - 2 * t2 + t) * m0
+            + (-2 * t3 + 3 * t2) * u1
+            + (t3 - t2) * m1
+        )
+
+    def tick(self, run_time):
+        """(users, spawn_rate) at run_time, None once the shape is over"""
+        i = self.stage_at(run_time)
+        if i is None:
+            return None
+        return (max(int(round(self.users_at(run_time, i))), 0), self.spawn_rates[i])
+
+    def _tangents(self):
+        """Fritsch-Carlson tangents (users per second) at each stage start"""
+        n = len(self.users)
+        slopes = [
+            (self.users[i + 1] - self.users[i]) / (self.starts[i + 1] - self.starts[i])
+            for i in range(n - 1)
+        ]
+        if not slopes:
+            return [0.0]
+        tangents = (
+            [slopes[0]]
+            + [
+                0.0 if s0 * s1 <= 0 else (s0 + s1) / 2
+                for s0, s1 in zip(slopes, slopes[1:])
+            ]
+            + [slopes[-1]]
+        )
+        for i, slope in enumerate(slopes):
+            if slope == 0:
+                tangents[i] = tangents[i + 1] = 0.0
+                continue
+            a, b = tangents[i] / slope, tangents[i + 1] / slope
+            if a * a + b * b > 9:
+                scale = 3 / (a * a + b * b) ** 0.5
+                tangents[i], tangents[i + 1] = scale * a * slope, scale * b * slope
+        return tangents
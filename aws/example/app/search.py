@@ -0,0 +1,148 @@
+import logging
+
+TARGETS = ["users", "rps"]
+
+
+class CapacitySearch:
+    """
+    Find the highest load the target sustains, one probe stage at a time.
+    The load starts at `start` and is multiplied by `factor` (or increased by `step`) while probes pass,
+    up to `maximum`. After the first failing probe, the load is bisected between the last passing
+    and the first failing one until they are less than `precision` (relative) or `resolution` apart.
+    Each probe holds its load for `duration` seconds once all its users run. A probe whose users
+    are not all running after `ramp_timeout` seconds (default: duration) fails.
+    A probe passes when, over its steady window, the `percentile` response time stays under
+    `latency_ms`, the failure rate under `max_failure_rate`, and for rps probes the achieved
+    rate reaches `min_throughput_ratio` of the target
+    """
+
+    def __init__(
+        self,
+        target="users",
+        start=10,
+        factor=2.0,
+        step=None,
+        maximum=None,
+        precision=0.05,
+        resolution=1,
+        duration=60,
+        ramp_timeout=None,
+        spawn_rate=20,
+        max_users=None,
+        percentile="95",
+        latency_ms=1000,
+        max_failure_rate=0.01,
+        min_throughput_ratio=0.95,
+        max_probes=30,
+    ):
+        if target not in TARGETS:
+            raise ValueError(f"Search target must be one of {', '.join(TARGETS)}")
+        if start <= 0 or duration <= 0 or spawn_rate <= 0:
+            raise ValueError(
+                "Search start, duration and spawn_rate must be greater than 0"
+            )
+        if step is None and factor <= 1:
+            raise ValueError("Search factor must be greater than 1")
+        if step is not None and step <= 0:
+            raise ValueError("Search step must be greater than 0")
+        self.target = target
+        self.start = start
+        self.factor = factor
+        self.step = step
+        self.maximum = maximum
+        self.precision = precision
+        self.resolution = resolution
+        self.duration = duration
+        self.ramp_timeout = ramp_timeout or duration
+        self.spawn_rate = spawn_rate
+        self.max_users = max_users
+        self.percentile = str(percentile)
+        self.latency_ms = latency_ms
+        self.max_failure_rate = max_failure_rate
+        self.min_throughput_ratio = min_throughput_ratio
+        self.max_probes = max_probes
+        self.probes = []
+        self.passed = None
+        self.failed = None
+        self.done = False
+
+    def probe(self, level):
+        """Stage holding a load level"""
+        if self.target == "rps":
+            stage = {"mode": "rps", "rps": level}
+            if self.max_users:
+                stage["max_users"] = self.max_users
+        else:
+            stage = {"users": level}
+        stage.update(duration=self.duration, spawn_rate=self.spawn_rate)
+        return stage
+
+    def passes(self, level, result):
+        if not result["steady"] or result["num_requests"] == 0:
+            return False
+        if result[f"response_time_percentile_{self.percentile}"] > self.latency_ms:
+            return False
+        if result["failure_rate"] > self.max_failure_rate:
+            return False
+        if self.target == "rps":
+            return result["requests_per_second"] >= level * self.min_throughput_ratio
+        return True
+
+    def record(self, level, result):
+        """Judge a probe from its stage metrics. Return the next level, None once the search is over"""
+        passed = self.passes(level, result)
+        self.probes.append(dict(result, level=level, passed=passed))
+        if passed:
+            self.passed = level
+        else:
+            self.failed = level if self.failed is None else min(self.failed, level)
+        next_level = self._next_level(level)
+        logging.info(
+            f"Capacity search: {level} {self.target} {'passed' if passed else 'failed'} "
+            f"(p{self.percentile} {result[f'response_time_percentile_{self.percentile}']}ms, "
+            f"{result['failure_rate']:.2%} failures, {result['requests_per_second']} rps), "
+            + (f"next {next_level}" if next_level is not None else "done")
+        )
+        if next_level is None:
+            self.done = True
+        return next_level
+
+    def _next_level(self, level):
+        if len(self.probes) >= self.max_probes:
+            return None
+        if self.failed is None:
+            if self.maximum is not None and level >= self.maximum:
+                return None
+            next_level = level + self.step if self.step else level * self.factor
+            if self.maximum is not None:
+                next_level = min(next_level, self.maximum)
+            return self._round(next_level)
+        low = self.passed or 0
+        if self.failed - low <= max(self.resolution, low * self.precision):
+            return None
+        middle = self._round((low + self.failed) / 2)
+        if middle <= low or middle >= self.failed:
+            return None
+        return middle
+
+    def _round(self, level):
+        return max(
+            int(round(level / self.resolution)) * self.resolution, self.resolution
+        )
+
+    def report(self):
+        """Highest passing probe and the latency curve of all probes, by load"""
+        best = None
+        for probe in self.probes:
+            if probe["passed"] and (best is None or probe["level"] > best["level"]):
+                best = probe
+        return {
+            "target": self.target,
+            "slo": {
+                f"response_time_percentile_{self.percentile}": self.latency_ms,
+                "max_failure_rate": self.max_failure_rate,
+            },
+            "max_sustainable": best,
+            "max_sustainable_rps": best["requests_per_second"] if best else 0,
+            "curve": sorted(self.probes, key=lambda probe: probe["level"]),
+        }
@@ -0,0 +1,33 @@
+import os
+import threading
+
+_session = None
+_clients = {}
+_lock = threading.Lock()
+
+
+def client(service, region=None):
+    """
+    AWS client shared by the whole process, created on first use from a single boto3 session.
+    boto3 itself is only imported then. Forked worker processes start with an empty cache,
+    as connections of the parent cannot be shared
+    """
+    global _session
+    region = region or os.environ.get("AWS_REGION")
+    with _lock:
+        if (service, region) not in _clients:
+            if _session is None:
+                import boto3
+
+                _session = boto3.session.Session()
+            _clients[(service, region)] = _session.client(service, region_name=region)
+        return _clients[(service, region)]
+
+
+def _reset():
+    global _session
+    _session = None
+    _clients.clear()
+
+
+os.register_at_fork(after_in_child=_reset)
@@ -1,12 +1,29 @@
-import csv
 import json
 import os
+import time
 
-import boto3
+import gevent
 from locust import between
 from locust import LoadTestShape
 from locust import task
 from locust.contrib.fasthttp import FastHttpUser
+from locust.event import EventHook
+
+from dataset import load_dataset
+from dataset import parse_shard
+from history import StageMetrics
+from omission import recorder
+from pacing import pacer
+from schedule import CompiledShape
+from schedule import pacing_users
+from schedule import parse_shape
+from schedule import validate_stages
+from search import CapacitySearch
+import services
+from traffic import default_headers
+from traffic import load_plan
+
+_downloaded_stages = {}
 
 
 class StagesShape(LoadTestShape):
@@ -21,6 +38,15 @@ class StagesShape(LoadTestShape):
         {"duration": 180, "users": 100, "spawn_rate": 100},
         {"duration": 210, "users": 0, "spawn_rate": 100}
     ]
+    or, with options:
+    {"mode": "time", "interpolation": "linear", "stages": [...]}
+    A stage can target a request rate instead of users, using as few users as the response time allows:
+        {"mode": "rps", "duration": 60, "rps": 2000, "spawn_rate": 100, "max_users": 5000}
+    or search the highest load sustained under a latency and failure SLO (see CapacitySearch):
+    {"mode": "search", "search": {"target": "rps", "start": 100, "latency_ms": 500, "max_failure_rate": 0.01}}
+    stage_events fires with kind="start", "steady" (the users of the stage are all running) or "end",
+    stage=<index> and timestamp, from the node running the shape. Stages of interpolated time shapes
+    are never steady
     """
 
     time_limit = 600
@@ -28,21 +54,119 @@ class StagesShape(LoadTestShape):
     stop_at_end = True
     stages = []
 
-    def __init__(self, stages_bucket, stages_key, mode="users", *args, **kwargs):
-        self.s3 = boto3.client("s3", region_name=os.environ["AWS_REGION"])
-        self.stages = self.download_stages(stages_bucket, stages_key)
+    def __init__(
+        self,
+        stages_bucket,
+        stages_key,
+        mode="users",
+        interpolation="step",
+        *args,
+        **kwargs,
+    ):
+        stages, options = parse_shape(self.download_stages(stages_bucket, stages_key))
+        self.mode = options.get("mode", mode)
+        self.search = None
+        self.probes = None
+        if self.mode == "search":
+            self.search = CapacitySearch(**options.get("search", {}))
+            self.stages = [self.search.probe(self.search.start)]
+        else:
+            self.stages = validate_stages(stages, self.mode)
+        self.compiled = CompiledShape(
+            self.stages, options.get("interpolation", interpolation)
+        )
         self.step = 0
         self.time_active = False
         self.runner = None
-        self.mode = mode
+        self.rps_users = {}
+        self.pacing_interval = None
+        self.stage_events = EventHook()
+        self.current_stage = None
+        self.stage_start = None
+        self.steady = False
         super(StagesShape, self).__init__(*args, **kwargs)
 
     def tick(self):
         """Called at every tick to control user spawning"""
         if self.mode == "time":
-            return self.tick_time()
+            state = self.tick_time()
+            stage = self.compiled.current
+        else:
+            if self.search is not None:
+                self.next_probe()
+            stage = self.step
+            state = self.tick_users()
+        if state is not None and self.stages[stage].get("mode") == "rps":
+            users = self.stage_users(stage)
+            self.set_pacing(users / self.stages[stage]["rps"] if users else None)
+            state = (users, state[1])
         else:
-            return self.tick_users()
+            self.set_pacing(None)
+        self.track_stage(stage, state)
+        return state
+
+    def next_probe(self):
+        """Search mode: when a probe is over, judge it from its steady window and queue the next one"""
+        if self.probes is None and self.runner is not None:
+            self.probes = StageMetrics(
+                [self.search.percentile], self.runner.stats, self.stages
+            )
+            self.stage_events.add_listener(self.probes.on_stage)
+        if self.search.done or self.probes is None:
+            return
+        if self.step < len(self.stages):
+            if self.steady or self.current_stage != self.step:
+                return
+            if time.time() - self.stage_start < self.search.ramp_timeout:
+                return
+            # The target could not reach the users of the probe (e.g. rps probes past the knee)
+            self.step += 1
+            self.time_active = False
+        self.probes.close(time.time())
+        level = self.search.record(
+            self.stages[-1][self.search.target], self.probes.results[-1]
+        )
+        if level is not None:
+            self.stages.append(self.search.probe(level))
+
+    def track_stage(self, stage, state):
+        """Fire stage_events when a stage starts, reaches its users and ends"""
+        now = time.time()
+        if state is None or stage != self.current_stage:
+            if self.current_stage is not None:
+                self.stage_events.fire(
+                    kind="end", stage=self.current_stage, timestamp=now
+                )
+            self.current_stage = None
+            if state is None:
+                return
+            self.current_stage = stage
+            self.stage_start = now
+            self.steady = False
+            self.stage_events.fire(kind="start", stage=stage, timestamp=now)
+        if self.steady or self.runner is None or self.runner.user_count != state[0]:
+            return
+        if self.mode != "time" or self.compiled.interpolation == "step":
+            self.steady = True
+            self.stage_events.fire(kind="steady", stage=stage, timestamp=now)
+
+    def stage_users(self, step):
+        """Users of a stage. For rps stages, grows with the response time and never shrinks within the stage"""
+        stage = self.stages[step]
+        if stage.get("mode") != "rps":
+            return stage["users"]
+        latency = self.runner.stats.total.get_current_response_time_percentile(0.95)
+        users = max(
+            self.rps_users.get(step, 0), pacing_users(stage, latency and latency / 1000)
+        )
+        self.rps_users[step] = users
+        return users
+
+    def set_pacing(self, interval):
+        """Send the per-user interval between requests to the workers when it changes"""
+        if interval != self.pacing_interval and self.runner is not None:
+            self.pacing_interval = interval
+            self.runner.send_message("pacing", {"interval": interval})
 
     def tick_users(self):
         """Spawn users: trigger duration only when all users are ready"""
@@ -50,9 +174,10 @@ class StagesShape(LoadTestShape):
             return None
 
         target = self.stages[self.step]
+        target_users = self.stage_users(self.step)
         users = self.runner.user_count
 
-        if target["users"] == users:
+        if target_users == users:
             if not self.time_active:
                 self.reset_time()
                 self.time_active = True
@@ -61,63 +186,96 @@ class StagesShape(LoadTestShape):
                 self.step += 1
                 self.time_active = False
 
-        return (target["users"], target["spawn_rate"])
+        return (target_users, target["spawn_rate"])
 
     def tick_time(self):
         """Spawn users: trigger duration based on time only (event if not all users ready)"""
-        run_time = self.get_run_time()
-        for stage in self.stages:
-            if run_time < stage["duration"]:
-                tick_data = (stage["users"], stage["spawn_rate"])
-                return tick_data
-        return None
+        return self.compiled.tick(self.get_run_time())
 
     def download_stages(self, bucket, key):
-        """Download stages from S3"""
-        obj = self.s3.get_object(Bucket=bucket, Key=key)
-        return json.loads(obj["Body"].read())
+        """Download stages from S3, unless this process (or the parent it was forked from) already did"""
+        return prefetch_stages(bucket, key).get()
+
+
+def prefetch_stages(bucket, key):
+    """
+    Start downloading stages in the background, once per process (and before forking worker processes).
+    Return the greenlet of the download, its value is the shape
+    """
+    if (bucket, key) not in _downloaded_stages:
+        _downloaded_stages[(bucket, key)] = gevent.spawn(_download_stages, bucket, key)
+    return _downloaded_stages[(bucket, key)]
+
+
+def forget_stages():
+    """Download the shapes again on next use: a warm pool job may reuse the key of an edited shape"""
+    _downloaded_stages.clear()
+
+
+def _download_stages(bucket, key):
+    obj = services.client("s3").get_object(Bucket=bucket, Key=key)
+    return json.loads(obj["Body"].read())
 
 
 class APIInterface(FastHttpUser):
     """
-    Client calling the API. Download test data and submit post requests
+    Client calling the API. Read test data from the process-wide dataset and submit post requests,
+    or send the requests of the process-wide request plan when the dataset format is "requests".
+    With CORRECTED_LATENCY, response times are also recorded from the intended send time (see OmissionRecorder)
     """
 
-    wait_time = between(1, 2)
+    think_time = between(1, 2)
 
     def __init__(self, *args, **kwargs):
         super(APIInterface, self).__init__(*args, **kwargs)
-        self.s3 = boto3.client("s3", region_name=os.environ["AWS_REGION"])
         self.method_path = os.environ["METHOD_PATH"]
-        self.headers = {
-            "Content-Type": os.environ.get("CONTENT_TYPE", "application/json"),
-            "Accept": "application/json",
-        }
+        self.headers = default_headers()
+        self.requests = None
+        self.intended_send = None
+        self.corrected_latency = os.environ.get("CORRECTED_LATENCY") == "1"
+
+    def wait_time(self):
+        """Think time, or the pacing schedule during rps stages"""
+        if pacer.interval is None:
+            # The schedule of a previous rps stage must not count as missed slots in the next one
+            self.intended_send = None
+            return self.think_time()
+        return pacer.wait(self)
 
     @task
     def index(self):
-        self.client.post(
-            self.method_path, data=self.testdata[self.data_idx], headers=self.headers
-        )
-        self.data_idx += 1
-        if self.data_idx == self.total_data:
-            self.data_idx = 0
+        if not self.corrected_latency:
+            self.send()
+            return
+        intended = self.intended_send if pacer.interval is not None else None
+        start = time.time()
+        self.send()
+        recorder.record(self, intended, start, time.time())
+
+    def send(self):
+        if self.requests is not None:
+            request = self.requests.next()
+            self.client.request(
+                request.method,
+                request.path,
+                name=request.name,
+                data=request.body,
+                headers=request.headers,
+            )
+        else:
+            self.client.post(
+                self.method_path, data=self.testdata.next(), headers=self.headers
+            )
 
     def on_start(self):
-        """When locust starts, download test dataset from bucket"""
-        dataset = self.download_test_set()
-        self.testdata = []
-        self.testexpected = []
-        reader = csv.reader(dataset, delimiter=",")
-        next(reader)
-        for row in reader:
-            self.testdata.append(row[0])
-        self.total_data = len(self.testdata)
-        self.data_idx = 0
-
-    def download_test_set(self):
-        """Download test set from S3"""
-        obj = self.s3.get_object(
-            Bucket=os.environ["TEST_DATASET_BUCKET"], Key=os.environ["TEST_DATASET_KEY"]
+        """When locust starts, get a cursor on the test dataset (downloaded once per process)"""
+        dataset = load_dataset(
+            os.environ["TEST_DATASET_BUCKET"],
+            os.environ["TEST_DATASET_KEY"],
+            mode=os.environ.get("TEST_DATASET_MODE", "cache"),
+            shard=parse_shard(os.environ.get("TEST_DATASET_SHARD")),
         )
-        return obj["Body"].read().decode().split()
+        if os.environ.get("TEST_DATASET_FORMAT", "body") == "requests":
+            self.requests = load_plan(dataset).cursor()
+        else:
+            self.testdata = dataset.cursor()
@@ -0,0 +1,204 @@
+import json
+import logging
+import os
+import time
+from urllib.parse import urlparse
+
+import gevent
+from gevent.queue import Empty
+from gevent.queue import Full
+from gevent.queue import Queue
+
+import services
+
+MAX_PENDING = 1000
+FLUSH_INTERVAL = 10
+RETRY_DELAY = 5
+
+
+class MetricsSink:
+    """
+    Stream interval records out of the master while the test runs.
+    offer() never blocks: records wait in a bounded queue, and when the queue is full (the destination
+    is slow or down) the record is dropped and counted. A greenlet writes the queued records in batches
+    every `flush_interval` seconds; a failed batch is retried once the next batch is due
+    """
+
+    def __init__(self, max_pending=MAX_PENDING, flush_interval=FLUSH_INTERVAL):
+        self.queue = Queue(maxsize=max_pending)
+        self.flush_interval = flush_interval
+        self.records = 0
+        self.dropped = 0
+        self.batches = 0
+        self.failed = []
+        self.closing = False
+        self.greenlet = gevent.spawn(self._run)
+
+    def offer(self, record):
+        """Queue a record, or drop it if the queue is full"""
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            self.dropped += 1
+
+    def close(self, timeout=30):
+        """Write the queued records and stop"""
+        self.closing = True
+        self.greenlet.join(timeout)
+        if not self.greenlet.dead:
+            self.greenlet.kill()
+
+    def restart(self, job_id=None):
+        """Count and write the records of the next job of a warm pool, after close()"""
+        self.close()
+        self.records = self.dropped = self.batches = 0
+        self.failed = []
+        self.closing = False
+        self.greenlet = gevent.spawn(self._run)
+
+    def summary(self):
+        return {
+            "records": self.records,
+            "dropped": self.dropped + len(self.failed) + self.queue.qsize(),
+            "batches": self.batches,
+        }
+
+    def _run(self):
+        while True:
+            deadline = time.time() + self.flush_interval
+            batch = self.failed
+            while not self.closing and time.time() < deadline:
+                try:
+                    batch.append(self.queue.get(timeout=min(1, self.flush_interval)))
+                except Empty:
+                    pass
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except Empty:
+                    break
+            self.failed = []
+            overflow = len(batch) - self.queue.maxsize
+            if overflow > 0:
+                self.dropped += overflow
+                batch = batch[overflow:]
+            if batch:
+                self._flush(batch)
+            if self.closing:
+                return
+
+    def _flush(self, batch):
+        data = "".join(
+            json.dumps(record, separators=(",", ":")) + "\n" for record in batch
+        )
+        try:
+            self.write(data.encode())
+        except Exception as e:
+            logging.warning(f"Metrics sink: {len(batch)} records not written: {e}")
+            self.failed = batch
+            if not self.closing:
+                gevent.sleep(RETRY_DELAY)
+            return
+        self.records += len(batch)
+        self.batches += 1
+
+    def write(self, data):
+        """To implement: write a batch of newline-delimited JSON records"""
+        pass
+
+
+class FileSink(MetricsSink):
+    """Append the records to a local file. Writes run in the hub threadpool, off the event loop"""
+
+    def __init__(self, path, **kwargs):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        super(FileSink, self).__init__(**kwargs)
+
+    def write(self, data):
+        gevent.get_hub().threadpool.apply(self._append, (data,))
+
+    def _append(self, data):
+        with open(self.path, "ab") as f:
+            f.write(data)
+
+
+class S3Sink(MetricsSink):
+    """
+    Write each batch as a new part, since S3 objects cannot be appended to:
+        PREFIX/EXECUTION_ID/part-000001.ndjson, part-000002.ndjson...
+    and the parts of each job of a warm pool under PREFIX/EXECUTION_ID/JOB_ID/.
+    Listing the prefix returns the parts in order
+    """
+
+    def __init__(self, bucket, prefix, execution_id=None, region=None, **kwargs):
+        self.bucket = bucket
+        execution_id = execution_id or os.environ.get("EXECUTION_ID", "local")
+        self.run_prefix = f"{prefix.rstrip('/')}/{execution_id}".lstrip("/")
+        self.prefix = self.run_prefix
+        self.s3 = services.client("s3", region)
+        self.part = 0
+        super(S3Sink, self).__init__(**kwargs)
+
+    def restart(self, job_id=None):
+        """Parts of the next job start over from 1, under the job id"""
+        super(S3Sink, self).restart(job_id)
+        self.prefix = f"{self.run_prefix}/{job_id}" if job_id else self.run_prefix
+        self.part = 0
+
+    def write(self, data):
+        self.s3.put_object(
+            Bucket=self.bucket,
+            Key=f"{self.prefix}/part-{self.part + 1:06d}.ndjson",
+            Body=data,
+        )
+        self.part += 1
+
+
+def create_sink(location, region=None, execution_id=None, **kwargs):
+    """Sink for a location: s3://bucket/prefix, or a file path. None without location"""
+    if not location:
+        return None
+    url = urlparse(location)
+    if url.scheme == "s3":
+        return S3Sink(url.netloc, url.path.lstrip("/"), execution_id, region, **kwargs)
+    if url.scheme == "file":
+        return FileSink(url.path, **kwargs)
+    return FileSink(location, **kwargs)
+
+
+class EndpointDeltas:
+    """
+    Requests, failures and response time counts (ms: count) of each endpoint since the previous call.
+    Endpoints without new requests are left out, so records stay small
+    """
+
+    def __init__(self):
+        self.previous = {}
+
+    def collect(self, stats):
+        endpoints = {}
+        for key, entry in list(stats.entries.items()):
+            requests, failures, times = self.previous.get(key, (0, 0, {}))
+            if entry.num_requests < requests:
+                # Stats were reset
+                requests, failures, times = 0, 0, {}
+            if entry.num_requests == requests and entry.num_failures == failures:
+                continue
+            endpoints[f"{key[1]} {key[0]}"] = {
+                "requests": entry.num_requests - requests,
+                "failures": max(entry.num_failures - failures, 0),
+                "response_times": {
+                    value: count - times.get(value, 0)
+                    for value, count in entry.response_times.items()
+                    if count != times.get(value, 0)
+                },
+            }
+            self.previous[key] = (
+                entry.num_requests,
+                entry.num_failures,
+                dict(entry.response_times),
+            )
+        return endpoints
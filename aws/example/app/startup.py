@@ -0,0 +1,44 @@
+import logging
+import os
+import time
+
+
+def process_start():
+    """Start time of the process, from /proc on Linux, or now"""
+    try:
+        with open("/proc/self/stat") as f:
+            ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return time.time() - uptime + ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return time.time()
+
+
+STARTED = process_start()
+
+
+class StartupTimer:
+    """
+    Seconds from the start of the process to each startup phase, up to the first request.
+    Phases are logged as they end and reported with the results
+    """
+
+    def __init__(self, started=STARTED):
+        self.started = started
+        self.phases = {}
+
+    def mark(self, phase):
+        if phase not in self.phases:
+            self.phases[phase] = round(time.time() - self.started, 3)
+            logging.info(f"Startup: {phase} after {self.phases[phase]}s")
+
+    def on_request(self, **kwargs):
+        self.mark("first_request")
+
+    def register(self, env):
+        """Mark the first request sent by the users of this process"""
+        env.events.request.add_listener(self.on_request)
+
+
+startup = StartupTimer()
@@ -0,0 +1,86 @@
+import logging
+import os
+import signal
+import time
+
+import gevent
+
+
+def process_count(value):
+    """Number of worker processes: an integer, or auto for one per available CPU"""
+    if str(value) == "auto":
+        if hasattr(os, "sched_getaffinity"):
+            return len(os.sched_getaffinity(0))
+        return os.cpu_count() or 1
+    return max(int(value), 1)
+
+
+def exit_code(status):
+    """Exit code of a child from its wait status, minus the signal number if it was killed"""
+    # os.waitstatus_to_exitcode is only available from Python 3.9
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+class WorkerProcesses:
+    """
+    Fork Locust worker processes in the container and supervise them.
+    Everything loaded before start() (dataset, shape) is shared with the children.
+    The parent calls `should_stop` every `interval` seconds and terminates the children once it returns True.
+    It exits when every child is done, with the worst exit code
+    """
+
+    def __init__(self, count, run, should_stop=None, interval=60):
+        self.count = count
+        self.run = run
+        self.should_stop = should_stop
+        self.interval = interval
+        self.children = {}
+
+    def start(self):
+        for index in range(self.count):
+            pid = os.fork()
+            if pid == 0:
+                os._exit(self._child(index))
+            self.children[pid] = index
+        logging.info(f"Started {self.count} worker processes")
+
+    def wait(self):
+        """Wait for all children, terminating them if the run is over. Return the exit code"""
+        code = 0
+        last_check = time.time()
+        while self.children:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid:
+                index = self.children.pop(pid)
+                child_code = exit_code(status)
+                if child_code:
+                    logging.error(f"Worker process {index} exited with {child_code}")
+                code = max(code, abs(child_code))
+                continue
+            if self.should_stop and time.time() - last_check >= self.interval:
+                last_check = time.time()
+                if self.should_stop():
+                    logging.info("Run is over, stopping worker processes")
+                    self.terminate()
+            gevent.sleep(0.5)
+        return code
+
+    def terminate(self, sig=signal.SIGTERM):
+        for pid in self.children:
+            try:
+                os.kill(pid, sig)
+            except ProcessLookupError:
+                pass
+
+    def _child(self, index):
+        """Run a worker in the forked process and return its exit code"""
+        try:
+            self.run(index)
+            return 0
+        except SystemExit as e:
+            return e.code if isinstance(e.code, int) else 1
+        except Exception:
+            logging.exception(f"Worker process {index} failed")
+            return 1
@@ -0,0 +1,182 @@
+import json
+import math
+import os
+from bisect import bisect_right
+from collections import namedtuple
+from itertools import accumulate
+
+from dataset import DatasetCursor
+
+PreparedRequest = namedtuple(
+    "PreparedRequest", ["method", "path", "name", "headers", "body"]
+)
+
+# Fraction of the cycle between two positions of the weighted order
+GOLDEN_RATIO = (math.sqrt(5) - 1) / 2
+
+_plans = {}
+
+
+def default_headers():
+    """Headers of every request unless a row overrides them"""
+    return {
+        "Content-Type": os.environ.get("CONTENT_TYPE", "application/json"),
+        "Accept": "application/json",
+        # Set by FastHttpSession on every request otherwise, mutating the shared dict
+        "Accept-Encoding": "gzip, deflate",
+    }
+
+
+def encode_body(body):
+    """Bytes sent as is, str encoded once, anything else sent as JSON"""
+    if body is None or isinstance(body, bytes):
+        return body
+    if isinstance(body, str):
+        return body.encode()
+    return json.dumps(body, separators=(",", ":")).encode()
+
+
+class RequestCompiler:
+    """
+    Turn dataset rows into ready-to-send requests. A row of the "requests" format is a JSON object:
+        {"method": "PUT", "path": "/items/42", "name": "/items/[id]", "headers": {"X-Tenant": "a"},
+         "body": {"name": "user42"}, "weight": 3}
+    Every field is optional: the method defaults to POST, the path to METHOD_PATH, the name to the path.
+    Requests with the same headers share the same dict
+    """
+
+    def __init__(self, method_path=None, headers=None):
+        self.method_path = method_path or os.environ.get("METHOD_PATH", "/")
+        self.headers = headers or default_headers()
+        self.shared_headers = {}
+
+    def compile(self, row):
+        """Return (request, weight)"""
+        spec = json.loads(row)
+        path = spec.get("path", self.method_path)
+        request = PreparedRequest(
+            spec.get("method", "POST").upper(),
+            path,
+            spec.get("name", path),
+            self._headers(spec.get("headers")),
+            encode_body(spec.get("body")),
+        )
+        weight = int(spec.get("weight", 1))
+        if weight < 0:
+            raise ValueError(f"Negative weight in request {row!r}")
+        return request, weight
+
+    def _headers(self, overrides):
+        if not overrides:
+            return self.headers
+        headers = dict(self.headers, **overrides)
+        key = tuple(sorted(headers.items()))
+        return self.shared_headers.setdefault(key, headers)
+
+
+class WeightedOrder:
+    """
+    Indexes of the entries in their weighted order, each one repeated weight / gcd(weights) times
+    per cycle. Slots are laid out entry after entry (cumulative weights, searched by bisection),
+    so memory grows with the number of entries, not the sum of their weights. Position i of the cycle
+    is slot i * stride modulo the cycle length: a stride close to the length over the golden ratio
+    and coprime with it visits every slot once per cycle and spreads each entry over the cycle,
+    so heavy entries are interleaved with the others instead of sent in bursts.
+    With equal weights, entries keep their order
+    """
+
+    __slots__ = ("ends", "total", "stride")
+
+    def __init__(self, weights):
+        divisor = 0
+        for weight in weights:
+            divisor = math.gcd(divisor, weight)
+        if divisor == 0:
+            raise ValueError("Request plan has no request with a positive weight")
+        self.ends = list(accumulate(weight // divisor for weight in weights))
+        self.total = self.ends[-1]
+        self.stride = 1
+        if self.total > len(weights):
+            self.stride = max(round(self.total * GOLDEN_RATIO), 1)
+            while math.gcd(self.stride, self.total) != 1:
+                self.stride += 1
+
+    def __len__(self):
+        return self.total
+
+    def __getitem__(self, idx):
+        if not 0 <= idx < self.total:
+            raise IndexError(idx)
+        return bisect_right(self.ends, idx * self.stride % self.total)
+
+
+class RequestPlan:
+    """
+    Requests compiled once per process, in their weighted order.
+    Users only step a cursor through the prepared requests
+    """
+
+    def __init__(self, requests, weights, shared=False):
+        self.requests = requests
+        self.order = WeightedOrder(weights)
+        self.ends, self.stride = self.order.ends, self.order.stride
+        self.total = len(self.order)
+        self.shared = DatasetCursor(self) if shared else None
+
+    def __len__(self):
+        return self.total
+
+    def __getitem__(self, idx):
+        # WeightedOrder.__getitem__ inlined: this runs on every request sent
+        return self.requests[bisect_right(self.ends, idx * self.stride % self.total)]
+
+    def cursor(self, start=0):
+        """Same as TestDataset.cursor"""
+        return self.shared or DatasetCursor(self, start)
+
+    @classmethod
+    def from_dataset(cls, dataset, compiler=None, shared=False):
+        compiler = compiler or RequestCompiler()
+        requests, weights = [], []
+        for idx in range(len(dataset)):
+            request, weight = compiler.compile(dataset[idx])
+            requests.append(request)
+            weights.append(weight)
+        return cls(requests, weights, shared)
+
+
+class StreamingPlan:
+    """
+    Compile the rows of a streaming dataset as they come out of its window.
+    Weights are not applied: the order of a stream is the order of the object
+    """
+
+    def __init__(self, stream, compiler=None):
+        self.stream = stream
+        self.compiler = compiler or RequestCompiler()
+
+    def cursor(self, start=0):
+        return self
+
+    def next(self):
+        return self.compiler.compile(self.stream.next())[0]
+
+
+def load_plan(dataset):
+    """Process-wide request plan compiled from a dataset returned by load_dataset"""
+    plan = _plans.get(id(dataset))
+    if plan is None:
+        if hasattr(dataset, "offsets"):
+            plan = RequestPlan.from_dataset(dataset, shared=dataset.shared is not None)
+        else:
+            plan = StreamingPlan(dataset)
+        _plans[id(dataset)] = plan
+    return plan
+
+
+def forget_plans(datasets):
+    """Drop the plans compiled from other datasets than these"""
+    kept = {id(dataset) for dataset in datasets}
+    for dataset_id in list(_plans):
+        if dataset_id not in kept:
+            del _plans[dataset_id]
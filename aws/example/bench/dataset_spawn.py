@@ -0,0 +1,95 @@
+"""
+Spawn latency and memory of the test dataset against user count, without network.
+
+Compares the legacy behaviour (every user decodes, splits and copies the whole CSV)
+with the process-wide packed dataset (one load, one cursor per user).
+
+    python bench/dataset_spawn.py --rows 200000 --users 1,10,100,300
+"""
+import argparse
+import csv
+import io
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from dataset import pack_rows  # noqa: E402
+from dataset import TestDataset  # noqa: E402
+
+
+def make_csv(rows):
+    lines = ["sample_input,sample_output"]
+    for i in range(rows):
+        lines.append(f'{{"name":"user{i}"}},{{"hello":"user{i}"}}')
+    return "\n".join(lines).encode()
+
+
+def rss_kb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * resource.getpagesize() // 1024
+
+
+def legacy(raw, users):
+    holders = []
+    for _ in range(users):
+        reader = csv.reader(raw.decode().split(), delimiter=",")
+        next(reader)
+        holders.append([row[0] for row in reader])
+    return holders
+
+
+def shared(raw, users, path):
+    pack_rows(io.StringIO(raw.decode(), newline=""), path)
+    dataset = TestDataset.from_file(path)
+    return [dataset.cursor() for _ in range(users)]
+
+
+def measure(mode, rows, users, queue):
+    raw = make_csv(rows)
+    before = rss_kb()
+    start = time.perf_counter()
+    if mode == "legacy":
+        holders = legacy(raw, users)
+    else:
+        holders = shared(raw, users, os.path.join(tempfile.mkdtemp(), "bench"))
+    elapsed = time.perf_counter() - start
+    queue.put(
+        {
+            "mode": mode,
+            "users": users,
+            "rows": rows,
+            "spawn_ms_per_user": round(elapsed * 1000 / users, 3),
+            "spawn_ms_total": round(elapsed * 1000, 1),
+            "rss_delta_kb": rss_kb() - before,
+        }
+    )
+    del holders
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--users", default="1,10,100,300")
+    args = parser.parse_args()
+
+    results = []
+    queue = multiprocessing.Queue()
+    for users in [int(x) for x in args.users.split(",")]:
+        for mode in ["legacy", "shared"]:
+            p = multiprocessing.Process(
+                target=measure, args=(mode, args.rows, users, queue)
+            )
+            p.start()
+            results.append(queue.get())
+            p.join()
+            print(json.dumps(results[-1]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,409 @@
+"""
+End-to-end throughput and overhead of the load generator on one Linux box, without network.
+
+Starts a local stub of the sample API (POST /hello), a directory-backed S3 stand-in holding the
+shape and the test set, an ECS stand-in reporting the master task, then runs app/main.py as a
+master and N worker processes for each worker count. Each worker runs --users users without
+think time, so the workers send as fast as they can, and keeps its own dataset cache, as
+separate containers would. Process CPU time and peak memory come from wait4 on each process,
+the request counts from the results of the master.
+
+    python bench/end_to_end.py --workers 1,2,4 --users 50 --duration 20 --output e2e.json
+    python bench/end_to_end.py --workers 1,2,4 --baseline e2e.json
+
+With --baseline, each metric is compared with the run of the same worker count and the
+script exits with 1 when one is worse by more than --tolerance. CPU times include the startup
+of each process, so compare runs of the same --users and --duration.
+"""
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import platform
+import runpy
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app")
+BUCKET = "bench"
+MASTER_TASK = "arn:aws:ecs:local:000000000000:task/bench/master"
+
+# Metric: True when higher is better
+METRICS = {
+    "rps_per_core": True,
+    "steady_rps": True,
+    "worker_us_per_request": False,
+    "master_cpu_share": False,
+    "master_max_rss_kb": False,
+    "spawn_seconds": False,
+    "workers_ready_seconds": False,
+}
+
+
+class NoSuchKey(Exception):
+    pass
+
+
+class LocalS3:
+    """The S3 calls of the app, on files under a root directory (one directory per bucket)"""
+
+    exceptions = type("exceptions", (), {"NoSuchKey": NoSuchKey})
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, bucket, key):
+        return os.path.join(self.root, bucket, key)
+
+    def get_object(self, Bucket, Key, Range=None):
+        path = self._path(Bucket, Key)
+        if not os.path.isfile(path):
+            raise NoSuchKey(Key)
+        with open(path, "rb") as f:
+            if Range:
+                start, end = [int(x) for x in Range[len("bytes=") :].split("-")]
+                f.seek(start)
+                data = f.read(end - start + 1)
+            else:
+                data = f.read()
+        return {"Body": io.BytesIO(data), "ContentLength": len(data)}
+
+    def head_object(self, Bucket, Key):
+        path = self._path(Bucket, Key)
+        if not os.path.isfile(path):
+            raise NoSuchKey(Key)
+        return {"ContentLength": os.path.getsize(path)}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        path = self._path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if isinstance(Body, str):
+            Body = Body.encode()
+        elif not isinstance(Body, bytes):
+            Body = Body.read()
+        with open(path + ".tmp", "wb") as f:
+            f.write(Body)
+        os.replace(path + ".tmp", path)
+        return {}
+
+    def upload_fileobj(self, Fileobj, Bucket, Key, **kwargs):
+        self.put_object(Bucket, Key, Fileobj.read())
+
+    def delete_object(self, Bucket, Key):
+        path = self._path(Bucket, Key)
+        if os.path.isfile(path):
+            os.remove(path)
+        return {}
+
+    def list_objects_v2(self, Bucket, Prefix="", MaxKeys=1000, **kwargs):
+        keys = []
+        base = os.path.join(self.root, Bucket)
+        for directory, _, files in os.walk(base):
+            for name in files:
+                key = os.path.relpath(os.path.join(directory, name), base)
+                if key.startswith(Prefix) and not key.endswith(".tmp"):
+                    keys.append(key)
+        keys = sorted(keys)[:MaxKeys]
+        return {"Contents": [{"Key": key} for key in keys]} if keys else {}
+
+
+class LocalECS:
+    """describe_tasks of the master task: RUNNING while the master process lives"""
+
+    def __init__(self, master_pid):
+        self.master_pid = master_pid
+
+    def describe_tasks(self, cluster, tasks):
+        try:
+            os.kill(self.master_pid, 0)
+            status = "RUNNING"
+        except OSError:
+            status = "STOPPED"
+        return {"tasks": [{"taskArn": arn, "lastStatus": status} for arn in tasks]}
+
+
+def run_node(argv):
+    """Run app/main.py with the stand-ins in place of the AWS clients, and users without think time"""
+    sys.path.insert(0, APP)
+    from locust import constant
+    import services
+    import shape
+
+    shape.APIInterface.think_time = constant(0)
+
+    s3 = LocalS3(os.environ["BENCH_S3_ROOT"])
+    ecs = LocalECS(int(os.environ.get("BENCH_MASTER_PID", "0")))
+    services.client = lambda service, region=None: ecs if service == "ecs" else s3
+    sys.argv = [os.path.join(APP, "main.py")] + argv
+    runpy.run_path(sys.argv[0], run_name="__main__")
+
+
+def stub_app(environ, start_response):
+    """The /hello route of the sample API"""
+    if environ["PATH_INFO"] != "/hello" or environ["REQUEST_METHOD"] != "POST":
+        start_response("404 Not Found", [("Content-Type", "application/json")])
+        return [b'{"message": "Not found"}']
+    length = int(environ.get("CONTENT_LENGTH") or 0)
+    body = json.loads(environ["wsgi.input"].read(length) or b"{}")
+    start_response("200 OK", [("Content-Type", "application/json")])
+    return [json.dumps({"hello": body.get("name")}).encode()]
+
+
+def serve_stub(listener):
+    from gevent import monkey
+
+    monkey.patch_all()
+    from gevent import socket as gsocket
+    from gevent.pywsgi import WSGIServer
+
+    listener = gsocket.socket(fileno=listener.detach())
+    WSGIServer(listener, stub_app, log=None, error_log=None).serve_forever()
+
+
+def start_stub(processes):
+    """Stub processes sharing one listening socket. Return the port and the processes"""
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(1024)
+    context = multiprocessing.get_context("fork")
+    servers = [
+        context.Process(target=serve_stub, args=(listener,), daemon=True)
+        for _ in range(processes)
+    ]
+    for server in servers:
+        server.start()
+    port = listener.getsockname()[1]
+    listener.close()
+    return port, servers
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def prepare(root, args, users):
+    """
+    Shape and test set of a run, in the S3 stand-in. A users stage: the users send back to back,
+    without going through the pacing of rps stages
+    """
+    shape = [
+        {"users": users, "duration": args.duration, "spawn_rate": args.spawn_rate},
+        {"users": 0, "duration": 1, "spawn_rate": args.spawn_rate},
+    ]
+    s3 = LocalS3(root)
+    s3.put_object(BUCKET, "shape.json", json.dumps(shape))
+    lines = ["sample_input,sample_output"]
+    lines += [f'{{"name":"user{i}"}},{{"hello":"user{i}"}}' for i in range(args.rows)]
+    s3.put_object(BUCKET, "data.csv", "\n".join(lines) + "\n")
+
+
+def wait(process, deadline):
+    """wait4 a process: (exit status, CPU seconds, peak RSS in KB)"""
+    while True:
+        pid, status, usage = os.wait4(process.pid, os.WNOHANG)
+        if pid:
+            if os.WIFSIGNALED(status):
+                process.returncode = -os.WTERMSIG(status)
+            else:
+                process.returncode = os.WEXITSTATUS(status)
+            return process.returncode, usage.ru_utime + usage.ru_stime, usage.ru_maxrss
+        if time.time() > deadline:
+            process.kill()
+            deadline = float("inf")
+        time.sleep(0.1)
+
+
+def measure(args, workers, port, logs):
+    root = tempfile.mkdtemp(prefix="e2e-")
+    users = workers * args.users
+    prepare(root, args, users)
+    master_port = free_port()
+    common = [
+        f"--host=http://127.0.0.1:{port}",
+        "--method=/hello",
+        f"--shapes-bucket={BUCKET}",
+        "--shapes-key=shape.json",
+        f"--testdata-bucket={BUCKET}",
+        "--testdata-key=data.csv",
+        f"--master-port={master_port}",
+        "--region=local",
+    ]
+    env = dict(
+        os.environ,
+        BENCH_S3_ROOT=root,
+        DATASET_CACHE_DIR=os.path.join(root, "cache-master"),
+        AWS_REGION="local",
+    )
+    command = [sys.executable, os.path.abspath(__file__), "node"]
+    deadline = time.time() + args.duration + args.timeout
+    start = time.time()
+    with open(os.path.join(logs, f"master-{workers}.log"), "w") as log:
+        master = subprocess.Popen(
+            command
+            + common
+            + [
+                "--client-type=master",
+                f"--expected-workers={workers}",
+                f"--output-bucket={BUCKET}",
+                "--output-key=out.json",
+                f"--max-runtime={args.duration + args.timeout}",
+            ],
+            env=env,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+        )
+    env["BENCH_MASTER_PID"] = str(master.pid)
+    processes = []
+    for i in range(workers):
+        with open(os.path.join(logs, f"worker-{workers}-{i}.log"), "w") as log:
+            processes.append(
+                subprocess.Popen(
+                    command
+                    + common
+                    + [
+                        "--client-type=worker",
+                        "--master-host=127.0.0.1",
+                        f"--fargate-task={MASTER_TASK}",
+                    ],
+                    env=dict(env, DATASET_CACHE_DIR=os.path.join(root, f"cache-{i}")),
+                    stdout=log,
+                    stderr=subprocess.STDOUT,
+                )
+            )
+    master_status, master_cpu, master_rss = wait(master, deadline)
+    wall = time.time() - start
+    worker_cpu, worker_rss = 0.0, 0
+    for process in processes:
+        _, cpu, rss = wait(process, time.time() + 30)
+        worker_cpu += cpu
+        worker_rss = max(worker_rss, rss)
+    try:
+        results = json.loads(
+            LocalS3(root).get_object(BUCKET, "out.json")["Body"].read()
+        )[-1]
+    except (NoSuchKey, ValueError, IndexError):
+        raise RuntimeError(f"Run with {workers} workers saved no results, see {logs}")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    stage = results["stages"][0]
+    requests = results["num_requests"]
+    return {
+        "workers": workers,
+        "users": users,
+        "master_exit": master_status,
+        "wall_s": round(wall, 2),
+        "requests": requests,
+        "failures": results["num_failures"],
+        "steady_rps": stage["requests_per_second"],
+        "steady_p95_ms": stage.get("response_time_percentile_95"),
+        "spawn_seconds": stage["ramp_seconds"],
+        "workers_ready_seconds": results.get("startup", {}).get("workers_ready"),
+        "worker_cpu_s": round(worker_cpu, 2),
+        "rps_per_core": round(requests / worker_cpu, 1) if worker_cpu else None,
+        "worker_us_per_request": round(worker_cpu * 1e6 / requests, 1)
+        if requests
+        else None,
+        "worker_max_rss_kb": worker_rss,
+        "master_cpu_s": round(master_cpu, 2),
+        "master_cpu_share": round(master_cpu / wall, 3),
+        "master_max_rss_kb": master_rss,
+    }
+
+
+def compare(runs, baseline, tolerance):
+    """Relative change of each metric against the baseline run with the same workers. Return the regressions"""
+    previous = {run["workers"]: run for run in baseline["runs"]}
+    regressions = []
+    for run in runs:
+        base = previous.get(run["workers"])
+        if base is None:
+            continue
+        for metric, higher_is_better in METRICS.items():
+            if not base.get(metric) or run.get(metric) is None:
+                continue
+            change = (run[metric] - base[metric]) / base[metric]
+            worse = -change if higher_is_better else change
+            line = {
+                "workers": run["workers"],
+                "metric": metric,
+                "baseline": base[metric],
+                "current": run[metric],
+                "change": round(change, 3),
+                "regression": worse > tolerance,
+            }
+            print(json.dumps(line))
+            if line["regression"]:
+                regressions.append(line)
+    return regressions
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "node":
+        return run_node(sys.argv[2:])
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", default="1,2,4")
+    parser.add_argument("--users", type=int, default=50, help="Users per worker")
+    parser.add_argument("--duration", type=int, default=20, help="Seconds at full load")
+    parser.add_argument("--spawn-rate", type=float, default=100)
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument(
+        "--stub-processes", type=int, default=max(os.cpu_count() // 2, 1)
+    )
+    parser.add_argument(
+        "--timeout", type=int, default=120, help="Extra seconds before runs are killed"
+    )
+    parser.add_argument("--output", default=None, help="Write the results as JSON")
+    parser.add_argument(
+        "--baseline", default=None, help="Results of a previous --output"
+    )
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    parser.add_argument("--logs", default=None, help="Directory of the node logs")
+    args = parser.parse_args()
+
+    logs = args.logs or tempfile.mkdtemp(prefix="e2e-logs-")
+    os.makedirs(logs, exist_ok=True)
+    port, servers = start_stub(args.stub_processes)
+    runs = []
+    try:
+        for workers in [int(x) for x in args.workers.split(",")]:
+            runs.append(measure(args, workers, port, logs))
+            print(json.dumps(runs[-1]))
+    finally:
+        for server in servers:
+            server.terminate()
+    report = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "host": {
+            "cpus": os.cpu_count(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "settings": vars(args),
+        "runs": runs,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        for setting in ["users", "duration", "spawn_rate", "rows"]:
+            if baseline["settings"].get(setting) != getattr(args, setting):
+                print(
+                    f"Warning: the baseline ran with {setting}={baseline['settings'].get(setting)}"
+                )
+        regressions = compare(runs, baseline, args.tolerance)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
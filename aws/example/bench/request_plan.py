@@ -0,0 +1,223 @@
+"""
+Requests per second per core of a Locust process, against a local stub target.
+
+Compares the body format (every row posted to METHOD_PATH), rows parsed as JSON requests
+on every send, and the precompiled request plan, with one or several weighted endpoints.
+The stub runs in another process, so only the CPU time of the Locust process is counted.
+Each mode runs --repeat times, interleaved, and the median is printed. The cost of preparing
+a request without sending it is also measured, as it is a small part of the total
+
+    python bench/request_plan.py --users 50 --duration 10
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import time
+
+from gevent import monkey
+
+monkey.patch_all()
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+import gevent  # noqa: E402
+from gevent.server import StreamServer  # noqa: E402
+from locust import constant  # noqa: E402
+from locust.env import Environment  # noqa: E402
+
+import dataset  # noqa: E402
+from shape import APIInterface  # noqa: E402
+from traffic import load_plan  # noqa: E402
+from traffic import RequestCompiler  # noqa: E402
+
+RESPONSE = (
+    b"HTTP/1.1 200 OK\r\nContent-Length: 17\r\nContent-Type: application/json\r\n\r\n"
+    b'{"hello":"world"}'
+)
+ENDPOINTS = [
+    {"method": "POST", "path": "/hello", "weight": 6},
+    {"method": "GET", "path": "/items", "weight": 3},
+    {
+        "method": "PUT",
+        "path": "/items/1",
+        "headers": {"X-Tenant": "bench"},
+        "weight": 1,
+    },
+]
+
+
+def serve(port):
+    """Minimal keep-alive HTTP target: reads a request, answers the same response"""
+
+    def handle(sock, address):
+        buffer = b""
+        while True:
+            try:
+                data = sock.recv(65536)
+            except OSError:
+                return
+            if not data:
+                return
+            buffer += data
+            while b"\r\n\r\n" in buffer:
+                head, _, rest = buffer.partition(b"\r\n\r\n")
+                length = 0
+                for line in head.split(b"\r\n"):
+                    if line.lower().startswith(b"content-length:"):
+                        length = int(line.split(b":")[1])
+                if len(rest) < length:
+                    break
+                buffer = rest[length:]
+                sock.sendall(RESPONSE)
+
+    StreamServer(("127.0.0.1", port), handle).serve_forever()
+
+
+def make_rows(rows, fmt, mixed):
+    if fmt == "body":
+        return [json.dumps({"name": f"user{i}"}) for i in range(rows)]
+    if not mixed:
+        return [json.dumps({"body": {"name": f"user{i}"}}) for i in range(rows)]
+    lines = []
+    for i in range(rows):
+        endpoint = dict(ENDPOINTS[i % len(ENDPOINTS)])
+        if endpoint["method"] != "GET":
+            endpoint["body"] = {"name": f"user{i}"}
+        lines.append(json.dumps(endpoint))
+    return lines
+
+
+def load(rows, mixed, fmt):
+    """Pack the rows as a dataset and put it in the process-wide cache, as load_dataset would"""
+    path = os.path.join(tempfile.mkdtemp(), "bench")
+    lines = [
+        '"' + row.replace('"', '""') + '"\n' for row in make_rows(rows, fmt, mixed)
+    ]
+    dataset.pack_rows(["request\n"] + lines, path)
+    dataset._datasets[
+        ("bench", "data.csv", "cache", None)
+    ] = dataset.TestDataset.from_file(path)
+    os.environ.update(
+        {
+            "METHOD_PATH": "/hello",
+            "TEST_DATASET_BUCKET": "bench",
+            "TEST_DATASET_KEY": "data.csv",
+            "TEST_DATASET_FORMAT": "body" if fmt == "body" else "requests",
+        }
+    )
+
+
+class PerRowUser(APIInterface):
+    """Mixed traffic without precompilation: every row is parsed when it is sent"""
+
+    def on_start(self):
+        super().on_start()
+        self.compiler = RequestCompiler()
+        self.rows = dataset._datasets[("bench", "data.csv", "cache", None)].cursor()
+
+    def index(self):
+        request = self.compiler.compile(self.rows.next())[0]
+        self.client.request(
+            request.method,
+            request.path,
+            name=request.name,
+            data=request.body,
+            headers=request.headers,
+        )
+
+
+def prepare_ns(mode, count=200000):
+    """Nanoseconds to get the arguments of the next request, without sending it"""
+    fmt, _, _ = mode.partition(":")
+    rows = dataset._datasets[("bench", "data.csv", "cache", None)]
+    if fmt == "body":
+        cursor = rows.cursor()
+        start = time.perf_counter()
+        for _ in range(count):
+            cursor.next()
+    elif fmt == "per_row":
+        cursor, compiler = rows.cursor(), RequestCompiler()
+        start = time.perf_counter()
+        for _ in range(count):
+            compiler.compile(cursor.next())
+    else:
+        cursor = load_plan(rows).cursor()
+        start = time.perf_counter()
+        for _ in range(count):
+            cursor.next()
+    return round((time.perf_counter() - start) * 1e9 / count)
+
+
+def measure(mode, args, port, queue):
+    fmt, _, endpoints = mode.partition(":")
+    load(args.rows, endpoints == "mixed", fmt)
+    user_class = PerRowUser if fmt == "per_row" else APIInterface
+    user_class.wait_time = constant(0)
+    env = Environment(user_classes=[user_class], host=f"http://127.0.0.1:{port}")
+    runner = env.create_local_runner()
+    runner.start(args.users, spawn_rate=args.users)
+    gevent.sleep(1)
+    env.stats.reset_all()
+    before = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.perf_counter()
+    gevent.sleep(args.duration)
+    after = resource.getrusage(resource.RUSAGE_SELF)
+    elapsed = time.perf_counter() - start
+    requests = env.stats.total.num_requests
+    runner.quit()
+    cpu = (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime)
+    queue.put(
+        {
+            "mode": mode,
+            "users": args.users,
+            "requests": requests,
+            "failures": env.stats.total.num_failures,
+            "rps": round(requests / elapsed, 1),
+            "cpu_s": round(cpu, 2),
+            "rps_per_core": round(requests / cpu, 1) if cpu else None,
+            "prepare_ns": prepare_ns(mode),
+        }
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--port", type=int, default=18089)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    server = multiprocessing.Process(target=serve, args=(args.port,), daemon=True)
+    server.start()
+    time.sleep(0.5)
+    queue = multiprocessing.Queue()
+    modes = ["body", "plan:single", "per_row:mixed", "plan:mixed"]
+    results = {mode: [] for mode in modes}
+    try:
+        for _ in range(args.repeat):
+            for mode in modes:
+                p = multiprocessing.Process(
+                    target=measure, args=(mode, args, args.port, queue)
+                )
+                p.start()
+                results[mode].append(queue.get())
+                p.join()
+        for mode in modes:
+            runs = results[mode]
+            median = dict(runs[0])
+            for field in ["requests", "rps", "cpu_s", "rps_per_core", "prepare_ns"]:
+                median[field] = statistics.median(run[field] for run in runs)
+            print(json.dumps(median))
+    finally:
+        server.terminate()
+
+
+if __name__ == "__main__":
+    main()
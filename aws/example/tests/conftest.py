@@ -0,0 +1,90 @@
+import hashlib
+import io
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+
+class NoSuchKey(Exception):
+    pass
+
+
+class Body(io.BytesIO):
+    """Streaming body of a response"""
+
+    def iter_lines(self):
+        return iter(self.read().splitlines())
+
+
+class FakeS3:
+    """The S3 calls of the app on in-memory objects, counting the reads"""
+
+    class exceptions:
+        NoSuchKey = NoSuchKey
+
+    def __init__(self):
+        self.objects = {}
+        self.gets = 0
+
+    def put(self, bucket, key, data):
+        self.objects[(bucket, key)] = data.encode() if isinstance(data, str) else data
+
+    def head_object(self, Bucket, Key):
+        data = self.objects[(Bucket, Key)]
+        etag = hashlib.md5(data).hexdigest()  # nosec
+        return {"ContentLength": len(data), "ETag": f'"{etag}"'}
+
+    def get_object(self, Bucket, Key, Range=None):
+        self.gets += 1
+        if (Bucket, Key) not in self.objects:
+            raise NoSuchKey(Key)
+        data = self.objects[(Bucket, Key)]
+        if Range:
+            start, end = [int(x) for x in Range[len("bytes=") :].split("-")]
+            data = data[start : end + 1]
+        return {
+            "Body": Body(data),
+            "ContentLength": len(data),
+        }
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.put(Bucket, Key, Body)
+        return {}
+
+    def upload_fileobj(self, f, Bucket, Key, Config=None):
+        self.put(Bucket, Key, f.read())
+
+    def get_paginator(self, operation):
+        assert operation == "list_objects_v2"
+        return self
+
+    def paginate(self, **kwargs):
+        yield self.list_objects_v2(**kwargs)
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key), None)
+        return {}
+
+    def list_objects_v2(self, Bucket, Prefix="", MaxKeys=1000, **kwargs):
+        keys = sorted(
+            key
+            for bucket, key in self.objects
+            if bucket == Bucket and key.startswith(Prefix)
+        )[:MaxKeys]
+        return {"Contents": [{"Key": key} for key in keys]} if keys else {}
+
+
+@pytest.fixture
+def s3(monkeypatch, tmp_path):
+    """Fake S3 behind services.client, with an empty dataset cache"""
+    import dataset
+    import services
+
+    fake = FakeS3()
+    monkeypatch.setattr(services, "client", lambda service, region=None: fake)
+    monkeypatch.setattr(dataset, "CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(dataset, "_datasets", {})
+    return fake
@@ -0,0 +1,157 @@
+import socket
+import time
+
+import gevent
+from locust.env import Environment
+
+from cluster import MasterLiveness
+from cluster import WorkerBarrier
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_master(port, barrier):
+    master = Environment().create_master_runner("127.0.0.1", port)
+    master.register_message(
+        "worker_ready", lambda environment, msg, **kwargs: barrier.add(msg.node_id)
+    )
+    return master
+
+
+def start_worker(port, liveness=None):
+    worker = Environment().create_worker_runner("127.0.0.1", port)
+    if liveness is not None:
+        worker.register_message("master_heartbeat", liveness.on_heartbeat)
+    worker.send_message("worker_ready")
+    return worker
+
+
+def send_heartbeats(master):
+    while True:
+        master.send_message("master_heartbeat")
+        gevent.sleep(0.1)
+
+
+def stop(master, workers):
+    for worker in workers:
+        worker.greenlet.kill(block=False)
+    master.quit()
+
+
+def test_barrier_opens_when_all_workers_are_ready():
+    port = free_port()
+    barrier = WorkerBarrier(2, timeout=10)
+    master = start_master(port, barrier)
+    workers = [start_worker(port) for _ in range(2)]
+    try:
+        assert barrier.wait()
+        summary = barrier.summary()
+        assert summary["ready_workers"] == 2
+        assert summary["missing_workers"] == 0
+        assert summary["time_to_ready"] < 10
+    finally:
+        stop(master, workers)
+
+
+def test_barrier_starts_with_quorum_and_counts_late_workers():
+    port = free_port()
+    barrier = WorkerBarrier(4, quorum=0.5, timeout=10)
+    master = start_master(port, barrier)
+    workers = [start_worker(port) for _ in range(2)]
+    try:
+        assert barrier.wait()
+        workers.append(start_worker(port))
+        gevent.sleep(0.5)
+        summary = barrier.summary()
+        assert summary["ready_workers"] == 2
+        assert summary["late_workers"] == 1
+        assert summary["missing_workers"] == 1
+    finally:
+        stop(master, workers)
+
+
+def test_barrier_fails_below_min_workers_at_deadline():
+    port = free_port()
+    barrier = WorkerBarrier(3, min_workers=2, timeout=1)
+    master = start_master(port, barrier)
+    workers = [start_worker(port)]
+    try:
+        assert not barrier.wait()
+    finally:
+        stop(master, workers)
+
+
+def watch(liveness, seconds):
+    """Call lost() like MasterLiveness.watch for a while. Return True once it reports the master lost"""
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        if liveness.lost():
+            return True
+        gevent.sleep(liveness.interval)
+    return False
+
+
+def test_worker_exits_once_master_task_is_confirmed_stopped():
+    port = free_port()
+    barrier = WorkerBarrier(1, timeout=10)
+    master = start_master(port, barrier)
+    checks = []
+    task_stopped = []
+
+    def check_master():
+        checks.append(time.time())
+        return bool(task_stopped)
+
+    liveness = MasterLiveness(0.1, 3, check_master=check_master)
+    workers = [start_worker(port, liveness)]
+    heartbeats = gevent.spawn(send_heartbeats, master)
+    try:
+        assert barrier.wait()
+        assert not watch(liveness, 0.5)
+        assert liveness.last is not None
+        assert not checks
+
+        # Heartbeats stop, but the master task is still running (e.g. the master stalls)
+        heartbeats.kill()
+        assert not watch(liveness, 2)
+        assert 1 <= len(checks) <= 4
+        # Checks back off
+        assert all(b - a > 0.1 for a, b in zip(checks, checks[1:]))
+
+        task_stopped.append(True)
+        assert watch(liveness, 3)
+    finally:
+        heartbeats.kill()
+        stop(master, workers)
+
+
+def test_failed_checks_do_not_stop_the_worker():
+    def check_master():
+        raise RuntimeError("Rate exceeded")
+
+    liveness = MasterLiveness(0.1, 3, check_master=check_master, max_silence=2)
+    liveness.on_heartbeat(None, None)
+    assert not watch(liveness, 1.5)
+    # Until the hard silence limit
+    assert watch(liveness, 1.5)
+
+
+def test_checks_before_the_first_heartbeat_tolerate_errors():
+    def check_master():
+        raise RuntimeError("Rate exceeded")
+
+    liveness = MasterLiveness(0.1, 3, check_master=check_master)
+    liveness.backoff.next = 0
+    assert not liveness.lost()
+
+
+def test_worker_exits_on_missed_heartbeats_without_ecs():
+    liveness = MasterLiveness(0.1, 3)
+    liveness.on_heartbeat(None, None)
+    assert not liveness.lost()
+    gevent.sleep(0.5)
+    assert liveness.lost()
@@ -0,0 +1,116 @@
+import os
+
+import pytest
+
+from dataset import forget_datasets
+from dataset import load_dataset
+from dataset import StreamingDataset
+
+QUOTED = (
+    "sample_input,sample_output\n"
+    '"{""name"":""a,b""}",x\n'
+    '"line 1\nline 2",y\n'
+    "plain,z\n"
+)
+
+
+def rows(dataset):
+    return [bytes(dataset[i]) for i in range(len(dataset))]
+
+
+def test_cache_keeps_quoted_commas_and_new_lines(s3):
+    s3.put("b", "data.csv", QUOTED)
+    dataset = load_dataset("b", "data.csv")
+    assert rows(dataset) == [b'{"name":"a,b"}', b"line 1\nline 2", b"plain"]
+    cursor = dataset.cursor(2)
+    assert [cursor.next() for _ in range(2)] == [b"plain", b'{"name":"a,b"}']
+
+
+def test_cache_is_shared_by_the_process(s3):
+    s3.put("b", "data.csv", QUOTED)
+    assert load_dataset("b", "data.csv") is load_dataset("b", "data.csv")
+
+
+def test_cache_is_packed_again_when_the_object_changes(s3, monkeypatch):
+    import dataset
+
+    s3.put("b", "data.csv", QUOTED)
+    load_dataset("b", "data.csv")
+    gets = s3.gets
+    # Another process (or run) on the same host finds the packed file
+    monkeypatch.setattr(dataset, "_datasets", {})
+    assert len(load_dataset("b", "data.csv")) == 3
+    assert s3.gets == gets
+
+    s3.put("b", "data.csv", "sample_input,sample_output\nnew,1\n")
+    monkeypatch.setattr(dataset, "_datasets", {})
+    assert rows(load_dataset("b", "data.csv")) == [b"new"]
+    packed = os.listdir(os.path.dirname(dataset.cache_path("b", "data.csv")))
+    assert len([name for name in packed if name.endswith(".idx")]) == 1
+
+
+def test_next_job_keeps_only_the_datasets_of_its_object(s3):
+    s3.put("b", "a.csv", QUOTED)
+    s3.put("b", "b.csv", QUOTED)
+    kept = load_dataset("b", "a.csv")
+    load_dataset("b", "b.csv")
+    assert forget_datasets("b", "a.csv") == [kept]
+    assert load_dataset("b", "a.csv") is kept
+
+
+def test_stream_keeps_quoted_commas_and_new_lines_across_chunks(s3):
+    s3.put("b", "data.csv", QUOTED)
+    stream = StreamingDataset("b", "data.csv", window=2, chunk_size=5)
+    assert [stream.next() for _ in range(3)] == [
+        b'{"name":"a,b"}',
+        b"line 1\nline 2",
+        b"plain",
+    ]
+
+
+def test_stream_loops_back_to_the_first_row(s3):
+    s3.put("b", "data.csv", QUOTED)
+    stream = load_dataset("b", "data.csv", mode="stream")
+    assert stream.cursor() is stream
+    sent = [stream.next() for _ in range(7)]
+    assert sent[3:6] == sent[:3]
+    assert sent[6] == sent[0]
+
+
+def test_shards_are_disjoint_and_cover_every_row(s3):
+    expected = [f"row{i:03d}".encode() for i in range(40)]
+    s3.put(
+        "b",
+        "data.csv",
+        "sample_input,sample_output\n"
+        + "".join(f"{row.decode()},x\n" for row in expected),
+    )
+    for count in [1, 2, 3, 5, 8]:
+        shards = [
+            rows(load_dataset("b", "data.csv", shard=(i, count))) for i in range(count)
+        ]
+        assert all(shards)
+        assert sorted(row for shard in shards for row in shard) == expected
+
+
+def test_stream_shard_matches_the_cached_shard(s3):
+    s3.put("b", "data.csv", "sample_input\n" + "".join(f"row{i}\n" for i in range(30)))
+    cached = rows(load_dataset("b", "data.csv", shard=(1, 3)))
+    stream = load_dataset("b", "data.csv", mode="stream", shard=(1, 3))
+    assert [stream.next() for _ in range(len(cached))] == cached
+    assert stream.next() == cached[0]
+
+
+def test_a_shard_without_rows_uses_every_row(s3):
+    s3.put("b", "data.csv", "sample_input,sample_output\nrow,1\n")
+    # The first half of the object only holds the header
+    assert rows(load_dataset("b", "data.csv", shard=(0, 2))) == [b"row"]
+    assert rows(load_dataset("b", "data.csv", shard=(1, 2))) == [b"row"]
+    stream = load_dataset("b", "data.csv", mode="stream", shard=(0, 2))
+    assert [stream.next() for _ in range(2)] == [b"row", b"row"]
+
+
+def test_a_dataset_without_rows_fails(s3):
+    s3.put("b", "data.csv", "sample_input,sample_output\n")
+    with pytest.raises(ValueError):
+        load_dataset("b", "data.csv")
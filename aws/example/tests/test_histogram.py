@@ -0,0 +1,86 @@
+from histogram import bucket_index
+from histogram import bucket_value
+from histogram import BUCKETS
+from histogram import LatencyHistogram
+from histogram import percentile_fraction
+
+
+def test_small_values_are_exact():
+    for value in range(128):
+        assert bucket_value(bucket_index(value)) == value
+
+
+def test_buckets_keep_about_two_percent_precision():
+    previous = 0
+    for value in [128, 129, 200, 1000, 4567, 60000, 10 ** 6, 10 ** 9]:
+        idx = bucket_index(value)
+        assert idx >= previous
+        previous = idx
+        assert abs(bucket_value(idx) - value) <= value * 0.016
+
+
+def test_huge_and_negative_values_stay_in_range():
+    assert bucket_index(-5) == 0
+    assert bucket_index(2 ** 60) == BUCKETS - 1
+
+
+def test_percentile_fraction():
+    assert percentile_fraction("50") == 0.5
+    assert percentile_fraction("95") == 0.95
+    assert percentile_fraction("999") == 0.999
+
+
+def test_percentiles():
+    histogram = LatencyHistogram()
+    for value in range(1, 101):
+        histogram.record(value)
+    assert histogram.total == 100
+    assert histogram.percentiles([0.5, 0.95, 1.0]) == [50, 95, 100]
+    assert LatencyHistogram().percentile(0.5) == 0
+
+
+def test_record_with_count():
+    histogram = LatencyHistogram()
+    histogram.record(10, 99)
+    histogram.record(1000)
+    assert histogram.total == 100
+    assert histogram.percentile(0.99) == 10
+    assert histogram.percentile(1.0) == bucket_value(bucket_index(1000))
+
+
+def test_merge_and_diff():
+    a = LatencyHistogram.from_dict({10: 3, 20: 1})
+    b = LatencyHistogram.from_dict({20: 2, 5000: 1})
+    snapshot = a.copy()
+    a.merge(b)
+    assert a.total == 7
+    assert a.to_dict() == {10: 3, 20: 3, bucket_value(bucket_index(5000)): 1}
+    assert (a - snapshot).to_dict() == LatencyHistogram.from_dict(
+        {20: 2, 5000: 1}
+    ).to_dict()
+    assert snapshot.total == 4
+
+
+def test_dict_round_trip():
+    histogram = LatencyHistogram.from_dict({1: 1, 300: 2, 70000: 5})
+    assert LatencyHistogram.from_dict(histogram.to_dict()).counts == histogram.counts
+
+
+def test_record_series_matches_recording_each_value():
+    for value, step, count in [
+        (5000.0, 10.0, 500),
+        (120.4, 0.25, 400),
+        (10 ** 6, 3.7, 1),
+    ]:
+        expected = LatencyHistogram()
+        for k in range(count):
+            expected.record(round(value - k * step))
+        histogram = LatencyHistogram()
+        histogram.record_series(value, step, count)
+        assert histogram.counts == expected.counts
+
+
+def test_record_series_updates_each_bucket_once():
+    histogram = LatencyHistogram()
+    histogram.record_series(10.0 ** 7, 0.001, 10 ** 10)
+    assert histogram.total == 10 ** 10
@@ -0,0 +1,32 @@
+from types import SimpleNamespace
+
+from omission import OmissionRecorder
+
+
+def test_requests_are_measured_from_their_intended_time():
+    recorder = OmissionRecorder()
+    user = SimpleNamespace(skipped_slots=None)
+    recorder.record(user, None, 10.0, 10.01)
+    recorder.record(user, 10.0, 10.05, 10.06)
+    assert recorder.histogram.to_dict() == {10: 1, 60: 1}
+
+
+def test_skipped_slots_are_backfilled():
+    recorder = OmissionRecorder()
+    user = SimpleNamespace(skipped_slots=(10.0, 3, 0.01))
+    recorder.record(user, 10.03, 10.03, 10.04)
+    assert recorder.histogram.to_dict() == {10: 1, 20: 1, 30: 1, 40: 1}
+    assert recorder.backfilled == 3
+    assert user.skipped_slots is None
+
+
+def test_workers_reports_are_merged_on_the_master():
+    worker, master = OmissionRecorder(), OmissionRecorder()
+    user = SimpleNamespace(skipped_slots=(0.0, 10 ** 6, 0.001))
+    worker.record(user, 1000.0, 1000.0, 1000.001)
+    data = {}
+    worker.on_report_to_master("worker", data)
+    master.on_worker_report("worker", data)
+    assert worker.histogram.total == 0
+    assert master.histogram.total == 10 ** 6 + 1
+    assert master.report(["50"])["backfilled_samples"] == 10 ** 6
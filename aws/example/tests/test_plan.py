@@ -0,0 +1,91 @@
+import pytest
+
+from plan import simulate
+from plan import size_fleet
+from plan import step_function_input
+from plan import summarize
+
+STAGES = [
+    {"users": 10, "spawn_rate": 5, "duration": 4},
+    {"users": 0, "spawn_rate": 10, "duration": 1},
+]
+
+
+def test_simulate_ramps_at_the_spawn_rate_and_holds_each_stage():
+    timeline = simulate(STAGES)
+    users = [u for _, _, u in timeline]
+    assert users[:2] == [5, 10]
+    assert users.count(10) >= 5
+    assert users[-1] == 0
+    summary = summarize(STAGES, timeline)
+    assert summary["peak_users"] == 10
+    assert summary["duration"] == len(timeline)
+
+
+def test_simulate_time_mode_follows_the_stage_end_times():
+    timeline = simulate(STAGES, mode="time")
+    assert [target for _, target, _ in timeline] == [10, 10, 10, 10]
+    assert [u for _, _, u in timeline] == [5, 10, 10, 10]
+
+
+def test_simulate_rps_stages_use_the_users_needed_at_the_latency():
+    stages = [
+        {"mode": "rps", "rps": 100, "spawn_rate": 100, "duration": 2},
+        {"users": 0, "spawn_rate": 100, "duration": 1},
+    ]
+    timeline = simulate(stages, latency=0.2)
+    assert max(u for _, _, u in timeline) == 30
+    assert summarize(stages, timeline)["peak_rps"] == 100
+
+
+def test_size_fleet_from_users_per_vcpu():
+    assert size_fleet(1000, vcpus_per_worker=2, users_per_vcpu=100) == 5
+    assert size_fleet(1001, vcpus_per_worker=2, users_per_vcpu=100) == 6
+    assert size_fleet(0, users_per_vcpu=100) == 1
+
+
+def test_size_fleet_from_rps_per_vcpu():
+    assert size_fleet(100, rps_per_vcpu=50, rps_per_user=2) == 4
+    assert size_fleet(0, vcpus_per_worker=4, rps_per_vcpu=50, peak_rps=1000) == 5
+    with pytest.raises(ValueError):
+        size_fleet(100, rps_per_vcpu=50)
+
+
+def template(worker_command):
+    return {
+        "JobDetails": {"MasterCommand": ["--master", "--expected-workers", "1"]},
+        "Jobs": [{"WorkerCommand": worker_command}],
+    }
+
+
+def test_step_function_input_expects_every_worker():
+    result = step_function_input(template(["--worker"]), 8)
+    assert result["WorkerCount"] == 8
+    assert result["WorkerTemplate"] == {"WorkerCommand": ["--worker"]}
+    assert "Jobs" not in result
+    assert result["JobDetails"]["MasterCommand"] == [
+        "--master",
+        "--expected-workers",
+        "8",
+    ]
+
+
+def test_step_function_input_counts_the_processes_of_each_worker():
+    result = step_function_input(template(["--processes", "3"]), 4)
+    assert result["JobDetails"]["MasterCommand"][-1] == "12"
+    result = step_function_input(
+        template(["--processes", "auto"]), 4, vcpus_per_worker=2
+    )
+    assert result["JobDetails"]["MasterCommand"][-1] == "8"
+
+
+def test_step_function_input_keeps_the_template_unchanged():
+    original = template(["--worker"])
+    original["JobDetails"]["MasterCommand"] = ["--master"]
+    result = step_function_input(original, 2)
+    assert result["JobDetails"]["MasterCommand"] == [
+        "--master",
+        "--expected-workers",
+        "2",
+    ]
+    assert original["JobDetails"]["MasterCommand"] == ["--master"]
@@ -0,0 +1,28 @@
+import json
+
+from pool import JobQueue
+
+
+def test_jobs_move_from_pending_to_done(s3):
+    queue = JobQueue("bucket", "pool/", poll_interval=0.01)
+    job_id = queue.submit({"testdata_key": "a.csv"})
+    assert queue.next() == (job_id, {"testdata_key": "a.csv"})
+    assert ("bucket", f"pool/running/{job_id}.json") in s3.objects
+    queue.finish(job_id, {"testdata_key": "a.csv"})
+    assert list(s3.objects) == [("bucket", f"pool/done/{job_id}.json")]
+
+
+def test_unreadable_jobs_are_failed(s3):
+    queue = JobQueue("bucket", "pool", poll_interval=0.01)
+    s3.put("bucket", "pool/pending/1-bad.json", "{not json")
+    s3.put("bucket", "pool/pending/2-list.json", "[1, 2]")
+    s3.put("bucket", "pool/pending/3-good.json", '{"host": "https://example"}')
+    assert queue.next() == ("3-good", {"host": "https://example"})
+    for job_id in ["1-bad", "2-list"]:
+        assert ("bucket", f"pool/pending/{job_id}.json") not in s3.objects
+        failed = json.loads(s3.objects[("bucket", f"pool/failed/{job_id}.json")])
+        assert failed["error"]
+
+
+def test_idle_queue(s3):
+    assert JobQueue("bucket", "pool", poll_interval=0.01).next(0.05) is None
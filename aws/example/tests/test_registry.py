@@ -0,0 +1,62 @@
+import json
+
+import pytest
+
+import registry
+import services
+
+
+class InvalidToken(Exception):
+    pass
+
+
+class FakeStepFunctions:
+    """A token can be completed once"""
+
+    class exceptions:
+        InvalidToken = InvalidToken
+        TaskDoesNotExist = KeyError
+        TaskTimedOut = TimeoutError
+
+    def __init__(self):
+        self.outputs = {}
+
+    def send_task_success(self, taskToken, output):
+        if taskToken in self.outputs:
+            raise InvalidToken(taskToken)
+        self.outputs[taskToken] = json.loads(output)
+
+
+@pytest.fixture
+def sfn(s3, monkeypatch):
+    fake = FakeStepFunctions()
+    clients = {"s3": s3, "stepfunctions": fake}
+    monkeypatch.setattr(
+        services, "client", lambda service, region=None: clients[service]
+    )
+    monkeypatch.delenv("ECS_CONTAINER_METADATA_URI_V4", raising=False)
+    return fake
+
+
+def put_token(s3, token):
+    s3.put("bucket", "_registry/exec/token.json", json.dumps({"TaskToken": token}))
+
+
+def test_master_first_leaves_the_token_to_the_lambda(s3, sfn):
+    master = registry.MasterRegistry("bucket", "exec").announce("10.0.0.5", 5557)
+    assert master["MasterPrivateIp"] == "10.0.0.5"
+    assert json.loads(s3.objects[("bucket", "_registry/exec/master.json")]) == master
+    assert sfn.outputs == {}
+
+
+def test_token_first_is_completed_by_the_master(s3, sfn):
+    put_token(s3, "token")
+    master = registry.MasterRegistry("bucket", "exec").announce("10.0.0.5", 5557)
+    assert sfn.outputs == {"token": master}
+
+
+def test_token_already_completed_by_the_lambda(s3, sfn):
+    put_token(s3, "token")
+    sfn.send_task_success(taskToken="token", output="{}")
+    registry.MasterRegistry("bucket", "exec").announce("10.0.0.5", 5557)
+    assert sfn.outputs == {"token": {}}
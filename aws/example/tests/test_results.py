@@ -0,0 +1,47 @@
+import pytest
+
+from results import ResultStore
+
+
+def test_saved_runs_are_listed_and_loaded(s3):
+    store = ResultStore("bucket", "results/")
+    history = [{"time": 1, "current_rps": 10}, {"time": 2, "current_rps": 12}]
+    first = store.save(
+        {"time": "2021-05-09 10:00", "num_requests": 42, "history": history},
+        execution_id="exec/1",
+    )
+    second = store.save({"num_requests": 7}, execution_id="exec-2")
+    runs = store.list_runs()
+    assert sorted(run["run_id"] for run in runs) == sorted([first, second])
+    entry = store.list_runs(first)[0]
+    assert entry == {
+        "run_id": first,
+        "execution_id": "exec/1",
+        "location": f"results/runs/exec/1/{first}",
+        "time": "2021-05-09 10:00",
+        "num_requests": 42,
+    }
+    # Listing reads no object
+    gets = s3.gets
+    store.list_runs()
+    assert s3.gets == gets
+
+    assert store.load_run(first) == {
+        "time": "2021-05-09 10:00",
+        "num_requests": 42,
+        "history": history,
+    }
+    assert store.load_run(second, history=False) == {"num_requests": 7}
+
+
+def test_missing_fields_are_none(s3):
+    store = ResultStore("bucket", "results")
+    run_id = store.save({}, execution_id="exec")
+    assert store.list_runs(run_id)[0]["time"] is None
+    assert store.list_runs(run_id)[0]["num_requests"] is None
+    assert store.load_run(run_id) == {"history": []}
+
+
+def test_unknown_run(s3):
+    with pytest.raises(KeyError):
+        ResultStore("bucket", "results").load_run("nope")
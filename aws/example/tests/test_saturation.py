@@ -0,0 +1,110 @@
+import socket
+
+import gevent
+from locust.env import Environment
+from locust.runners import STATE_RUNNING
+
+from saturation import BalancedMasterRunner
+from saturation import SaturationMonitor
+
+IDLE = {"cpu_percent": 20, "loop_lag_ms": 1, "scheduling_delay_ms": 0.1}
+BUSY_ENOUGH = {"cpu_percent": 60, "loop_lag_ms": 5, "scheduling_delay_ms": 1}
+BUSY = {"cpu_percent": 100, "loop_lag_ms": 10, "scheduling_delay_ms": 5}
+
+
+def test_saturated_only_while_running_users():
+    monitor = SaturationMonitor(cpu_threshold=90, lag_threshold_ms=50)
+    assert monitor.saturated(BUSY, 10)
+    assert not monitor.saturated(BUSY, 0)
+    assert not monitor.saturated(IDLE, 10)
+    assert monitor.saturated(dict(IDLE, loop_lag_ms=80), 10)
+
+
+def test_allocate_moves_users_away_from_saturated_workers():
+    monitor = SaturationMonitor(cpu_threshold=90)
+    monitor.add("a", BUSY, 50)
+    monitor.add("b", IDLE, 50)
+    monitor.add("c", IDLE, 50)
+    allocation = monitor.allocate(150, ["a", "b", "c"])
+    assert allocation == {"a": 45, "b": 53, "c": 52}
+    assert sum(allocation.values()) == 150
+
+
+def test_allocate_keeps_the_even_split_below_the_cap():
+    monitor = SaturationMonitor(cpu_threshold=90)
+    monitor.add("a", BUSY, 100)
+    monitor.add("b", IDLE, 10)
+    assert monitor.allocate(40, ["a", "b"]) == {"a": 20, "b": 20}
+
+
+def test_caps_hold_until_the_load_drops_well_below_the_thresholds():
+    monitor = SaturationMonitor(cpu_threshold=90)
+    monitor.add("a", BUSY, 50)
+    monitor.add("b", IDLE, 50)
+    # No longer saturated with fewer users, but not far from it either
+    monitor.add("a", BUSY_ENOUGH, 45)
+    assert monitor.allocate(200, ["a", "b"]) == {"a": 45, "b": 155}
+    monitor.add("a", IDLE, 45)
+    assert monitor.allocate(200, ["a", "b"]) is None
+    monitor.add("a", BUSY, 50)
+    monitor.reset()
+    assert monitor.allocate(200, ["a", "b"]) is None
+
+
+def test_allocate_without_saturated_or_free_workers():
+    monitor = SaturationMonitor()
+    monitor.add("a", IDLE, 10)
+    monitor.add("b", IDLE, 10)
+    assert monitor.allocate(20, ["a", "b"]) is None
+    monitor.add("a", BUSY, 10)
+    monitor.add("b", BUSY, 10)
+    assert monitor.allocate(20, ["a", "b"]) is None
+
+
+def test_collect_reports_the_peaks_of_the_interval():
+    monitor = SaturationMonitor()
+    monitor.add("a", BUSY, 10)
+    monitor.add("a", IDLE, 10)
+    monitor.add("b", IDLE, 10)
+    assert monitor.collect() == {
+        "saturated_workers": 1,
+        "worker_cpu_percent": 100,
+        "loop_lag_ms": 10,
+        "scheduling_delay_ms": 5,
+    }
+    assert monitor.collect()["saturated_workers"] == 0
+    assert monitor.summary()["saturated_intervals"] == 1
+    assert monitor.summary()["workers"]["a"]["saturated_reports"] == 1
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_balanced_runner_scales_spawn_rates_with_the_allocation():
+    port = free_port()
+    monitor = SaturationMonitor(cpu_threshold=90, rebalance=True)
+    master = BalancedMasterRunner(Environment(), "127.0.0.1", port)
+    master.monitor = monitor
+    workers = [Environment().create_worker_runner("127.0.0.1", port) for _ in range(2)]
+    sent = []
+    master.server.send_to_client = sent.append
+    try:
+        while len(master.clients.ready) < 2:
+            gevent.sleep(0.1)
+        busy, free = sorted(worker.id for worker in master.clients.ready)
+        monitor.add(busy, BUSY, 50)
+        master.update_state(STATE_RUNNING)
+        master.start(100, 10)
+        spawns = {message.node_id: message.data for message in sent}
+        assert spawns[busy]["num_users"] == 45
+        assert spawns[free]["num_users"] == 55
+        assert spawns[busy]["spawn_rate"] == 4.5
+        assert spawns[free]["spawn_rate"] == 5.5
+    finally:
+        for worker in workers:
+            worker.greenlet.kill(block=False)
+        master.greenlet.kill(block=False)
+        master.server.close()
@@ -0,0 +1,101 @@
+import pytest
+
+from schedule import CompiledShape
+from schedule import pacing_users
+from schedule import parse_shape
+from schedule import validate_stages
+
+STAGES = [
+    {"users": 10, "spawn_rate": 1, "duration": 10},
+    {"users": 30, "spawn_rate": 1, "duration": 20},
+    {"users": 0, "spawn_rate": 1, "duration": 30},
+]
+
+
+def test_parse_shape():
+    assert parse_shape(STAGES) == (STAGES, {})
+    assert parse_shape({"mode": "time", "stages": STAGES}) == (
+        STAGES,
+        {"mode": "time"},
+    )
+    assert parse_shape({"mode": "search", "search": {}}) == (
+        [],
+        {"mode": "search", "search": {}},
+    )
+    with pytest.raises(ValueError):
+        parse_shape({"mode": "time"})
+
+
+def test_validate_stages_accepts_a_valid_shape():
+    assert validate_stages(STAGES, mode="time") is STAGES
+    rps = [
+        {"mode": "rps", "rps": 50, "spawn_rate": 10, "duration": 10},
+        {"users": 0, "spawn_rate": 10, "duration": 1},
+    ]
+    assert validate_stages(rps) is rps
+
+
+@pytest.mark.parametrize(
+    "stages,mode",
+    [
+        ([], "users"),
+        ([{"users": 0, "spawn_rate": 1}], "users"),
+        ([{"users": "10", "spawn_rate": 1, "duration": 1}], "users"),
+        ([{"users": -1, "spawn_rate": 1, "duration": 1}], "users"),
+        ([{"users": 0, "spawn_rate": 0, "duration": 1}], "users"),
+        ([{"mode": "burst", "users": 0, "spawn_rate": 1, "duration": 1}], "users"),
+        ([{"users": 10, "spawn_rate": 1, "duration": 1}], "users"),
+        (
+            [
+                {"users": 10, "spawn_rate": 1, "duration": 10},
+                {"users": 0, "spawn_rate": 1, "duration": 5},
+            ],
+            "time",
+        ),
+    ],
+)
+def test_validate_stages_rejects_invalid_shapes(stages, mode):
+    with pytest.raises(ValueError):
+        validate_stages(stages, mode=mode)
+
+
+def test_pacing_users():
+    assert pacing_users({"rps": 0}) == 0
+    assert pacing_users({"rps": 100}) == 38
+    assert pacing_users({"rps": 100}, latency=1) == 150
+    assert pacing_users({"rps": 1, "min_users": 5}) == 5
+    assert pacing_users({"rps": 1000, "max_users": 100}) == 100
+
+
+def test_step_shape():
+    shape = CompiledShape(STAGES)
+    assert shape.tick(0) == (10, 1)
+    assert shape.tick(9.9) == (10, 1)
+    assert shape.tick(10) == (30, 1)
+    assert shape.tick(25) == (0, 1)
+    assert shape.tick(30) is None
+    # Looking back after the current stage moved forward
+    assert shape.tick(5) == (10, 1)
+
+
+def test_linear_shape():
+    shape = CompiledShape(STAGES, "linear")
+    assert shape.tick(0) == (10, 1)
+    assert shape.tick(5) == (20, 1)
+    assert shape.tick(15) == (15, 1)
+    assert shape.tick(25) == (0, 1)
+
+
+def test_spline_shape_goes_through_the_stages_without_overshooting():
+    shape = CompiledShape(STAGES, "spline")
+    assert shape.tick(0) == (10, 1)
+    assert shape.tick(10) == (30, 1)
+    users = [shape.tick(t / 10)[0] for t in range(300)]
+    assert max(users) == 30
+    assert min(users) >= 0
+    assert users[:100] == sorted(users[:100])
+
+
+def test_unknown_interpolation():
+    with pytest.raises(ValueError):
+        CompiledShape(STAGES, "cubic")
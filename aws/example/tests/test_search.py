@@ -0,0 +1,76 @@
+import pytest
+
+from search import CapacitySearch
+
+
+def result(p95=100, failure_rate=0.0, rps=100, steady=True, num_requests=1000):
+    return {
+        "steady": steady,
+        "num_requests": num_requests,
+        "response_time_percentile_95": p95,
+        "failure_rate": failure_rate,
+        "requests_per_second": rps,
+    }
+
+
+def run(search, capacity):
+    """Search a target that holds the SLO up to `capacity` users"""
+    level = search.start
+    while level is not None:
+        level = search.record(level, result(p95=100 if level <= capacity else 5000))
+    return search.report()
+
+
+def test_search_grows_then_bisects_to_the_capacity():
+    search = CapacitySearch(start=10, precision=0.05)
+    report = run(search, 137)
+    levels = [probe["level"] for probe in search.probes]
+    assert levels[:5] == [10, 20, 40, 80, 160]
+    assert search.done
+    assert 137 * 0.95 <= report["max_sustainable"]["level"] <= 137
+    assert report["curve"] == sorted(search.probes, key=lambda p: p["level"])
+
+
+def test_search_stops_at_the_maximum():
+    search = CapacitySearch(start=10, step=10, maximum=30)
+    report = run(search, 1000)
+    assert [probe["level"] for probe in search.probes] == [10, 20, 30]
+    assert report["max_sustainable"]["level"] == 30
+
+
+def test_search_with_nothing_passing():
+    search = CapacitySearch(start=10)
+    report = run(search, 0)
+    assert report["max_sustainable"] is None
+    assert report["max_sustainable_rps"] == 0
+
+
+def test_search_stops_after_max_probes():
+    search = CapacitySearch(start=1, max_probes=3)
+    run(search, 10 ** 9)
+    assert len(search.probes) == 3
+
+
+def test_probe_fails_on_errors_ramp_and_throughput():
+    search = CapacitySearch(target="rps", max_users=50)
+    assert search.probe(200) == {
+        "mode": "rps",
+        "rps": 200,
+        "max_users": 50,
+        "duration": 60,
+        "spawn_rate": 20,
+    }
+    assert search.passes(100, result(rps=96))
+    assert not search.passes(100, result(rps=90))
+    assert not search.passes(100, result(failure_rate=0.05))
+    assert not search.passes(100, result(steady=False))
+    assert not search.passes(100, result(num_requests=0))
+
+
+@pytest.mark.parametrize(
+    "options",
+    [{"target": "bytes"}, {"start": 0}, {"factor": 1}, {"step": -1}],
+)
+def test_invalid_search(options):
+    with pytest.raises(ValueError):
+        CapacitySearch(**options)
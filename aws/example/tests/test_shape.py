@@ -0,0 +1,22 @@
+import shape
+
+
+def test_shapes_are_downloaded_once_until_forgotten(monkeypatch):
+    downloads = []
+    documents = {"key": [{"users": 10, "spawn_rate": 1, "duration": 1}]}
+
+    def download(bucket, key):
+        downloads.append(key)
+        return documents[key]
+
+    monkeypatch.setattr(shape, "_download_stages", download)
+    shape.forget_stages()
+    assert shape.prefetch_stages("bucket", "key").get()[0]["users"] == 10
+    assert shape.prefetch_stages("bucket", "key").get()[0]["users"] == 10
+    assert downloads == ["key"]
+
+    documents["key"] = [{"users": 20, "spawn_rate": 1, "duration": 1}]
+    shape.forget_stages()
+    assert shape.prefetch_stages("bucket", "key").get()[0]["users"] == 20
+    assert downloads == ["key", "key"]
+    shape.forget_stages()
@@ -0,0 +1,32 @@
+import sink
+
+
+class RecordingS3:
+    def __init__(self):
+        self.keys = []
+
+    def put_object(self, Bucket, Key, Body):
+        self.keys.append(Key)
+
+
+def test_s3_parts_restart_under_the_job_id(monkeypatch):
+    s3 = RecordingS3()
+    monkeypatch.setattr(sink.services, "client", lambda service, region=None: s3)
+    metrics = sink.S3Sink("bucket", "live/", "exec", flush_interval=0.1)
+    metrics.offer({"users": 1})
+    metrics.restart("job-1")
+    metrics.offer({"users": 2})
+    metrics.offer({"users": 3})
+    metrics.close()
+    assert s3.keys == [
+        "live/exec/part-000001.ndjson",
+        "live/exec/job-1/part-000001.ndjson",
+    ]
+    assert metrics.summary() == {"records": 2, "dropped": 0, "batches": 1}
+
+
+def test_base_sink_writes_nowhere():
+    metrics = sink.MetricsSink(flush_interval=0.1)
+    metrics.offer({"users": 1})
+    metrics.close()
+    assert metrics.summary()["records"] == 1
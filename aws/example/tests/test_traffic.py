@@ -0,0 +1,85 @@
+import json
+from collections import Counter
+
+import pytest
+
+from traffic import RequestCompiler
+from traffic import RequestPlan
+from traffic import WeightedOrder
+
+
+def longest_run(order, idx):
+    longest = current = 0
+    for value in order:
+        current = current + 1 if value == idx else 0
+        longest = max(longest, current)
+    return longest
+
+
+def test_weighted_order_repeats_entries_by_weight():
+    order = WeightedOrder([2, 4, 6])
+    assert len(order) == 6
+    assert Counter(order) == {0: 1, 1: 2, 2: 3}
+
+
+def test_weighted_order_interleaves_heavy_entries():
+    order = list(WeightedOrder([1, 1, 8]))
+    assert Counter(order) == {0: 1, 1: 1, 2: 8}
+    assert longest_run(order, 2) < 8
+    assert abs(order.index(0) - order.index(1)) >= 3
+
+
+def test_weighted_order_keeps_equal_weights_in_order():
+    assert list(WeightedOrder([5, 5, 5])) == [0, 1, 2]
+
+
+def test_weighted_order_memory_does_not_grow_with_the_weights():
+    order = WeightedOrder([10 ** 9, 1])
+    assert len(order) == 10 ** 9 + 1
+    assert len(order.ends) == 2
+    assert sum(1 for i in range(10 ** 5) if order[i] == 1) <= 1
+    with pytest.raises(IndexError):
+        order[len(order)]
+
+
+def test_weighted_order_skips_zero_weights():
+    assert Counter(WeightedOrder([0, 3, 0, 3])) == {1: 1, 3: 1}
+    with pytest.raises(ValueError):
+        WeightedOrder([0, 0])
+
+
+def test_request_plan_cycles_through_the_weighted_requests():
+    plan = RequestPlan(["a", "b"], [1, 3])
+    cursor = plan.cursor()
+    sent = [cursor.next() for _ in range(4 * len(plan))]
+    assert Counter(sent) == {"a": 4, "b": 12}
+    assert RequestPlan(["a"], [1], shared=True).cursor() is not None
+
+
+def test_compiler_defaults_and_shared_headers():
+    compiler = RequestCompiler(method_path="/hello", headers={"Accept": "json"})
+    request, weight = compiler.compile("{}")
+    assert (request.method, request.path, request.name, request.body) == (
+        "POST",
+        "/hello",
+        "/hello",
+        None,
+    )
+    assert weight == 1
+    row = {
+        "method": "put",
+        "path": "/items/1",
+        "name": "/items/[id]",
+        "headers": {"X-Tenant": "a"},
+        "body": {"id": 1},
+        "weight": 3,
+    }
+    first, weight = compiler.compile(json.dumps(row))
+    second, _ = compiler.compile(json.dumps(dict(row, path="/items/2")))
+    assert first.method == "PUT"
+    assert first.body == b'{"id":1}'
+    assert weight == 3
+    assert first.headers == {"Accept": "json", "X-Tenant": "a"}
+    assert first.headers is second.headers
+    with pytest.raises(ValueError):
+        compiler.compile('{"weight": -1}')
@@ -0,0 +1,159 @@
+"""
+Master discovery time of the status Lambda against cluster size, with a local ECS stand-in.
+
+Compares the legacy lookup (list the family page by page, describe and scan each page serially)
+with the indexed one (startedBy filter, concurrent describe batches, task and IP cache),
+and with the fallback scan of the family used when the master was started without startedBy.
+Each ECS call sleeps --latency seconds, like a round trip to the API.
+
+    python bench/status_lookup.py --tasks 10,100,500,2000 --latency 0.05
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import status  # noqa: E402
+from interface import DistributedLocust  # noqa: E402
+from interface import Fargate  # noqa: E402
+
+FAMILY = "distributed-locust"
+EXECUTION_ID = "ab0e1f2da1e511eb8992d9ddf1fe3780"
+
+
+class FakeECS:
+    """list_tasks and describe_tasks over a cluster of running tasks, the master being listed last"""
+
+    def __init__(self, count, latency):
+        self.latency = latency
+        self.calls = 0
+        self.lock = threading.Lock()
+        self.tasks = {}
+        for i in range(count):
+            master = i == count - 1
+            arn = f"arn:aws:ecs:region:account:task/cluster/{i:032x}"
+            self.tasks[arn] = {
+                "taskArn": arn,
+                "lastStatus": "RUNNING",
+                "startedBy": EXECUTION_ID if master else f"other-{i}",
+                "overrides": {
+                    "containerOverrides": [
+                        {
+                            "name": FAMILY,
+                            "environment": [
+                                {"name": "AWS_REGION", "value": "region"},
+                                {
+                                    "name": "EXECUTION_ID",
+                                    "value": EXECUTION_ID if master else f"other-{i}",
+                                },
+                            ],
+                        }
+                    ]
+                },
+                "attachments": [
+                    {
+                        "type": "ElasticNetworkInterface",
+                        "details": [
+                            {
+                                "name": "privateIPv4Address",
+                                "value": f"10.0.{i // 256}.{i % 256}",
+                            }
+                        ],
+                    }
+                ],
+            }
+
+    def _call(self):
+        with self.lock:
+            self.calls += 1
+        time.sleep(self.latency)
+
+    def list_tasks(self, cluster, family=None, startedBy=None, nextToken=None):
+        self._call()
+        arns = [
+            arn
+            for arn, task in self.tasks.items()
+            if startedBy is None or task["startedBy"] == startedBy
+        ]
+        start = int(nextToken or 0)
+        response = {"taskArns": arns[start : start + 100]}
+        if start + 100 < len(arns):
+            response["nextToken"] = str(start + 100)
+        return response
+
+    def describe_tasks(self, cluster, tasks):
+        if len(tasks) > 100:
+            raise ValueError("describe_tasks accepts at most 100 tasks")
+        self._call()
+        return {"tasks": [self.tasks[arn] for arn in tasks]}
+
+
+def legacy(fargate, job):
+    """The lookup of the status Lambda before the startedBy index"""
+    while fargate.has_tasks:
+        tasks = fargate.fetch_tasks(job.task_family, fargate.next_token)
+        if len(tasks) == 0:
+            return None
+        master_task = fargate.find_execution(tasks, job.task_name, job.execution_id)
+        if master_task is None and not fargate.has_tasks:
+            return None
+        if master_task:
+            return master_task
+    return None
+
+
+def measure(mode, count, latency, polls):
+    ecs = FakeECS(count, latency)
+    status._master_tasks.clear()
+    status._private_ips.clear()
+    timings = []
+    for _ in range(polls):
+        job = DistributedLocust(
+            {
+                "JobDetails": {
+                    "ClusterName": "cluster",
+                    "FamilyName": FAMILY,
+                    "MasterTaskName": FAMILY,
+                    "ExecutionId": EXECUTION_ID,
+                },
+                "Jobs": [],
+            }
+        )
+        fargate = Fargate("cluster", client=ecs)
+        start = time.perf_counter()
+        if mode == "legacy":
+            task = legacy(fargate, job)
+        elif mode == "scan":
+            task = status.scan_family(fargate, job)
+        else:
+            task = status.find_master(fargate, job)
+            status.cached_private_ip(job, task)
+        timings.append(time.perf_counter() - start)
+        assert task["startedBy"] == EXECUTION_ID
+    return {
+        "mode": mode,
+        "tasks": count,
+        "first_poll_ms": round(timings[0] * 1000, 1),
+        "next_polls_ms": round(sum(timings[1:]) * 1000 / max(polls - 1, 1), 1),
+        "api_calls": ecs.calls,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tasks", default="10,100,500,2000")
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--polls", type=int, default=3)
+    args = parser.parse_args()
+
+    for count in [int(x) for x in args.tasks.split(",")]:
+        for mode in ["legacy", "scan", "indexed"]:
+            print(json.dumps(measure(mode, count, args.latency, args.polls)))
+
+
+if __name__ == "__main__":
+    main()
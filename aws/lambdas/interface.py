@@ -1,17 +1,26 @@
+import json
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 import boto3
 
+DESCRIBE_BATCH_SIZE = 100
+DESCRIBE_CONCURRENCY = 8
+WORKER_BATCH_SIZE = 40
+
 
 class Fargate:
     """Interface to interact with Fargate tasks"""
 
     def __init__(
-        self, cluster, region_name=os.environ.get("AWS_REGION", "ap-southeast-1")
+        self,
+        cluster,
+        region_name=os.environ.get("AWS_REGION", "ap-southeast-1"),
+        client=None,
     ):
         """Initialize ECS client"""
         self.cluster = cluster
-        self.client = boto3.client("ecs", region_name=region_name)
+        self.client = client or boto3.client("ecs", region_name=region_name)
         self.has_tasks = True
         self.next_token = None
 
@@ -32,10 +41,35 @@ class Fargate:
         self.has_tasks = self.next_token is not None
         return response["taskArns"]
 
+    def fetch_started_by(self, started_by):
+        """Running tasks started with the given startedBy, the execution id set by the Step Function"""
+        arns = []
+        params = {"cluster": self.cluster, "startedBy": started_by}
+        while True:
+            response = self.client.list_tasks(**params)
+            arns += response["taskArns"]
+            if not response.get("nextToken"):
+                return arns
+            params["nextToken"] = response["nextToken"]
+
+    def describe(self, tasks):
+        """Describe tasks in batches of DESCRIBE_BATCH_SIZE (the API limit), concurrently"""
+        batches = [
+            tasks[i : i + DESCRIBE_BATCH_SIZE]
+            for i in range(0, len(tasks), DESCRIBE_BATCH_SIZE)
+        ]
+        if len(batches) <= 1:
+            return self._describe_batch(batches[0]) if batches else []
+        with ThreadPoolExecutor(min(len(batches), DESCRIBE_CONCURRENCY)) as executor:
+            results = executor.map(self._describe_batch, batches)
+            return [task for result in results for task in result]
+
+    def _describe_batch(self, tasks):
+        return self.client.describe_tasks(cluster=self.cluster, tasks=tasks)["tasks"]
+
     def find_execution(self, tasks, task_name, execution_id):
         """Describe all running tasks, and try to find the execution based on task name and execution id"""
-        descriptions = self.client.describe_tasks(cluster=self.cluster, tasks=tasks)
-        return self._filter(descriptions["tasks"], task_name, execution_id)
+        return self._filter(self.describe(tasks), task_name, execution_id)
 
     def _filter(self, tasks, task_name, execution_id):
         """Filter the tasks based on name and execution id"""
@@ -52,14 +86,66 @@ class Fargate:
 
     def _is_execution(self, task, execution_id):
         """Check if the execution id is the same as the one we're looking for"""
+        if task.get("startedBy") == execution_id:
+            return True
         for env_var in task["overrides"]["containerOverrides"][0]["environment"]:
             if env_var["name"] == "EXECUTION_ID" and env_var["value"] == execution_id:
                 return True
         return False
 
 
+class Registry:
+    """
+    Meeting point of the master node and the Step Function, under <prefix>/<execution_id>/ in S3.
+    The master writes master.json once it listens, the register Lambda writes the task token in token.json
+    """
+
+    def __init__(
+        self,
+        bucket,
+        execution_id,
+        prefix="_registry",
+        region_name=os.environ.get("AWS_REGION", "ap-southeast-1"),
+        s3=None,
+        sfn=None,
+    ):
+        self.bucket = bucket
+        self.prefix = f"{prefix.rstrip('/')}/{execution_id}"
+        self.s3 = s3 or boto3.client("s3", region_name=region_name)
+        self.sfn = sfn or boto3.client("stepfunctions", region_name=region_name)
+
+    def put(self, name, document):
+        self.s3.put_object(
+            Bucket=self.bucket, Key=f"{self.prefix}/{name}", Body=json.dumps(document)
+        )
+
+    def get(self, name):
+        """Document stored under name, None if not written yet"""
+        try:
+            obj = self.s3.get_object(Bucket=self.bucket, Key=f"{self.prefix}/{name}")
+        except self.s3.exceptions.NoSuchKey:
+            return None
+        return json.loads(obj["Body"].read())
+
+    def complete(self, token, master):
+        """Resume the Step Function with the master details. It may already be resumed by the master"""
+        try:
+            self.sfn.send_task_success(taskToken=token, output=json.dumps(master))
+        except (
+            self.sfn.exceptions.InvalidToken,
+            self.sfn.exceptions.TaskDoesNotExist,
+            self.sfn.exceptions.TaskTimedOut,
+        ) as e:
+            print("Registration already completed", e)
+
+
 class DistributedLocust:
-    """Interface for distributed locust"""
+    """
+    Interface for distributed locust.
+    Workers are either listed one by one in Jobs, or described once in WorkerTemplate with a WorkerCount
+    (and optional ShardOverrides by worker index). Templates are expanded by batches of WorkerBatchSize
+    inside the Step Function, so the event size does not depend on the number of workers
+    """
 
     def __init__(self, event):
         """Parse job event"""
@@ -69,24 +155,30 @@ class DistributedLocust:
         self.task_family = details["FamilyName"]
         self.task_name = details["MasterTaskName"]
         self.execution_id = details["ExecutionId"]
-        self.jobs = self.event["Jobs"]
+        self.jobs = self.event.get("Jobs", [])
 
     def failed(self):
         """Task is not running, must have crashed"""
         self.event["MasterStatus"] = "STOPPED"
         return self.event
 
-    def success(self, task):
+    def registered(self, master):
+        """The master announced itself through the registry, no lookup in ECS is needed"""
+        self.event["MasterStatus"] = master["MasterStatus"]
+        return self._configure_master(
+            master["MasterPrivateIp"],
+            master.get("MasterTaskArn"),
+            master.get("MasterPort"),
+        )
+
+    def success(self, task, private_ip=None):
         """Task is running and ready to access workers"""
         self.event["MasterStatus"] = task["lastStatus"]
-        self.event["MasterTaskArn"] = task["taskArn"]
-        self.event["MasterPrivateIp"] = self._extract_private_ip(task)
-        self.event["Jobs"] = self._configure_workers(
-            self.jobs, self.event["MasterPrivateIp"], self.event["MasterTaskArn"]
+        return self._configure_master(
+            private_ip or self.extract_private_ip(task), task["taskArn"]
         )
-        return self.event
 
-    def _extract_private_ip(self, task):
+    def extract_private_ip(self, task):
         """Extract IP address for workers to know how to connect to the master node"""
         for x in task["attachments"]:
             if x["type"] == "ElasticNetworkInterface":
@@ -95,9 +187,62 @@ class DistributedLocust:
                         return det["value"]
         return None
 
-    def _configure_workers(self, workers, ip_address, task_arn):
-        """Add the master node details to the worker nodes. They will be used to established the connection"""
-        params = ["--master-host", ip_address, "--fargate-task", task_arn]
+    def _configure_master(self, ip_address, task_arn, port=None):
+        self.event["MasterPrivateIp"] = ip_address
+        self.event["MasterTaskArn"] = task_arn
+        self.event["MasterPort"] = port
+        if "WorkerTemplate" in self.event:
+            self.event.setdefault("ShardOverrides", {})
+            size = int(self.event.setdefault("WorkerBatchSize", WORKER_BATCH_SIZE))
+            self.event["WorkerBatches"] = list(
+                range(0, int(self.event["WorkerCount"]), size)
+            )
+        else:
+            self.event["Jobs"] = self._configure_workers(
+                self.jobs, ip_address, task_arn, port
+            )
+        return self.event
+
+    def _configure_workers(self, workers, ip_address, task_arn, port=None):
+        """
+        Add the master node details to the worker nodes. They will be used to established the connection.
+        Each worker also gets its index and the total number of workers to select its dataset shard
+        """
         for i in range(len(workers)):
-            workers[i]["WorkerCommand"] += params
+            workers[i]["WorkerCommand"] += worker_params(
+                ip_address, task_arn, port, i, len(workers)
+            )
         return workers
+
+
+def worker_params(ip_address, task_arn, port, index, count):
+    """Command line parameters of a worker: master node details, index and number of workers"""
+    params = ["--master-host", ip_address]
+    if task_arn:
+        params += ["--fargate-task", task_arn]
+    if port:
+        params += ["--master-port", str(port)]
+    return params + ["--worker-index", str(index), "--worker-count", str(count)]
+
+
+def expand_workers(batch):
+    """
+    Jobs of the workers in a batch: a copy of the template with the overrides of the worker index
+    (top-level fields are replaced), and the worker parameters appended to its command
+    """
+    template = batch["WorkerTemplate"]
+    count = int(batch["WorkerCount"])
+    start = int(batch["BatchStart"])
+    overrides = batch.get("ShardOverrides") or {}
+    jobs = []
+    for index in range(start, min(start + int(batch["BatchSize"]), count)):
+        job = dict(template, **overrides.get(str(index), {}))
+        job["WorkerCommand"] = list(job["WorkerCommand"]) + worker_params(
+            batch["MasterPrivateIp"],
+            batch.get("MasterTaskArn"),
+            batch.get("MasterPort"),
+            index,
+            count,
+        )
+        jobs.append(job)
+    return jobs
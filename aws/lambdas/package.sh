@@ -1,7 +1,7 @@
 
 
 
-zip -r9 ../distributedlocust.zip . -x \*.git\* -x \*.pyc\* -x \*__pycache__\*
+zip -r9 ../distributedlocust.zip . -x \*.git\* -x \*.pyc\* -x \*__pycache__\* -x bench/\*
 
 cd ..
 
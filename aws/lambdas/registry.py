@@ -0,0 +1,23 @@
+import json
+
+from interface import Registry
+
+
+def handler(event, context):
+    """
+    Register the task token of the Step Function waiting for the master node.
+    The master completes it once it listens. If it already announced itself, complete it now
+    """
+
+    print("New event", json.dumps({k: v for k, v in event.items() if k != "TaskToken"}))
+
+    details = event["Registry"]
+    registry = Registry(
+        details["Bucket"], event["ExecutionId"], details.get("Prefix", "_registry")
+    )
+    registry.put("token.json", {"TaskToken": event["TaskToken"]})
+
+    master = registry.get("master.json")
+    if master:
+        registry.complete(event["TaskToken"], master)
+    return {"Registered": master is not None}
@@ -3,6 +3,11 @@ import json
 from interface import DistributedLocust
 from interface import Fargate
 
+# Kept between invocations of a warm Lambda, i.e. between the Step Function polls of an execution
+_clients = {}
+_master_tasks = {}
+_private_ips = {}
+
 
 def handler(event, context):
     """
@@ -11,66 +16,72 @@ def handler(event, context):
 
     print("New event", json.dumps(event))
 
+    registration = event.pop("Registration", None)
     job = DistributedLocust(event)
-    fargate = Fargate(job.cluster)
+    if registration:
+        return job.registered(registration)
 
-    while fargate.has_tasks:
-        tasks = fargate.fetch_tasks(job.task_family, fargate.next_token)
+    fargate = fargate_for(job.cluster)
+
+    master_task = find_master(fargate, job)
+    if master_task is None:
+        return job.failed()
+    return job.success(master_task, cached_private_ip(job, master_task))
+
+
+def fargate_for(cluster):
+    if cluster not in _clients:
+        _clients[cluster] = Fargate(cluster)
+    return _clients[cluster]
 
-        if len(tasks) == 0:
-            return job.failed()
 
+def find_master(fargate, job):
+    """
+    Find the master task of the execution. Once known, its ARN is described directly.
+    Otherwise the tasks started by the execution are listed, and only when there are none
+    (master started without startedBy) the task family is scanned
+    """
+    arn = _master_tasks.get(job.execution_id)
+    if arn:
+        tasks = fargate.describe([arn])
+        if tasks:
+            return tasks[0]
+
+    tasks = fargate.fetch_started_by(job.execution_id)
+    if tasks:
         master_task = fargate.find_execution(tasks, job.task_name, job.execution_id)
+    else:
+        master_task = scan_family(fargate, job)
+    if master_task:
+        _master_tasks[job.execution_id] = master_task["taskArn"]
+    return master_task
 
-        if master_task is None and not fargate.has_tasks:
-            return job.failed()
-
-        if master_task:
-            return job.success(master_task)
-
-    return None
-
-
-event = {
-    "JobDetails": {
-        "ExecutionId": "ab0e1f2da1e511eb8992d9ddf1fe3780",
-        "ClusterName": "mlops",
-        "TaskDefinition": "arn:aws:ecs:ap-southeast-1:908177370303:task-definition/distributed-locust-single-shape-load:1",
-        "AwsRegion": "ap-southeast-1",
-        "Subnets": ["subnet-55476b32", "subnet-7581dc3c"],
-        "SecurityGroups": ["sg-01044b90c2c0ad58e"],
-        "FamilyName": "distributed-locust-single-shape-load",
-        "MasterTaskName": "distributed-locust-single-shape-load",
-        "MasterCommand": [
-            "python3",
-            "app/main.py",
-            "--host",
-            "https://d2yme6kw9k.execute-api.ap-southeast-1.amazonaws.com/api",
-            "--method",
-            "/hello",
-            "--client-type",
-            "master",
-            "--expected-workers",
-            "1",
-            "--master-host",
-            "0.0.0.0",
-            "--shapes-bucket",
-            "mlops-configs-20210509172522",
-            "--shapes-key",
-            "jobs/2021-05-09/000001.json",
-            "--testdata-bucket",
-            "mlops-configs-20210509172522",
-            "--testdata-key",
-            "jobs/2021-05-09/sampledata.csv",
-            "--output-bucket",
-            "mlops-configs-20210509172522",
-            "--output-key",
-            "jobs/2021-05-09/output.json",
-        ],
-    },
-    "Jobs": [
-        {
-            "EndpointName": "loadtesting-dddd-0",
+
+def scan_family(fargate, job):
+    """List every running task of the family, then describe them in concurrent batches"""
+    tasks = []
+    fargate.has_tasks, fargate.next_token = True, None
+    while fargate.has_tasks:
+        tasks += fargate.fetch_tasks(job.task_family, fargate.next_token)
+    if len(tasks) == 0:
+        return None
+    return fargate.find_execution(tasks, job.task_name, job.execution_id)
+
+
+def cached_private_ip(job, task):
+    """The ENI of a task and its IP do not change once attached"""
+    arn = task["taskArn"]
+    if arn not in _private_ips:
+        ip = job.extract_private_ip(task)
+        if ip is None:
+            return None
+        _private_ips[arn] = ip
+    return _private_ips[arn]
+
+
+if __name__ == "__main__":
+    event = {
+        "JobDetails": {
             "ExecutionId": "ab0e1f2da1e511eb8992d9ddf1fe3780",
             "ClusterName": "mlops",
             "TaskDefinition": "arn:aws:ecs:ap-southeast-1:908177370303:task-definition/distributed-locust-single-shape-load:1",
@@ -78,8 +89,8 @@ event = {
             "Subnets": ["subnet-55476b32", "subnet-7581dc3c"],
             "SecurityGroups": ["sg-01044b90c2c0ad58e"],
             "FamilyName": "distributed-locust-single-shape-load",
-            "WorkerTaskName": "distributed-locust-single-shape-load",
-            "WorkerCommand": [
+            "MasterTaskName": "distributed-locust-single-shape-load",
+            "MasterCommand": [
                 "python3",
                 "app/main.py",
                 "--host",
@@ -87,7 +98,11 @@ event = {
                 "--method",
                 "/hello",
                 "--client-type",
-                "worker",
+                "master",
+                "--expected-workers",
+                "1",
+                "--master-host",
+                "0.0.0.0",
                 "--shapes-bucket",
                 "mlops-configs-20210509172522",
                 "--shapes-key",
@@ -96,8 +111,42 @@ event = {
                 "mlops-configs-20210509172522",
                 "--testdata-key",
                 "jobs/2021-05-09/sampledata.csv",
+                "--output-bucket",
+                "mlops-configs-20210509172522",
+                "--output-key",
+                "jobs/2021-05-09/output.json",
             ],
-        }
-    ],
-}
-print(handler(event, {}))
+        },
+        "Jobs": [
+            {
+                "EndpointName": "loadtesting-dddd-0",
+                "ExecutionId": "ab0e1f2da1e511eb8992d9ddf1fe3780",
+                "ClusterName": "mlops",
+                "TaskDefinition": "arn:aws:ecs:ap-southeast-1:908177370303:task-definition/distributed-locust-single-shape-load:1",
+                "AwsRegion": "ap-southeast-1",
+                "Subnets": ["subnet-55476b32", "subnet-7581dc3c"],
+                "SecurityGroups": ["sg-01044b90c2c0ad58e"],
+                "FamilyName": "distributed-locust-single-shape-load",
+                "WorkerTaskName": "distributed-locust-single-shape-load",
+                "WorkerCommand": [
+                    "python3",
+                    "app/main.py",
+                    "--host",
+                    "https://d2yme6kw9k.execute-api.ap-southeast-1.amazonaws.com/api",
+                    "--method",
+                    "/hello",
+                    "--client-type",
+                    "worker",
+                    "--shapes-bucket",
+                    "mlops-configs-20210509172522",
+                    "--shapes-key",
+                    "jobs/2021-05-09/000001.json",
+                    "--testdata-bucket",
+                    "mlops-configs-20210509172522",
+                    "--testdata-key",
+                    "jobs/2021-05-09/sampledata.csv",
+                ],
+            }
+        ],
+    }
+    print(handler(event, {}))
@@ -0,0 +1,62 @@
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+
+def task(arn, name="master", status="RUNNING", started_by=None, ip="10.0.0.1"):
+    return {
+        "taskArn": arn,
+        "lastStatus": status,
+        "startedBy": started_by,
+        "overrides": {"containerOverrides": [{"name": name, "environment": []}]},
+        "attachments": [
+            {
+                "type": "ElasticNetworkInterface",
+                "details": [{"name": "privateIPv4Address", "value": ip}],
+            }
+        ],
+    }
+
+
+class StubECS:
+    """The ECS calls of the Lambdas on in-memory tasks of one family, recording the calls"""
+
+    page_size = 100
+
+    def __init__(self):
+        self.tasks = {}
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def add(self, *tasks):
+        for t in tasks:
+            self.tasks[t["taskArn"]] = t
+
+    def list_tasks(self, cluster, family=None, startedBy=None, nextToken=None):
+        self.calls.append(("list_tasks", family or startedBy))
+        arns = [
+            arn
+            for arn, t in self.tasks.items()
+            if t["lastStatus"] != "STOPPED"
+            and (startedBy is None or t["startedBy"] == startedBy)
+        ]
+        start = int(nextToken or 0)
+        response = {"taskArns": arns[start : start + self.page_size]}
+        if start + self.page_size < len(arns):
+            response["nextToken"] = str(start + self.page_size)
+        return response
+
+    def describe_tasks(self, cluster, tasks):
+        assert len(tasks) <= 100
+        with self.lock:
+            self.calls.append(("describe_tasks", len(tasks)))
+        return {"tasks": [self.tasks[arn] for arn in tasks if arn in self.tasks]}
+
+
+@pytest.fixture
+def ecs():
+    return StubECS()
@@ -0,0 +1,33 @@
+from conftest import task
+from interface import Fargate
+
+
+def test_describe_splits_the_tasks_in_batches_of_100(ecs):
+    ecs.add(*[task(f"arn:{i}") for i in range(250)])
+    tasks = Fargate("cluster", client=ecs).describe(list(ecs.tasks))
+    assert [t["taskArn"] for t in tasks] == list(ecs.tasks)
+    assert sorted(size for call, size in ecs.calls) == [50, 100, 100]
+
+
+def test_describe_nothing(ecs):
+    assert Fargate("cluster", client=ecs).describe([]) == []
+    assert ecs.calls == []
+
+
+def test_fetch_started_by_follows_the_pages(ecs):
+    ecs.add(*[task(f"arn:{i}", started_by="exec") for i in range(150)])
+    ecs.add(task("arn:other", started_by="other"))
+    arns = Fargate("cluster", client=ecs).fetch_started_by("exec")
+    assert arns == [f"arn:{i}" for i in range(150)]
+    assert ecs.calls == [("list_tasks", "exec")] * 2
+
+
+def test_find_execution_by_started_by_or_environment(ecs):
+    by_env = task("arn:env")
+    by_env["overrides"]["containerOverrides"][0]["environment"] = [
+        {"name": "EXECUTION_ID", "value": "exec"}
+    ]
+    ecs.add(task("arn:worker", name="worker", started_by="exec"), by_env)
+    fargate = Fargate("cluster", client=ecs)
+    assert fargate.find_execution(list(ecs.tasks), "master", "exec") is by_env
+    assert fargate.find_execution(list(ecs.tasks), "master", "other") is None
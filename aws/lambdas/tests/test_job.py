@@ -0,0 +1,65 @@
+from interface import expand_workers
+
+TEMPLATE = {
+    "TaskDefinition": "locust-worker",
+    "WorkerCommand": ["--worker", "--processes", "2"],
+}
+
+
+def batch(start, size, count=5, **fields):
+    return dict(
+        {
+            "WorkerTemplate": TEMPLATE,
+            "WorkerCount": count,
+            "BatchStart": start,
+            "BatchSize": size,
+            "MasterPrivateIp": "10.0.0.1",
+        },
+        **fields
+    )
+
+
+def test_expand_workers_appends_the_worker_parameters():
+    jobs = expand_workers(batch(0, 2))
+    assert [job["WorkerCommand"] for job in jobs] == [
+        TEMPLATE["WorkerCommand"]
+        + ["--master-host", "10.0.0.1", "--worker-index", str(i), "--worker-count", "5"]
+        for i in range(2)
+    ]
+    assert all(job["TaskDefinition"] == "locust-worker" for job in jobs)
+    assert TEMPLATE["WorkerCommand"] == ["--worker", "--processes", "2"]
+
+
+def test_expand_workers_stops_at_the_worker_count():
+    jobs = expand_workers(batch(4, 50))
+    assert len(jobs) == 1
+    assert jobs[0]["WorkerCommand"][-4:] == [
+        "--worker-index",
+        "4",
+        "--worker-count",
+        "5",
+    ]
+    assert expand_workers(batch(5, 50)) == []
+
+
+def test_expand_workers_with_master_task_port_and_overrides():
+    jobs = expand_workers(
+        batch(
+            0,
+            2,
+            count=2,
+            MasterTaskArn="arn:task",
+            MasterPort=5557,
+            ShardOverrides={"1": {"TaskDefinition": "locust-worker-large"}},
+        )
+    )
+    assert jobs[0]["TaskDefinition"] == "locust-worker"
+    assert jobs[1]["TaskDefinition"] == "locust-worker-large"
+    assert jobs[1]["WorkerCommand"][3:9] == [
+        "--master-host",
+        "10.0.0.1",
+        "--fargate-task",
+        "arn:task",
+        "--master-port",
+        "5557",
+    ]
@@ -0,0 +1,81 @@
+import io
+import json
+
+import pytest
+
+import interface
+import registry
+
+
+class NoSuchKey(Exception):
+    pass
+
+
+class InvalidToken(Exception):
+    pass
+
+
+class FakeS3:
+    class exceptions:
+        NoSuchKey = NoSuchKey
+
+    def __init__(self):
+        self.objects = {}
+
+    def put_object(self, Bucket, Key, Body):
+        self.objects[Key] = Body
+
+    def get_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise NoSuchKey(Key)
+        return {"Body": io.BytesIO(self.objects[Key].encode())}
+
+
+class FakeStepFunctions:
+    """A token can be completed once"""
+
+    class exceptions:
+        InvalidToken = InvalidToken
+        TaskDoesNotExist = KeyError
+        TaskTimedOut = TimeoutError
+
+    def __init__(self):
+        self.outputs = {}
+
+    def send_task_success(self, taskToken, output):
+        if taskToken in self.outputs:
+            raise InvalidToken(taskToken)
+        self.outputs[taskToken] = json.loads(output)
+
+
+@pytest.fixture
+def clients(monkeypatch):
+    clients = {"s3": FakeS3(), "stepfunctions": FakeStepFunctions()}
+    monkeypatch.setattr(
+        interface.boto3, "client", lambda service, region_name=None: clients[service]
+    )
+    return clients
+
+
+EVENT = {"ExecutionId": "exec", "TaskToken": "token", "Registry": {"Bucket": "bucket"}}
+MASTER = {"MasterStatus": "RUNNING", "MasterPrivateIp": "10.0.0.5", "MasterPort": 5557}
+
+
+def test_token_first_is_left_to_the_master(clients):
+    assert registry.handler(dict(EVENT), {}) == {"Registered": False}
+    token = json.loads(clients["s3"].objects["_registry/exec/token.json"])
+    assert token == {"TaskToken": "token"}
+    assert clients["stepfunctions"].outputs == {}
+
+
+def test_master_first_is_completed_by_the_lambda(clients):
+    clients["s3"].put_object("bucket", "_registry/exec/master.json", json.dumps(MASTER))
+    assert registry.handler(dict(EVENT), {}) == {"Registered": True}
+    assert clients["stepfunctions"].outputs == {"token": MASTER}
+
+
+def test_token_already_completed_by_the_master(clients):
+    clients["s3"].put_object("bucket", "_registry/exec/master.json", json.dumps(MASTER))
+    clients["stepfunctions"].send_task_success(taskToken="token", output="{}")
+    assert registry.handler(dict(EVENT), {}) == {"Registered": True}
+    assert clients["stepfunctions"].outputs == {"token": {}}
@@ -0,0 +1,71 @@
+import pytest
+
+import status
+from conftest import task
+from interface import Fargate
+
+EVENT = {
+    "JobDetails": {
+        "ClusterName": "cluster",
+        "FamilyName": "locust",
+        "MasterTaskName": "master",
+        "ExecutionId": "exec",
+    },
+    "Jobs": [],
+}
+
+
+@pytest.fixture
+def fargate(ecs, monkeypatch):
+    fargate = Fargate("cluster", client=ecs)
+    monkeypatch.setattr(status, "_clients", {"cluster": fargate})
+    monkeypatch.setattr(status, "_master_tasks", {})
+    monkeypatch.setattr(status, "_private_ips", {})
+    return fargate
+
+
+def event():
+    return dict(EVENT, JobDetails=dict(EVENT["JobDetails"]), Jobs=[])
+
+
+def test_master_started_by_the_execution(ecs, fargate):
+    ecs.add(task("arn:master", started_by="exec", ip="10.0.0.9"))
+    ecs.add(*[task(f"arn:{i}") for i in range(300)])
+    result = status.handler(event(), {})
+    assert result["MasterStatus"] == "RUNNING"
+    assert result["MasterPrivateIp"] == "10.0.0.9"
+    assert ecs.calls == [("list_tasks", "exec"), ("describe_tasks", 1)]
+
+
+def test_family_is_scanned_without_started_by(ecs, fargate):
+    master = task("arn:master")
+    master["overrides"]["containerOverrides"][0]["environment"] = [
+        {"name": "EXECUTION_ID", "value": "exec"}
+    ]
+    ecs.add(*[task(f"arn:{i}", name="worker") for i in range(150)], master)
+    result = status.handler(event(), {})
+    assert result["MasterTaskArn"] == "arn:master"
+    assert ("list_tasks", "locust") in ecs.calls
+
+
+def test_known_master_is_described_directly(ecs, fargate):
+    ecs.add(task("arn:master", started_by="exec"))
+    status.handler(event(), {})
+    ecs.calls.clear()
+    assert status.handler(event(), {})["MasterTaskArn"] == "arn:master"
+    assert ecs.calls == [("describe_tasks", 1)]
+
+
+def test_known_master_stopped(ecs, fargate):
+    ecs.add(task("arn:master", started_by="exec"))
+    status.handler(event(), {})
+    ecs.tasks["arn:master"]["lastStatus"] = "STOPPED"
+    assert status.handler(event(), {})["MasterStatus"] == "STOPPED"
+    # Stopped tasks are eventually forgotten by ECS
+    del ecs.tasks["arn:master"]
+    assert status.handler(event(), {})["MasterStatus"] == "STOPPED"
+
+
+def test_no_master(ecs, fargate):
+    ecs.add(task("arn:worker", name="worker", started_by="exec"))
+    assert status.handler(event(), {})["MasterStatus"] == "STOPPED"
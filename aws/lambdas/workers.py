@@ -0,0 +1,12 @@
+from interface import expand_workers
+
+
+def handler(event, context):
+    """
+    Expand a batch of the worker template into the jobs started by the Step Function
+    """
+
+    start = event["BatchStart"]
+    print("Expanding workers", start, "to", start + event["BatchSize"])
+
+    return expand_workers(event)